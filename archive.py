@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from durability import group_commit
+
+
+# Members who leave a guild are taken out of its data, and kept with their
+# pairs in an archive until they come back. The 'leave' record carries what
+# is archived: the fields of the member (as in MemberTable.add, without the
+# id) and its pairs as [other id, wins, losses, sent, kind]. The 'return'
+# record carries the same for a member who rejoined, with only the pairs
+# whose other member is in the guild; the rest stay archived until the
+# other one comes back too.
+
+
+def archived_member(
+    member_id: int,
+    fields: list,
+    pairs: dict[tuple[int, int], list[int]]
+) -> dict:
+    '''The archive of a member, from its fields and the archived pairs'''
+    member_pairs = []
+    for (first, second), (first_wins, second_wins, sent, kind) in pairs.items():
+        if first == member_id:
+            member_pairs.append([second, first_wins, second_wins, sent, kind])
+        elif second == member_id:
+            member_pairs.append([first, second_wins, first_wins, -sent, kind])
+    return {'member': member_id, 'fields': fields, 'pairs': member_pairs}
+
+
+def pair_key(
+    member_id: int,
+    pair: list[int]
+) -> tuple[tuple[int, int], list[int]]:
+    '''An archived pair of the member, with the lower member id first'''
+    other_id, wins, losses, sent, kind = pair
+    if member_id < other_id:
+        return (member_id, other_id), [wins, losses, sent, kind]
+    return (other_id, member_id), [losses, wins, -sent, kind]
+
+
+class Archive:
+    '''
+    The archive of a guild as a log, <guild_id>.archive, of its 'leave' and
+    'return' records, one JSON record per line. Members leave and come back
+    rarely, so finding one replays the whole log.
+    '''
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def append(self, records: list[dict]) -> Optional[Future]:
+        lines = ''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records
+        )
+        with self._lock, open(self.filename, 'a') as archive_file:
+            archive_file.write(lines)
+        return group_commit.add(self)
+
+    def sync(self) -> None:
+        try:
+            fd = os.open(self.filename, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def find(self, member_id: int) -> Optional[dict]:
+        '''The archive of the member, or None if it is in the guild'''
+        try:
+            with self._lock, open(self.filename) as archive_file:
+                lines = archive_file.readlines()
+        except FileNotFoundError:
+            return None
+
+        fields = None
+        pairs: dict[tuple[int, int], list[int]] = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break # a torn write from a crash
+            leaving = record['op'] == 'leave'
+            if record['member'] == member_id:
+                fields = record['fields'] if leaving else None
+            for pair in record['pairs']:
+                key, values = pair_key(record['member'], pair)
+                if leaving:
+                    pairs[key] = values
+                else:
+                    pairs.pop(key, None)
+
+        if fields is None:
+            return None
+        return archived_member(member_id, fields, pairs)
@@ -0,0 +1,439 @@
+'''
+Behaviour checks run offline, to catch regressions before a deploy.
+
+    python -m benchmarks.checks [name ...]
+
+Each check builds what it needs in a temporary directory and asserts on the
+outcome. Prints one line per check and exits with 1 if any failed. Runs
+every check by default, or only the named ones.
+'''
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import traceback
+from concurrent.futures import Future
+from time import time
+from typing import Awaitable, Callable
+
+import ledger
+import outbox
+import scorefile
+from benchmarks.fakes import FakeBot, FakeChannel, FakeGuild, FakeInteraction
+from const import CACHE_BYTES
+from cooldowns import claims
+from durability import group_commit
+from errors import InvalidNameError
+from events import leave_record
+from locking import GuildLock, RWLock, locks
+from reshard import reshard
+from state import GuildState, store
+from storage import open_storage
+
+BACKENDS = ('json', 'binary', 'sqlite')
+
+CHECKS: dict[str, Callable[[], Awaitable[None]]] = {}
+
+
+def check(function: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+    CHECKS[function.__name__] = function
+    return function
+
+
+@check
+async def cogs_load() -> None:
+    '''The cogs load into a real Bot, so no command name or alias clashes'''
+    from bot import load, make_bot
+
+    bot = make_bot()
+    await load(bot)
+    for name in ('gamble', 'send', 'tournament', 'transfers', 'top', 'stats'):
+        assert bot.get_command(name) is not None, name
+    assert bot.get_command('t') is bot.get_command('transfers')
+
+
+@check
+async def sharded_append_waits() -> None:
+    '''A sharded storage hands back the group commit of the guild's shard'''
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ('json', 'binary', 'sqlite'):
+            storage = open_storage(backend, f'{tmp}/{backend}/', [0, 1], 2)
+            data = ledger.new_guild(1 << 22, 'guild')
+            storage.create(data)
+            record = {'op': 'gift', 'member': 1, 'amount': 0}
+            future = storage.append(data, [record])
+            if group_commit.mode == 'commit':
+                assert isinstance(future, Future), backend
+                future.result()
+            storage.close()
+
+
+@check
+async def reshard_keeps_guilds() -> None:
+    '''Unsharded guilds are refused by the sharded storage until moved'''
+    guild_ids = [n << 22 for n in range(1, 7)]
+    for backend in BACKENDS:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = tmp + '/'
+            storage = open_storage(backend, path)
+            for guild_id in guild_ids:
+                data = ledger.new_guild(guild_id, f'guild {guild_id}')
+                ledger.apply(data, {
+                    'op': 'join', 'member': 1, 'name': 'a', 'coins': 7, 'time': 0,
+                })
+                storage.create(data)
+                record = {'op': 'gift', 'member': 1, 'amount': guild_id >> 22}
+                ledger.apply(data, record)
+                data['journal_seq'] = record['seq'] = 1
+                storage.append(data, [record]) # left in the journal
+            storage.close()
+
+            try:
+                open_storage(backend, path, [0, 1], 2)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError(f'{backend}: unsharded guilds were not refused')
+
+            for shard_count in (2, 3, 1):
+                assert reshard(backend, path, shard_count) > 0, backend
+                assert reshard(backend, path, shard_count) == 0, backend
+                storage = open_storage(
+                    backend, path, list(range(shard_count)), shard_count
+                )
+                for guild_id in guild_ids:
+                    data = storage.load(guild_id)
+                    assert data is not None, (backend, shard_count, guild_id)
+                    coins = data['members'][1].coins
+                    assert coins == 7 + (guild_id >> 22), (backend, coins)
+                storage.close()
+
+
+@check
+async def leave_while_waiting() -> None:
+    '''A member who leaves while a command waits for the locks is not used'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 3)
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        gambler, opponent, _ = guild.members
+        state = await store.get(guild.id)
+        state.leaderboard # built, so apply keeps it up to date
+
+        async with locks[guild.id].write():
+            duel = asyncio.create_task(
+                bot.invoke(gambler, 'gamble', '5', opponent.display_name)
+            )
+            await asyncio.sleep(0) # resolved the opponent, waits for the locks
+            await state.apply(leave_record(state, opponent.id))
+
+        assert isinstance(await duel, InvalidNameError)
+        assert len(state.leaderboard) == len(state.members) == 2
+        channel = FakeChannel()
+        assert await bot.invoke(gambler, 'rank', channel=channel) is None
+        await bot.close()
+        assert channel.sent and ' of 2 ' in channel.sent[0], channel.sent
+
+
+@check
+async def cache_budget() -> None:
+    '''The cache counts what guilds grow into after they are loaded'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guilds = [FakeGuild(guild_id, f'guild {guild_id}', 20) for guild_id in (1, 2)]
+        bot = FakeBot(guilds)
+        await bot.start(tmp + '/')
+        first = await store.get(1)
+        loaded = first.nbytes
+        assert store.nbytes == sum(state.nbytes for state in store.guilds.values())
+
+        first.leaderboard
+        assert first.nbytes > loaded
+        members = guilds[0].members
+        await bot.invoke(members[0], 'gamble', '5', members[1].display_name)
+        assert store.nbytes == sum(state.nbytes for state in store.guilds.values())
+
+        # over the budget once the leaderboard of the second guild is built
+        second = await store.get(2)
+        store.budget = store.nbytes
+        second.leaderboard
+        await asyncio.sleep(0.1)
+        assert 1 not in store.guilds and 2 in store.guilds, list(store.guilds)
+        store.budget = CACHE_BYTES
+        await bot.close()
+
+
+@check
+async def claim_reminders() -> None:
+    '''Only reminders are scheduled, and unloading drops the moved ones'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 4)
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        for member in guild.members:
+            await bot.invoke(member, 'claim')
+        assert await store.evict(guild.id)
+        await store.get(guild.id)
+        assert not claims.heap, claims.heap
+
+        channel = FakeChannel()
+        member = guild.members[0]
+        await bot.invoke(member, 'remind', channel=channel)
+        assert len(claims) == 1 and len(claims.heap) == 1
+        claims.claimed(guild.id, member.id, int(time()) + 1)
+        assert len(claims.heap) == 2
+        assert await store.evict(guild.id)
+        assert len(claims) == 1 and len(claims.heap) == 1
+        await asyncio.sleep(1.5)
+        assert not claims
+        await bot.close()
+        assert channel.sent[-1].startswith(f'{member.display_name}, your reward is ready')
+
+
+@check
+async def top_fits_a_message() -> None:
+    '''$top 50 with long names is paged under the Discord message limit'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 60)
+        for member in guild.members:
+            member.display_name = member.name = member.name.rjust(35, 'x')
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        channel = FakeChannel()
+        assert await bot.invoke(guild.members[0], 'top', '50', channel=channel) is None
+        await bot.close()
+        assert channel.sent and len(channel.sent[0]) <= 2000, len(channel.sent[0])
+        assert channel.sent[0].startswith('Top 50 by coins:\n1. ')
+
+
+@check
+async def pages_after_unload() -> None:
+    '''Page buttons read the guild as loaded at the click, not at the command'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 30)
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        channel = FakeChannel()
+        await bot.invoke(guild.members[0], 'wallet', 'group', channel=channel)
+        await outbox.outbox.drain()
+        view, = channel.views
+        assert await store.evict(guild.id)
+
+        await view.next.callback(FakeInteraction(channel))
+        assert guild.id in store.guilds
+        assert channel.sent[-1].startswith('player20: '), channel.sent[-1]
+        await bot.close()
+
+
+@check
+async def rounds_or_member() -> None:
+    '''x<rounds> goes last, and a member named like it can still be dueled'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 2)
+        gambler, named = guild.members
+        named.display_name = named.name = 'x5'
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        channel = FakeChannel()
+        for args in (('10', 'x5'), ('10', 'x5', 'x3'), ('10', 'x3')):
+            assert await bot.invoke(gambler, 'gamble', *args, channel=channel) is None
+        error = await bot.invoke(gambler, 'gamble', '10', 'x3', 'x5', channel=channel)
+        assert isinstance(error, InvalidNameError), error
+        await bot.close()
+
+        duel, rounds_against, rounds_alone = channel.sent
+        assert duel.endswith(' won!'), duel
+        assert rounds_against.startswith('player0 vs x5: '), rounds_against
+        assert rounds_alone.startswith('player0 played 3 rounds'), rounds_alone
+
+
+@check
+async def admin_only() -> None:
+    '''The hidden admin commands do nothing for other members'''
+    with tempfile.TemporaryDirectory() as tmp:
+        guild = FakeGuild(1, 'guild', 2)
+        bot = FakeBot([guild])
+        await bot.start(tmp + '/')
+        for args in (('stats',), ('profile', '10'), ('specialgift', '5', 'player1')):
+            channel = FakeChannel()
+            assert await bot.invoke(guild.members[0], *args, channel=channel) is None
+            assert channel.sent == ['Nice try!'], (args, channel.sent)
+        await bot.close()
+
+
+def contents(state: GuildState) -> dict:
+    '''The guild data as plain JSON, without the journal position'''
+    raw = scorefile.encode(state.data)
+    raw.pop('journal_seq')
+    return json.loads(json.dumps(raw, sort_keys=True))
+
+
+async def crash(bot: FakeBot, path: str, backend: str) -> None:
+    '''Restarts the bot on the same files without flushing, as after a crash'''
+    store.storage.close()
+    await bot.start(path, backend)
+
+
+async def play(bot: FakeBot, guild: FakeGuild) -> None:
+    '''Duels and transfers between every pair of neighbours of the guild'''
+    members = guild.members
+    for first, second in zip(members, members[1:] + members[:1]):
+        assert await bot.invoke(first, 'gamble', '10', second.display_name) is None
+        assert await bot.invoke(first, 'send', '5', second.display_name) is None
+
+
+@check
+async def journal_replay() -> None:
+    '''A restart without a snapshot replays the journal into the same data'''
+    for backend in BACKENDS:
+        with tempfile.TemporaryDirectory() as tmp:
+            guild = FakeGuild(1, 'guild', 4)
+            bot = FakeBot([guild])
+            await bot.start(tmp + '/', backend)
+            await play(bot, guild)
+            before = contents(await store.get(guild.id))
+            if backend != 'sqlite':
+                assert store.storage.pending(guild.id) > 0, backend
+
+            await crash(bot, tmp + '/', backend)
+            assert contents(await store.get(guild.id)) == before, backend
+            await bot.close()
+
+
+@check
+async def compact_while_playing() -> None:
+    '''Commands go on while a snapshot is written, and their records are kept'''
+    for backend in BACKENDS:
+        with tempfile.TemporaryDirectory() as tmp:
+            guild = FakeGuild(1, 'guild', 4)
+            bot = FakeBot([guild])
+            await bot.start(tmp + '/', backend)
+            await play(bot, guild)
+            state = await store.get(guild.id)
+
+            writing = threading.Event()
+            written = threading.Event()
+            store_snapshot = store.storage.store_snapshot
+
+            def slow_store_snapshot(guild_id: int, copied: object) -> None:
+                writing.set()
+                written.wait(5)
+                store_snapshot(guild_id, copied)
+
+            store.storage.store_snapshot = slow_store_snapshot
+            compacting = asyncio.create_task(store.compact(state))
+            while not writing.is_set():
+                await asyncio.sleep(0.001)
+            await asyncio.wait_for(play(bot, guild), timeout=2)
+            written.set()
+            await compacting
+            assert state.dirty, backend
+            before = contents(state)
+
+            await crash(bot, tmp + '/', backend)
+            state = await store.get(guild.id)
+            assert contents(state) == before, backend
+
+            # a crash after the journal was rotated, before the snapshot
+            store.storage.snapshot(state.data)
+            await play(bot, guild)
+            before = contents(state)
+            await crash(bot, tmp + '/', backend)
+            assert contents(await store.get(guild.id)) == before, backend
+            await bot.close()
+
+
+@check
+async def leave_and_return() -> None:
+    '''A member who leaves and comes back gets their coins, stats and pairs back'''
+    for backend in BACKENDS:
+        with tempfile.TemporaryDirectory() as tmp:
+            guild = FakeGuild(1, 'guild', 4)
+            bot = FakeBot([guild])
+            await bot.start(tmp + '/', backend)
+            await play(bot, guild)
+            state = await store.get(guild.id)
+            before = contents(state)
+            leaving = guild.members[1]
+
+            guild.members.remove(leaving)
+            await bot.events.on_member_remove(leaving)
+            assert leaving.id not in state.members, backend
+            assert not list(state.pairs.partners(leaving.id)), backend
+            await crash(bot, tmp + '/', backend) # the archive is on disk
+            assert leaving.id not in (await store.get(guild.id)).members, backend
+
+            guild.members.append(leaving)
+            await bot.events.on_member_join(leaving)
+            assert contents(await store.get(guild.id)) == before, backend
+            await bot.close()
+
+
+@check
+async def lock_ordering() -> None:
+    '''Writers are not starved by readers, members in any order do not deadlock'''
+    lock = RWLock()
+    order = []
+
+    async def hold(name: str, acquire, seconds: float) -> None:
+        async with acquire():
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    tasks = [asyncio.create_task(hold('reader 1', lock.read, 0.02))]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(hold('writer', lock.write, 0)))
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(hold('reader 2', lock.read, 0)))
+    await asyncio.gather(*tasks)
+    # the later reader waits behind the waiting writer
+    assert order == ['reader 1', 'writer', 'reader 2'], order
+    assert lock.idle
+
+    guild_lock = GuildLock()
+    running = 0
+    most = 0
+
+    async def transaction(*member_ids: int) -> None:
+        nonlocal running, most
+        async with guild_lock.members(*member_ids):
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    # opposite orders over shared members would deadlock without the
+    # ascending id order, disjoint members run together
+    await asyncio.wait_for(asyncio.gather(
+        transaction(1, 2), transaction(2, 1), transaction(3, 4), transaction(4, 3)
+    ), timeout=5)
+    assert most == 2, most
+    assert guild_lock.idle
+
+    # an event holding the guild waits for the transactions, and they for it
+    async with guild_lock.write():
+        waiting = asyncio.create_task(transaction(5))
+        await asyncio.sleep(0.02)
+        assert not waiting.done()
+    await waiting
+    assert guild_lock.idle
+
+
+def main(names: list[str]) -> None:
+    failed = 0
+    for name in names or CHECKS:
+        try:
+            asyncio.run(CHECKS[name]())
+        except Exception:
+            failed += 1
+            print(f'FAIL {name}')
+            traceback.print_exc()
+        else:
+            print(f'ok   {name}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+'''
+In-process stand-ins for the Discord objects the cogs use, so that the
+Action, Display and event cogs can run without a connection:
+
+    bot = FakeBot([FakeGuild(1, 'guild', 100)])
+    await bot.start(tmp_path)
+    await bot.invoke(bot.guilds[0].members[0], 'gamble', '10')
+
+Replies go through the outbox as usual and end up in FakeChannel.sent, and
+their page buttons in FakeChannel.views, to be clicked with a FakeInteraction.
+'''
+from __future__ import annotations
+
+import itertools
+import os
+from typing import Any, Optional
+
+from discord.ext import commands
+
+import outbox
+from commands import Action, Display
+from cooldowns import claims
+from events import BotEvents, BotStartEvents, CommandEvents
+from metrics import after_command, before_command, metrics
+from monitor import loop_lag
+from state import store
+from storage import open_storage
+
+FIRST_ID = 10 ** 17 # member ids are snowflakes of 18 digits
+
+_channel_ids = itertools.count(1)
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.id = next(_channel_ids)
+        self.sent: list[str] = []
+        self.views: list[Any] = []
+
+    async def send(self, content: str, view: Any = None) -> None:
+        self.sent.append(content)
+        if view is not None:
+            self.views.append(view)
+
+
+class FakeInteraction:
+    '''A button click, the edited message ends up in channel.sent'''
+
+    def __init__(self, channel: FakeChannel) -> None:
+        self.channel = channel
+        self.response = self
+
+    async def edit_message(self, content: str, view: Any = None) -> None:
+        await self.channel.send(content)
+
+
+class FakeMember:
+    def __init__(
+        self,
+        member_id: int,
+        display_name: str,
+        guild: FakeGuild,
+        bot: bool = False
+    ) -> None:
+        self.id = member_id
+        self.name = display_name
+        self.display_name = display_name
+        self.guild = guild
+        self.bot = bot
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str, size: int) -> None:
+        self.id = guild_id
+        self.name = name
+        self.system_channel = FakeChannel()
+        self.members = [
+            FakeMember(FIRST_ID + guild_id * 10 ** 7 + n, f'player{n}', self)
+            for n in range(size)
+        ]
+        self._by_id = {member.id: member for member in self.members}
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self._by_id.get(member_id)
+
+
+class FakeContext:
+    def __init__(
+        self,
+        bot: FakeBot,
+        author: FakeMember,
+        channel: Optional[FakeChannel] = None
+    ) -> None:
+        self.bot = bot
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel or FakeChannel()
+        self.message = None
+        self.command: Optional[commands.Command] = None
+
+    async def invoke(self, command: commands.Command, *args, **kwargs) -> None:
+        await command.callback(self.bot.cogs[command.name], self, *args, **kwargs)
+
+
+class FakeBot:
+    '''
+    Holds the cogs and dispatches commands and events to them the way the
+    discord.py Bot does, including the command errors to on_command_error.
+    '''
+
+    def __init__(self, guilds: list[FakeGuild]) -> None:
+        self.guilds = guilds
+        self.start_events = BotStartEvents(self)
+        self.events = BotEvents(self)
+        self.command_events = CommandEvents(self)
+        self.commands: dict[str, commands.Command] = {}
+        self.cogs: dict[str, commands.Cog] = {}
+        for cog in (Action(self), Display(self)):
+            for command in cog.get_commands():
+                for name in (command.name, *command.aliases):
+                    # like Bot.add_command, rather than shadow a command
+                    if name in self.commands:
+                        raise commands.CommandRegistrationError(
+                            name, alias_conflict=name != command.name
+                        )
+                    self.commands[name] = command
+                    self.cogs[name] = cog
+
+    def get_command(self, name: str) -> Optional[commands.Command]:
+        return self.commands.get(name)
+
+    async def start(
+        self,
+        path: str,
+        backend: str = 'json',
+        shard_ids: Optional[list[int]] = None,
+        shard_count: int = 1
+    ) -> None:
+        '''
+        Points the store at a fresh storage under path, partitioned like a
+        launcher.py worker with shard_ids, lets the outbox send without
+        pacing, and runs on_ready
+        '''
+        os.makedirs(path, exist_ok=True)
+        store.storage = open_storage(backend, path, shard_ids, shard_count)
+        store.guilds.clear()
+        store._sizes.clear()
+        store.nbytes = 0
+        outbox.outbox.period = 0
+        await self.start_events.on_ready()
+
+    async def invoke(
+        self,
+        author: FakeMember,
+        name: str,
+        *args: str,
+        channel: Optional[FakeChannel] = None
+    ) -> Optional[Exception]:
+        '''Runs a command, returns the command error it raised, if any'''
+        ctx = FakeContext(self, author, channel)
+        ctx.command = self.commands[name]
+        try:
+            await before_command(ctx)
+            try:
+                await ctx.command.callback(self.cogs[name], ctx, *args)
+            finally:
+                await after_command(ctx)
+        except commands.CommandError as error:
+            await self.command_events.on_command_error(ctx, error)
+            return error
+        return None
+
+    async def close(self) -> None:
+        loop_lag.stop()
+        metrics.stop()
+        claims.stop()
+        await outbox.outbox.drain()
+        await store.close()
@@ -0,0 +1,116 @@
+'''
+Fires concurrent simulated commands at the cogs, offline, through the fakes.
+
+    python -m benchmarks.load [members ...]
+
+For each guild size, starts the bot on a fresh storage in a temporary
+directory, then runs COMMANDS random $gamble, $send, $claim and $wallet
+invocations, at most CONCURRENCY at a time, spread over the members of the
+guild. Reports the throughput, the p50/p99 latency of each command, and
+where their time went as in $stats. Defaults to guilds of 100, 1000 and
+10k members. Set STORAGE_BACKEND to compare the backends.
+'''
+from __future__ import annotations
+
+import asyncio
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks.fakes import FakeBot, FakeChannel, FakeGuild, FakeMember
+from const import STORAGE_BACKEND
+from metrics import metrics
+
+COMMANDS = 5000
+CONCURRENCY = 500
+CHANNELS = 20 # channels the commands are spread over
+
+# share of each command in the workload
+MIX = {'gamble': 0.4, 'duel': 0.1, 'send': 0.15, 'claim': 0.05, 'wallet': 0.3}
+
+
+def make_workload(
+    guild: FakeGuild,
+    count: int
+) -> list[tuple[str, FakeMember, tuple[str, ...]]]:
+    rng = random.Random(len(guild.members))
+    kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=count)
+    workload = []
+    for kind in kinds:
+        author, other = rng.sample(guild.members, 2)
+        if kind == 'gamble':
+            workload.append(('gamble', author, (str(rng.randint(1, 20)),)))
+        elif kind == 'duel':
+            workload.append(
+                ('gamble', author, (str(rng.randint(1, 20)), other.display_name))
+            )
+        elif kind == 'send':
+            workload.append(
+                ('send', author, (str(rng.randint(1, 20)), other.display_name))
+            )
+        elif kind == 'claim':
+            workload.append(('claim', author, ()))
+        else:
+            workload.append(('wallet', author, (other.display_name,)))
+    return workload
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(size: int, path: str) -> None:
+    guild = FakeGuild(size, f'guild {size}', size)
+    bot = FakeBot([guild])
+    await bot.start(path, STORAGE_BACKEND)
+    metrics.reset()
+
+    channels = [FakeChannel() for _ in range(CHANNELS)]
+    workload = make_workload(guild, COMMANDS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies: dict[str, list[float]] = {}
+    errors = 0
+
+    async def invoke(n: int, name: str, author: FakeMember, args: tuple) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            error = await bot.invoke(
+                author, name, *args, channel=channels[n % CHANNELS]
+            )
+            latencies.setdefault(name, []).append(perf_counter() - start)
+            if error is not None:
+                errors += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(
+        invoke(n, name, author, args)
+        for n, (name, author, args) in enumerate(workload)
+    ))
+    total = perf_counter() - start
+    await bot.close()
+
+    print(
+        f'{size} members, {STORAGE_BACKEND}: {COMMANDS} commands in '
+        f'{total:.2f} s, {COMMANDS / total:.0f}/s, {errors} errors'
+    )
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        print(
+            f'  {name:8} {len(values):6} calls  '
+            f'p50 {percentile(values, 0.5) * 1000:7.2f} ms  '
+            f'p99 {percentile(values, 0.99) * 1000:7.2f} ms'
+        )
+    for line in metrics.summary(guild.id).splitlines():
+        print(f'  {line}')
+
+
+def main(sizes: list[int]) -> None:
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(run(size, tmp + '/'))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10_000])
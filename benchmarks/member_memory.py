@@ -0,0 +1,119 @@
+'''
+Compares the members of a guild as OrderedDicts (the score_file layout) and
+as a MemberTable.
+
+    python -m benchmarks.member_memory [members ...]
+
+Reports the memory of both layouts, the time to look up a member and read
+its four stats, to update one stat, and to sum a stat over the whole guild.
+Defaults to guilds of 100k and 1M members.
+'''
+from __future__ import annotations
+
+import gc
+import random
+import sys
+import tracemalloc
+from collections import OrderedDict
+from time import perf_counter
+
+from members import MemberTable
+
+ACCESSES = 200_000
+FIRST_ID = 10 ** 17 # member ids are snowflakes of 18 digits
+
+
+def build_dicts(size: int) -> dict:
+    members = {}
+    for n in range(size):
+        member_data = OrderedDict()
+        member_data['id'] = FIRST_ID + n
+        member_data['display_name'] = f'member{n}'
+        member_data['coins'] = 500 + n % 1000
+        member_data['wins'] = n % 50
+        member_data['losses'] = n % 40
+        member_data['transfers'] = n % 300 - 150
+        member_data['last_claimed'] = 946737045
+        members[str(FIRST_ID + n)] = member_data
+    return members
+
+
+def build_table(size: int) -> MemberTable:
+    table = MemberTable()
+    for n in range(size):
+        table.add(
+            FIRST_ID + n, f'member{n}', 500 + n % 1000, n % 50, n % 40,
+            n % 300 - 150, 946737045
+        )
+    return table
+
+
+def measure(build, size: int) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    built = build(size)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, used
+
+
+def per_access(func, ids: list[int]) -> float:
+    start = perf_counter()
+    func(ids)
+    return (perf_counter() - start) / len(ids)
+
+
+def bench(size: int) -> None:
+    ids = random.Random(size).choices(range(FIRST_ID, FIRST_ID + size), k=ACCESSES)
+
+    def dict_read(ids):
+        for member_id in ids:
+            member = members[str(member_id)]
+            member['coins'], member['wins'], member['losses'], member['transfers']
+
+    def dict_update(ids):
+        for member_id in ids:
+            members[str(member_id)]['coins'] += 1
+
+    def table_read(ids):
+        for member_id in ids:
+            member = table[member_id]
+            member.coins, member.wins, member.losses, member.transfers
+
+    def table_update(ids):
+        for member_id in ids:
+            table[member_id].coins += 1
+
+    members, dict_size = measure(build_dicts, size)
+    dict_times = (per_access(dict_read, ids), per_access(dict_update, ids))
+    start = perf_counter()
+    sum(member['coins'] for member in members.values())
+    dict_sum = perf_counter() - start
+    del members
+
+    table, table_size = measure(build_table, size)
+    table_times = (per_access(table_read, ids), per_access(table_update, ids))
+    start = perf_counter()
+    sum(table.column('coins'))
+    table_sum = perf_counter() - start
+    del table
+
+    print(f'{size:,} members')
+    for label, used, (read, update), total in (
+        ('OrderedDict', dict_size, dict_times, dict_sum),
+        ('MemberTable', table_size, table_times, table_sum),
+    ):
+        print(
+            f'  {label}: {used / 2**20:7.1f} MiB ({used / size:.0f} B/member), '
+            f'read {read * 1e9:.0f} ns, update {update * 1e9:.0f} ns, '
+            f'sum coins {total * 1000:.1f} ms'
+        )
+
+
+def main(sizes: list[int]) -> None:
+    for size in sizes:
+        bench(size)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000])
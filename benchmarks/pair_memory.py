@@ -0,0 +1,124 @@
+'''
+Compares the memory of the pairwise stats as per-member dicts (the
+score_file layout) and as a PairTable.
+
+    python -m benchmarks.pair_memory [pairs ...]
+
+Each active pair has dueled and sent coins, and every member has about 20
+partners. Reports the memory of both layouts, and the time of a pair lookup
+and of listing the pairs of one member. Defaults to 10k and 1M pairs.
+'''
+from __future__ import annotations
+
+import gc
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+from pairs import PairTable
+
+LOOKUPS = 100_000
+FIRST_ID = 10 ** 17 # member ids are snowflakes of 18 digits
+
+
+def make_pairs(count: int) -> list[tuple[int, int]]:
+    rng = random.Random(count)
+    size = max(count // 10, 100)
+    pairs = set()
+    while len(pairs) < count:
+        first, second = rng.sample(range(size), 2)
+        pairs.add((FIRST_ID + min(first, second), FIRST_ID + max(first, second)))
+    return list(pairs)
+
+
+def build_dicts(pairs: list[tuple[int, int]]) -> dict:
+    members = {}
+    for first, second in pairs:
+        for member_id, other_id, amount in (
+            (first, second, 5),
+            (second, first, -5),
+        ):
+            member = members.setdefault(str(member_id), {
+                'wins_per_mem': {},
+                'losses_per_mem': {},
+                'transfers_per_mem': {},
+            })
+            # separate key objects, as json.load creates them
+            member['wins_per_mem' if amount > 0 else 'losses_per_mem'][
+                str(other_id)] = 1
+            member['transfers_per_mem'][str(other_id)] = amount
+    return members
+
+
+def build_table(pairs: list[tuple[int, int]]) -> PairTable:
+    table = PairTable()
+    for first, second in pairs:
+        table.add_win(first, second)
+        table.add_transfer(first, second, 5)
+    return table
+
+
+def measure(build, pairs: list[tuple[int, int]]) -> tuple[object, int, float]:
+    gc.collect()
+    tracemalloc.start()
+    start = perf_counter()
+    built = build(pairs)
+    took = perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, size, took
+
+
+def time_lookups(lookup, pairs: list[tuple[int, int]]) -> float:
+    sample = random.Random(0).choices(pairs, k=LOOKUPS)
+    start = perf_counter()
+    for first, second in sample:
+        lookup(first, second)
+    return (perf_counter() - start) / LOOKUPS
+
+
+def bench(count: int) -> None:
+    pairs = make_pairs(count)
+    member_id = pairs[0][0]
+
+    members, dict_size, dict_build = measure(build_dicts, pairs)
+    dict_lookup = time_lookups(
+        lambda first, second: (
+            members[str(first)]['wins_per_mem'].get(str(second)),
+            members[str(first)]['losses_per_mem'].get(str(second)),
+        ),
+        pairs
+    )
+    start = perf_counter()
+    list(members[str(member_id)]['transfers_per_mem'].items())
+    dict_group = perf_counter() - start
+    del members
+
+    table, table_size, table_build = measure(build_table, pairs)
+    table_lookup = time_lookups(table.score, pairs)
+    start = perf_counter()
+    list(table.transfers(member_id))
+    table_group = perf_counter() - start
+    del table
+
+    print(f'{count:,} pairs')
+    print(
+        f'  dicts:     {dict_size / 2**20:8.1f} MiB '
+        f'({dict_size / count:.0f} B/pair), build {dict_build:.2f} s, '
+        f'lookup {dict_lookup * 1e6:.2f} us, group {dict_group * 1e6:.1f} us'
+    )
+    print(
+        f'  PairTable: {table_size / 2**20:8.1f} MiB '
+        f'({table_size / count:.0f} B/pair), build {table_build:.2f} s, '
+        f'lookup {table_lookup * 1e6:.2f} us, group {table_group * 1e6:.1f} us'
+    )
+
+
+def main(counts: list[int]) -> None:
+    for count in counts:
+        bench(count)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 1_000_000])
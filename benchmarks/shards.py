@@ -0,0 +1,146 @@
+'''
+Runs the load benchmark on several worker processes at once, the way
+launcher.py splits the shards over its workers, to see how the throughput
+scales with the number of workers.
+
+    python -m benchmarks.shards [workers ...]
+
+GUILDS guilds of MEMBERS members are spread over SHARDS shards. For each
+worker count, every worker process gets its shards as in launcher.py,
+starts the bot on their guilds only, with the storage partitioned by shard
+in a temporary directory, and then all of them run COMMANDS_PER_GUILD
+commands on each of their guilds together. Reports the total throughput
+and the speedup over a single worker. Defaults to 1, 2 and 4 workers; the
+speedup is bounded by the number of cores.
+'''
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+from time import perf_counter
+
+from const import STORAGE_BACKEND
+from launcher import shards_of
+from storage import shard_of
+
+SHARDS = 8
+GUILDS = 16
+MEMBERS = 1000
+COMMANDS_PER_GUILD = 2000
+CONCURRENCY = 500 # per worker
+
+
+def guild_ids() -> list[int]:
+    # the shard of a guild is taken from the upper bits of its id
+    return [n << 22 for n in range(1, GUILDS + 1)]
+
+
+async def run_worker(
+    shard_ids: list[int],
+    path: str,
+    ready: multiprocessing.Barrier
+) -> tuple[int, float]:
+    from benchmarks.fakes import FakeBot, FakeChannel, FakeGuild
+    from benchmarks.load import make_workload
+
+    guilds = [
+        FakeGuild(guild_id, f'guild {guild_id >> 22}', MEMBERS)
+        for guild_id in guild_ids() if shard_of(guild_id, SHARDS) in shard_ids
+    ]
+    bot = FakeBot(guilds)
+    await bot.start(path, STORAGE_BACKEND, shard_ids, SHARDS)
+    channel = FakeChannel()
+    workload = [
+        command for guild in guilds
+        for command in make_workload(guild, COMMANDS_PER_GUILD)
+    ]
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def invoke(name: str, author: object, args: tuple) -> None:
+        async with semaphore:
+            await bot.invoke(author, name, *args, channel=channel)
+
+    ready.wait()
+    start = perf_counter()
+    await asyncio.gather(*(invoke(*command) for command in workload))
+    took = perf_counter() - start
+    await bot.close()
+    return len(workload), took
+
+
+def worker_main(
+    shard_ids: list[int],
+    path: str,
+    ready: multiprocessing.Barrier,
+    results: multiprocessing.Queue
+) -> None:
+    # the bot prints as it starts, only the results matter here
+    sys.stdout = open(os.devnull, 'w')
+    results.put(asyncio.run(run_worker(shard_ids, path, ready)))
+
+
+def collect(
+    processes: list[multiprocessing.Process],
+    results: multiprocessing.Queue
+) -> list[tuple[int, float]]:
+    '''The result of every worker, raises once one of them failed'''
+    outcomes = []
+    while len(outcomes) < len(processes):
+        try:
+            outcomes.append(results.get(timeout=1))
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(
+                        f'{process.name} exited with code {process.exitcode}'
+                    )
+    return outcomes
+
+
+def run(workers: int) -> float:
+    context = multiprocessing.get_context('spawn')
+    ready = context.Barrier(workers)
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = [
+            context.Process(
+                target=worker_main,
+                args=(shards_of(worker, workers, SHARDS), tmp + '/', ready, results)
+            )
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            outcomes = collect(processes, results)
+        finally:
+            # the others wait on the barrier forever once a worker crashed
+            for process in processes:
+                process.terminate()
+                process.join()
+
+    commands = sum(count for count, _ in outcomes)
+    took = max(took for _, took in outcomes)
+    throughput = commands / took
+    print(
+        f'{workers} workers, {STORAGE_BACKEND}: {commands} commands in '
+        f'{took:.2f} s, {throughput:.0f}/s'
+    )
+    return throughput
+
+
+def main(worker_counts: list[int]) -> None:
+    print(f'{GUILDS} guilds of {MEMBERS} members over {SHARDS} shards, {os.cpu_count()} cores')
+    base = None
+    for workers in worker_counts:
+        throughput = run(workers)
+        base = base or throughput
+        print(f'  speedup {throughput / base:.2f}x')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1, 2, 4])
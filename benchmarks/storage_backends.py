@@ -0,0 +1,122 @@
+'''
+Compares the JSON, binary and SQLite storage backends on synthetic guilds.
+
+    python -m benchmarks.storage_backends [members ...]
+
+For each guild size, reports the time to create the guild, to load it cold,
+to persist one transaction, and to take a full snapshot, plus the bytes on
+disk. Defaults to guilds of 100, 10k and 100k members.
+'''
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+from collections import OrderedDict
+from time import perf_counter
+
+import ledger
+import scorefile
+from storage import open_storage
+
+TRANSACTIONS = 2000
+
+
+def make_guild(guild_id: int, size: int) -> OrderedDict:
+    data = ledger.new_guild(guild_id, f'guild {size}')
+    for member_id in range(1, size + 1):
+        ledger.apply(data, {
+            'op': 'join',
+            'member': member_id,
+            'name': f'member{member_id}',
+            'coins': 500,
+            'time': 946737045,
+        })
+    return data
+
+
+def make_records(size: int, count: int) -> list[dict]:
+    rng = random.Random(size)
+    records = []
+    for _ in range(count):
+        first, second = rng.sample(range(1, size + 1), 2)
+        kind = rng.choice(('gamble', 'duel', 'send'))
+        if kind == 'gamble':
+            records.append({
+                'op': 'gamble', 'member': first, 'bet': 1, 'won': rng.random() < .5
+            })
+        elif kind == 'duel':
+            records.append({
+                'op': 'duel', 'winner': first, 'loser': second, 'bet': 1
+            })
+        else:
+            records.append({
+                'op': 'send', 'sender': first, 'receiver': second, 'amount': 1
+            })
+    return records
+
+
+def disk_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+    )
+
+
+def bench(backend: str, size: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + os.sep
+        data = make_guild(1, size)
+        records = make_records(size, TRANSACTIONS)
+        storage = open_storage(backend, path)
+
+        start = perf_counter()
+        storage.create(data)
+        create = perf_counter() - start
+
+        start = perf_counter()
+        for record in records:
+            ledger.apply(data, record)
+            data['journal_seq'] += 1
+            record['seq'] = data['journal_seq']
+            storage.append(data, [record])
+        append = (perf_counter() - start) / len(records)
+
+        start = perf_counter()
+        storage.compact(data)
+        compact = perf_counter() - start
+        storage.close()
+
+        storage = open_storage(backend, path)
+        start = perf_counter()
+        loaded = storage.load(1)
+        load = perf_counter() - start
+        storage.close()
+        assert scorefile.encode(loaded) == scorefile.encode(data)
+
+        return {
+            'create': create,
+            'load': load,
+            'append': append,
+            'compact': compact,
+            'disk': disk_size(tmp),
+        }
+
+
+def main(sizes: list[int]) -> None:
+    print(
+        f'{"backend":<8}{"members":>9}{"create ms":>12}{"load ms":>10}'
+        f'{"append us":>11}{"compact ms":>12}{"disk KiB":>10}'
+    )
+    for size in sizes:
+        for backend in ('json', 'binary', 'sqlite'):
+            result = bench(backend, size)
+            print(
+                f'{backend:<8}{size:>9}{result["create"] * 1e3:>12.1f}'
+                f'{result["load"] * 1e3:>10.1f}{result["append"] * 1e6:>11.1f}'
+                f'{result["compact"] * 1e3:>12.1f}{result["disk"] / 1024:>10.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 10_000, 100_000])
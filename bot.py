@@ -1,36 +1,73 @@
 from __future__ import annotations
 
 import asyncio
+from typing import Optional
+
 import discord
 from discord.ext import commands
 from discord.ext.commands import HelpCommand
 
-from const import COMMAND_PREFIX
-from private import TOKEN
+from const import COMMAND_PREFIX, PATH, STORAGE_BACKEND
 from events import BotEvents, BotStartEvents, CommandEvents, locks
 from commands import Action, Display
 from help import CustomHelp
+from metrics import after_command, before_command
+from state import store
+from storage import open_storage
+
+
+def make_bot(
+    shard_ids: Optional[list[int]] = None,
+    shard_count: Optional[int] = None
+) -> commands.Bot:
+    '''
+    The bot of a single process, or with shard_ids, the bot of a worker of
+    launcher.py that runs only those shards out of shard_count
+    '''
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+    options = dict(
+        command_prefix=COMMAND_PREFIX,
+        intents=intents,
+        case_insensitive=True
+    )
+    if shard_ids is None:
+        bot = commands.Bot(**options)
+    else:
+        bot = commands.AutoShardedBot(
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            **options
+        )
+    bot.help_command = CustomHelp()
+    bot.before_invoke(before_command)
+    bot.after_invoke(after_command)
+    return bot
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-bot = commands.Bot(
-    command_prefix=COMMAND_PREFIX,
-    intents=intents,
-    case_insensitive=True
-)
-bot.help_command = CustomHelp()
-
-async def load():
+async def load(bot: commands.Bot):
     await bot.add_cog(BotEvents(bot))
     await bot.add_cog(BotStartEvents(bot))
     await bot.add_cog(CommandEvents(bot))
     await bot.add_cog(Action(bot))
     await bot.add_cog(Display(bot))
 
-async def main():
-    await load()
-    await bot.start(TOKEN)
+async def main(
+    shard_ids: Optional[list[int]] = None,
+    shard_count: Optional[int] = None
+):
+    from private import TOKEN # only needed to log in, not to build the bot
+    if shard_ids is not None:
+        # the guilds of these shards only, the other workers have the rest
+        store.storage.close()
+        store.storage = open_storage(STORAGE_BACKEND, PATH, shard_ids, shard_count)
+    bot = make_bot(shard_ids, shard_count)
+    await load(bot)
+    try:
+        await bot.start(TOKEN)
+    finally:
+        # write the remaining dirty guild data before exiting
+        await store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,34 +1,57 @@
 from __future__ import annotations
 
-import json
-import os
 import asyncio
-from time import localtime, strptime, strftime, mktime
-from collections import OrderedDict
-from random import randint, choice
+import re
+from concurrent.futures import Future
+from itertools import islice
+from time import time
+from random import random, randrange, shuffle
 from typing import TYPE_CHECKING, Optional
 
 import discord # pip install discord
 from discord.ext import commands
 from discord.guild import Guild
-from discord.member import Member
 from discord.ext.commands.bot import Bot
 from discord.ext.commands.context import Context
 
-from const import INITIAL_COINS, MIN_REWARD, MAX_REWARD, PATH, COMMAND_PREFIX
+from const import (
+    INITIAL_COINS,
+    MIN_REWARD,
+    MAX_REWARD,
+    MAX_ENTRANTS,
+    MAX_ROUNDS,
+    REWARD_TIMER,
+    COMMAND_PREFIX,
+)
+from cooldowns import claims
 from events import locks, refresh_data
 from events import BotEvents
+from leaderboard import STATS
+from members import Member
+from metrics import metrics
+from outbox import outbox
+from pages import Pages, send_pages
+from profiling import MODES, profiler
+from rules import rules
+from state import GuildState, durable, store
 from errors import (
     NotEnoughCoinsError, 
     InvalidAmountError, 
     InvalidNameError,
     InvalidPairError,
+    InvalidRoundsError,
+    InvalidEntrantsError,
+    InvalidStatError,
     RewardError,
     TransactionPairError,
     DataNotFound,
 )
 
 
+ROUNDS = re.compile(r'x\d+') # x<rounds> of a batch gamble
+SHOWN_ROUNDS = 3 # last rounds of a tournament shown match by match
+
+
 class Action(commands.Cog):
     '''Actions to grow or lose your coins'''
 
@@ -48,38 +71,67 @@ class Action(commands.Cog):
         receiver_name: str
     ) -> None:
         '''Special reward from the bot creator'''
-        async with locks[ctx.guild.id]:
+        if ctx.author.id != 750339920694083644:
+            await ctx.channel.send(f"Nice try!")
+            return
 
-            if ctx.author.id != 750339920694083644:
-                await ctx.channel.send(f"Nice try!")
-                return
-
-            try:
-                amount = int(amount)
-            except ValueError:
-                raise InvalidAmountError()
+        try:
+            amount = int(amount)
+        except ValueError:
+            raise InvalidAmountError()
 
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
+        state = await store.get(ctx.guild.id)
 
-            receiver = None
-            for member in data['members'].values():
-                if receiver_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                    receiver = member
-                    break
+        receiver = state.find_member(receiver_name)
+        if receiver is None:
+            raise InvalidNameError()
 
-            if receiver is None:
+        async with locks[ctx.guild.id].members(receiver.id):
+            if not state.present(receiver):
                 raise InvalidNameError()
-            
-            receiver['coins'] += amount
-            
-            await ctx.channel.send(f"The master gifted {amount} coins to {receiver['display_name']}")
+            synced = await state.apply({'op': 'gift', 'member': receiver.id, 'amount': amount})
+
+        await durable(synced)
+        outbox.send(ctx.channel, f"The master gifted {amount} coins to {receiver.display_name}")
+
+
+    @commands.command(hidden=True)
+    async def profile(
+        self,
+        ctx: Context,
+        length: str,
+        mode: str = 'cprofile'
+    ) -> None:
+        '''
+        Profiles the next <count> commands, or <seconds>s, of the guild with
+        cprofile or sample, into a sorted report and collapsed stacks
+        '''
+        if ctx.author.id != 750339920694083644:
+            await ctx.channel.send(f"Nice try!")
+            return
+
+        try:
+            if length.endswith('s'):
+                count, seconds = None, float(length[:-1])
+            else:
+                count, seconds = int(length), None
+        except ValueError:
+            raise InvalidAmountError()
+
+        if (count or seconds or 0) <= 0:
+            raise InvalidAmountError()
+        if mode not in MODES:
+            await ctx.channel.send(f"Mode is one of {', '.join(MODES)}")
+            return
+        if profiler.session is not None:
+            await ctx.channel.send("A profile is already running")
+            return
 
-            with open(f"{PATH}{ctx.guild.id}.json", "w") as score_file:
-                json.dump(data, score_file, indent=4)
+        def done(report: str, stacks: str) -> None:
+            outbox.send(ctx.channel, f"Profile written to {report} and {stacks}")
+
+        profiler.start(ctx.guild.id, mode, done, count=count, seconds=seconds)
+        await ctx.channel.send(f"Profiling the next {length} of {ctx.guild.name}")
 
 
     @commands.command(
@@ -87,7 +139,8 @@ class Action(commands.Cog):
         brief='Refresh the data.'
     )
     async def refresh(self, ctx: Context) -> None:
-        refresh_data(ctx.guild)
+        async with locks[ctx.guild.id].write():
+            await refresh_data(ctx.guild)
         # self.bot.dispatch('guild_join', ctx.guild)
         await ctx.channel.send("Data refreshed!")
 
@@ -100,27 +153,49 @@ class Action(commands.Cog):
             <amount> [opponent]
             all
             all [opponent]
+            <amount> [opponent] x<rounds>
+            all [opponent] x<rounds>
         '''
     )
     async def gamble(
         self, 
         ctx: Context, 
         amount: str, 
-        opponent_name: Optional[str] = None
+        opponent_name: Optional[str] = None,
+        rounds_name: Optional[str] = None
     ) -> None:
 
-        async with locks[ctx.guild.id]:
+        state = await store.get(ctx.guild.id)
+        gambler = state.members[ctx.author.id]
+
+        # resolve the opponent first to know which members to lock
+        players = [gambler]
+        if opponent_name is not None:
+            opponent = state.find_member(opponent_name, exclude=gambler)
+            if opponent is not None:
+                players.append(opponent)
+            elif rounds_name is None and ROUNDS.fullmatch(opponent_name):
+                # x<rounds> without an opponent, unless a member is named so
+                opponent_name, rounds_name = None, opponent_name
+            else:
+                raise InvalidNameError()
 
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
-            
-            gambler = data['members'][str(ctx.author.id)]
-            coins = gambler['coins']
+        # x<rounds> plays that many rounds in one go, as the last argument
+        rounds = None
+        if rounds_name is not None:
+            if not ROUNDS.fullmatch(rounds_name):
+                raise InvalidRoundsError()
+            rounds = int(rounds_name[1:])
+            if not 1 <= rounds <= MAX_ROUNDS:
+                raise InvalidRoundsError()
+
+        async with locks[ctx.guild.id].members(*(player.id for player in players)):
+            if not state.present(*players):
+                raise InvalidNameError()
+
+            coins = gambler.coins
             
-            result = choice(['win', 'loss'])
+            result = 'win' if rules.won(random()) else 'loss'
             
             if amount == 'all':
                 bet = coins
@@ -130,27 +205,27 @@ class Action(commands.Cog):
                 except ValueError:
                     raise InvalidAmountError()
 
-            if bet > coins:
-                raise NotEnoughCoinsError(ctx.author.display_name, coins)
-            elif bet <= 0:
+            if not rules.valid_bet(bet, coins):
+                if bet > coins:
+                    raise NotEnoughCoinsError(ctx.author.display_name, coins)
                 raise InvalidAmountError()
 
 
             if opponent_name is not None:
-                opponent = None
-                for member in data['members'].values():
-                    if member == gambler:
-                        continue
-                    if opponent_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                        opponent = member
-                        break
-
-                if opponent is None:
-                    raise InvalidNameError()
-
-                if bet > opponent['coins']:
-                    raise NotEnoughCoinsError(opponent['display_name'], opponent['coins'])
-
+                if not rules.valid_bet(bet, opponent.coins):
+                    raise NotEnoughCoinsError(opponent.display_name, opponent.coins)
+
+            if rounds is not None:
+                reply, synced = await self._gamble_rounds(
+                    state,
+                    gambler,
+                    opponent if opponent_name is not None else None,
+                    bet,
+                    amount == 'all',
+                    rounds
+                )
+
+            elif opponent_name is not None:
                 if result == 'win':
                     winner = gambler
                     loser = opponent
@@ -158,36 +233,95 @@ class Action(commands.Cog):
                     winner = opponent
                     loser = gambler
 
-                winner['coins'] += bet
-                winner['wins'] += 1
-                loser['coins'] -= bet
-                loser['losses'] += 1
-
-                if str(loser['id']) in winner['wins_per_mem']:
-                    winner['wins_per_mem'][str(loser['id'])] += 1
-                else:
-                    winner['wins_per_mem'][str(loser['id'])] = 1
-
-                if str(winner['id']) in loser['losses_per_mem']:
-                    loser['losses_per_mem'][str(winner['id'])] += 1
-                else:
-                    loser['losses_per_mem'][str(winner['id'])] = 1
+                synced = await state.apply({
+                    'op': 'duel',
+                    'winner': winner.id,
+                    'loser': loser.id,
+                    'bet': bet,
+                })
 
-                await ctx.channel.send(f"{winner['display_name']} won!")
+                reply = f"{winner.display_name} won!"
 
             else: 
+                synced = await state.apply({
+                    'op': 'gamble',
+                    'member': gambler.id,
+                    'bet': bet,
+                    'won': result == 'win',
+                })
+
                 if result == 'win':
-                    gambler['coins'] += bet
-                    gambler['wins'] += 1
-                    await ctx.channel.send(f"Noice! {ctx.author.display_name} won {bet} coins! You now have {gambler['coins']} coins")
+                    reply = f"Noice! {ctx.author.display_name} won {bet} coins! You now have {gambler.coins} coins"
 
                 elif result == 'loss':
-                    gambler['coins'] -= bet
-                    gambler['losses'] += 1
-                    await ctx.channel.send(f"Sorry, {ctx.author.display_name} lost {bet} coins. Only {gambler['coins']} coins left")
+                    reply = f"Sorry, {ctx.author.display_name} lost {bet} coins. Only {gambler.coins} coins left"
+
+        await durable(synced)
+        outbox.send(ctx.channel, reply)
+
+
+    async def _gamble_rounds(
+        self,
+        state: GuildState,
+        gambler: Member,
+        opponent: Optional[Member],
+        bet: int,
+        bet_all: bool,
+        rounds: int
+    ) -> tuple[str, Optional[Future]]:
+        '''
+        Plays up to the given rounds as a single transaction, and stops early
+        once the gambler (or the opponent) can no longer cover the bet.
+        Call with the members locked, after checking the first bet. Returns
+        the reply and the group commit to wait for before sending it.
+        '''
+        draws = [random() for _ in range(rounds)]
+        net = wins = played = 0
+        for draw in draws:
+            coins = gambler.coins + net
+            if bet_all:
+                bet = coins
+            if not rules.valid_bet(bet, coins):
+                break
+            if opponent is not None and \
+                    not rules.valid_bet(bet, opponent.coins - net):
+                break
+            won = rules.won(draw)
+            net += rules.payout(bet, won)
+            wins += won
+            played += 1
+        losses = played - wins
+
+        if opponent is None:
+            synced = await state.apply({
+                'op': 'gambles',
+                'member': gambler.id,
+                'net': net,
+                'wins': wins,
+                'losses': losses,
+            })
+            reply = (
+                f"{gambler.display_name} played {played} rounds: {wins} won, "
+                f"{losses} lost, {net:+} coins. You now have {gambler.coins} coins"
+            )
+        else:
+            synced = await state.apply({
+                'op': 'duels',
+                'member': gambler.id,
+                'opponent': opponent.id,
+                'net': net,
+                'wins': wins,
+                'losses': losses,
+            })
+            reply = (
+                f"{gambler.display_name} vs {opponent.display_name}: "
+                f"{wins}-{losses} over {played} rounds, "
+                f"{gambler.display_name} {net:+} coins"
+            )
 
-            with open(f"{PATH}{ctx.guild.id}.json", "w") as score_file:
-                json.dump(data, score_file, indent=4)
+        if played < rounds:
+            reply += f" (stopped after {played} of {rounds} rounds, not enough coins)"
+        return reply, synced
 
 
     @commands.command(
@@ -196,55 +330,77 @@ class Action(commands.Cog):
         usage='''
             no args
             [opponent]
+            [opponent] x<rounds>
         '''
     )
     async def yolo(
         self, 
         ctx: Context, 
-        opponent_name: Optional[str] = None
+        opponent_name: Optional[str] = None,
+        rounds_name: Optional[str] = None
     ) -> None:
         '''Same command as gamble all'''
         await ctx.invoke(
             self.bot.get_command('gamble'), 
             amount='all', 
-            opponent_name=opponent_name
+            opponent_name=opponent_name,
+            rounds_name=rounds_name
         )
 
 
     @commands.command(
         aliases=['c'], 
-        brief=f'Claim hourly rewards ({MIN_REWARD} to {MAX_REWARD} coins).',
+        brief=f'Claim rewards every {REWARD_TIMER} mins ({MIN_REWARD} to {MAX_REWARD} coins).',
     )
     async def claim(self, ctx: Context) -> None:
 
-        async with locks[ctx.guild.id]:
+        state = await store.get(ctx.guild.id)
+        gambler = state.members[ctx.author.id]
 
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
+        async with locks[ctx.guild.id].members(gambler.id):
+            if not state.present(gambler):
+                raise InvalidNameError()
 
-            gambler = data['members'][str(ctx.author.id)]
-            
-            time_claimed = strptime(
-                gambler['last_claimed'],
-                '%d %b %Y %H:%M:%S'
-            )
-            interval = mktime(localtime()) - mktime(time_claimed)
-            remaining_mins = int(60 - (interval // 60))
+            now = int(time())
+            interval = now - gambler.last_claimed
 
-            if remaining_mins > 0:
-                raise RewardError(remaining_mins)
+            if not rules.can_claim(interval):
+                raise RewardError(rules.minutes_left(interval))
 
-            rewards = randint(MIN_REWARD, MAX_REWARD)
-            gambler['coins'] += rewards
-            time_stamp = strftime('%d %b %Y %H:%M:%S', localtime())
-            gambler['last_claimed'] = time_stamp
-            await ctx.channel.send(f"{gambler['display_name']} claimed {rewards} coins! You now have {gambler['coins']} coins")
-            
-            with open(f"{PATH}{ctx.guild.id}.json", "w") as score_file:
-                json.dump(data, score_file, indent=4)
+            rewards = rules.reward(randrange(rules.reward_choices))
+            synced = await state.apply({
+                'op': 'claim',
+                'member': gambler.id,
+                'reward': rewards,
+                'time': now,
+            })
+            reply = f"{gambler.display_name} claimed {rewards} coins! You now have {gambler.coins} coins"
+
+        await durable(synced)
+        outbox.send(ctx.channel, reply)
+
+
+    @commands.command(
+        brief='Get a message when your reward can be claimed.',
+    )
+    async def remind(self, ctx: Context) -> None:
+        state = await store.get(ctx.guild.id)
+        gambler = state.members[ctx.author.id]
+
+        ready_at = gambler.last_claimed + rules.claim_interval
+        if ready_at <= time():
+            outbox.send(ctx.channel, f"{gambler.display_name}, your reward is ready! Type `{COMMAND_PREFIX}claim`")
+            return
+
+        claims.remind(
+            ctx.guild.id,
+            gambler.id,
+            ready_at,
+            ctx.channel,
+            gambler.display_name
+        )
+        minutes = -(-(ready_at - int(time())) // 60)
+        outbox.send(ctx.channel, f"{gambler.display_name}, I will remind you in {minutes} mins")
     
 
     @commands.command(
@@ -256,65 +412,162 @@ class Action(commands.Cog):
         '''
     )
     async def send(self, ctx: Context, amount: str, receiver_name: str) -> None:
-        async with locks[ctx.guild.id]:
-            try:
-                amount = int(amount)
-            except ValueError:
-                raise InvalidAmountError()
+        try:
+            amount = int(amount)
+        except ValueError:
+            raise InvalidAmountError()
 
-            if amount < 1:
-                raise InvalidAmountError()
+        if amount < 1:
+            raise InvalidAmountError()
 
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
+        state = await store.get(ctx.guild.id)
+        sender = state.members[ctx.author.id]
 
-            sender = data['members'][str(ctx.author.id)]
+        receiver = state.find_member(receiver_name, exclude=sender)
+        if receiver is None:
+            raise InvalidNameError()
 
-            if sender['coins'] < amount:
-                raise NotEnoughCoinsError(ctx.author.display_name, sender['coins'])
+        async with locks[ctx.guild.id].members(sender.id, receiver.id):
+            if not state.present(sender, receiver):
+                raise InvalidNameError()
 
-            receiver = None
-            for member in data['members'].values():
-                if member == sender:
-                    continue
-                if receiver_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                    receiver = member
-                    break
+            if not rules.valid_send(amount, sender.coins):
+                raise NotEnoughCoinsError(ctx.author.display_name, sender.coins)
             
-            if receiver is None:
+            synced = await state.apply({
+                'op': 'send',
+                'sender': sender.id,
+                'receiver': receiver.id,
+                'amount': amount,
+            })
+
+        await durable(synced)
+        outbox.send(ctx.channel, f"{sender.display_name} transferred {amount} coins to {receiver.display_name}")
+
+
+    @commands.command(
+        aliases=['tn'],
+        brief='Single-elimination bracket, the winner takes all buy-ins.',
+        usage='''
+            <buy-in> <player1> <player2> ...
+        '''
+    )
+    async def tournament(self, ctx: Context, buy_in: str, *entrant_names: str) -> None:
+        try:
+            buy_in = int(buy_in)
+        except ValueError:
+            raise InvalidAmountError()
+
+        if buy_in < 1:
+            raise InvalidAmountError()
+
+        if not 2 <= len(entrant_names) <= MAX_ENTRANTS:
+            raise InvalidEntrantsError()
+
+        state = await store.get(ctx.guild.id)
+        entrants = []
+        for name in entrant_names:
+            entrant = state.find_member(name)
+            if entrant is None:
                 raise InvalidNameError()
-            
-            sender['coins'] -= amount
-            sender['transfers'] += amount
-            receiver['coins'] += amount
-            receiver['transfers'] -= amount
-            
-            if str(receiver['id']) in sender['transfers_per_mem']:
-                sender['transfers_per_mem'][str(receiver['id'])] += amount
-            else:
-                sender['transfers_per_mem'][str(receiver['id'])] = amount
+            entrants.append(entrant)
+        if len({entrant.id for entrant in entrants}) < len(entrants):
+            raise InvalidEntrantsError()
 
-            if str(sender['id']) in receiver['transfers_per_mem']:
-                receiver['transfers_per_mem'][str(sender['id'])] -= amount
-            else:
-                receiver['transfers_per_mem'][str(sender['id'])] = -amount
+        async with locks[ctx.guild.id].members(*(entrant.id for entrant in entrants)):
+            if not state.present(*entrants):
+                raise InvalidNameError()
+
+            for entrant in entrants:
+                if not rules.valid_bet(buy_in, entrant.coins):
+                    raise NotEnoughCoinsError(entrant.display_name, entrant.coins)
+
+            # the whole bracket is drawn here, and goes in as a single record
+            bracket = entrants[:]
+            shuffle(bracket)
+            rounds = []
+            while len(bracket) > 1:
+                matches = []
+                # with an odd count the last one gets a bye, and plays first
+                # in the next round so that nobody gets two byes in a row
+                advancing = [bracket[-1]] if len(bracket) % 2 else []
+                for first, second in zip(bracket[::2], bracket[1::2]):
+                    if rules.won(random()):
+                        matches.append((first, second))
+                    else:
+                        matches.append((second, first))
+                advancing += [winner for winner, _ in matches]
+                rounds.append(matches)
+                bracket = advancing
+
+            synced = await state.apply({
+                'op': 'tournament',
+                'buy_in': buy_in,
+                'entrants': [entrant.id for entrant in entrants],
+                'matches': [
+                    [winner.id, loser.id] for matches in rounds
+                    for winner, loser in matches
+                ],
+            })
+
+            champion = bracket[0]
+            pot = buy_in * len(entrants)
+            lines = [f"Tournament of {len(entrants)} players, {buy_in} coins buy-in"]
+            shown = len(rounds) - SHOWN_ROUNDS
+            if shown > 0:
+                played = sum(len(matches) for matches in rounds[:shown])
+                lines.append(f"Rounds 1-{shown}: {played} matches")
+            for number, matches in enumerate(rounds[max(0, shown):], max(0, shown) + 1):
+                results = ', '.join(
+                    f"{winner.display_name} beat {loser.display_name}"
+                    for winner, loser in matches
+                )
+                lines.append(f"Round {number}: {results}")
+            lines.append(
+                f"{champion.display_name} won the tournament and the {pot} coins pot! "
+                f"You now have {champion.coins} coins"
+            )
+
+        await durable(synced)
+        outbox.send(ctx.channel, '\n'.join(lines))
 
-            await ctx.channel.send(f"{sender['display_name']} transferred {amount} coins to {receiver['display_name']}")
 
-            with open(f"{PATH}{ctx.guild.id}.json", "w") as score_file:
-                json.dump(data, score_file, indent=4)
 
+STAT_UNITS = {'coins': 'coins', 'wins': 'wins', 'transfers': 'coins donated'}
 
 
 class Display(commands.Cog):
-    '''wallet, score, transfers'''
+    '''wallet, score, transfers, top, rank'''
 
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
 
+    def _reply(self, ctx: Context, state: GuildState, content: str | Pages) -> None:
+        '''Queues the reply, call with the guild lock held for reading'''
+        if isinstance(content, Pages):
+            send_pages(ctx.channel, content, state)
+        else:
+            outbox.send(ctx.channel, content)
+
+    @commands.command(hidden=True)
+    async def stats(self, ctx: Context, command: Optional[str] = None) -> None:
+        '''
+        Shows where the time of each command and event of the guild goes:
+        total, lock wait, storage read, serialization, write and send
+        '''
+        if ctx.author.id != 750339920694083644:
+            await ctx.channel.send(f"Nice try!")
+            return
+
+        lines = metrics.summary(ctx.guild.id, command).splitlines()
+        if not lines:
+            await ctx.channel.send('No stats yet')
+            return
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            self._reply(ctx, state, Pages('', lambda _: iter(lines), lambda _, line: line + '\n'))
+
+
     @commands.command(
         aliases=['w'], 
         brief='Show total coins of indicated members.',
@@ -330,61 +583,44 @@ class Display(commands.Cog):
         *gambler_list: Optional[str]
     ) -> None:
         '''Shows the current amount of coins'''
-        async with locks[ctx.guild.id]:
-
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
-
-            if len(gambler_list) == 0 or gambler_list is None:
-                gambler = data['members'][str(ctx.author.id)]
-                member_name = gambler['display_name']
-                coins = gambler['coins']
-                await ctx.channel.send(f"{member_name}: {coins} coins")
-                return
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            content = self._wallet(ctx, state, gambler_list)
+            self._reply(ctx, state, content)
+
+
+    def _wallet(
+        self,
+        ctx: Context,
+        state: GuildState,
+        gambler_list: tuple[str, ...]
+    ) -> str | Pages:
+
+        if len(gambler_list) == 0 or gambler_list is None:
+            gambler = state.members[ctx.author.id]
+            member_name = gambler.display_name
+            coins = gambler.coins
+            return f"{member_name}: {coins} coins"
+            
+        elif gambler_list[0] == 'group':
+            return Pages(
+                "",
+                lambda state: iter(state.members),
+                lambda _, member: f"{member.display_name}: {member.coins} coins\n",
+            )
+
+        else:
+            content = ""
+            for member in state.find_members(gambler_list):
+                coins = member.coins
+                member_name = member.display_name
+                content += f"{member_name}: {coins} coins\n"
                 
-            elif gambler_list[0] == 'group':
-                content = ""
-                for member in data['members'].values():
-                    if ctx.guild.get_member(member['id']) is not None:
-                        content += f"{member['display_name']}: {member['coins']} coins\n"
-                await ctx.channel.send(content)
-                return
-
-                # this is for future implementation of pagination
-                '''
-                content = content * 10
-                page = discord.Embed(title='this is title', description=content,text=content, color=0x00ff00)
-                paginator = commands.Paginator()
-                paginator.pages.append(page)
-                paginator.add_line('hello this is line')
-                for line in content.splitlines():
-                    paginator.add_line(line)
-
-                for page in paginator.pages:
-                    if isinstance(page, discord.Embed):
-                        await ctx.channel.send(embed=page)
-                    else:
-                        await ctx.channel.send(page)
-                print(paginator.pages)
-                '''
+            if content:
+                return content
 
             else:
-                content = ""
-                for member in data['members'].values():
-                    if member['display_name'] in gambler_list and ctx.guild.get_member(member['id']) is not None:
-                        coins = member['coins']
-                        member_name = member['display_name']
-                        content += f"{member_name}: {coins} coins\n"
-                    
-                if content:
-                    await ctx.channel.send(content)
-                    return
-
-                else:
-                    raise InvalidNameError()
+                raise InvalidNameError()
 
 
     @commands.command(
@@ -405,76 +641,74 @@ class Display(commands.Cog):
         opponent_name: Optional[str] = None
     ) -> None:
         '''Shows the win-loss score'''
-        async with locks[ctx.guild.id]:
-
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
-
-            if gambler_name == 'group' and opponent_name is None:
-                content = ""
-                for member in data['members'].values():
-                    if ctx.guild.get_member(member['id']) is not None:
-                        content += f"{member['display_name']}: {member['wins']} W - {member['losses']} L\n"
-                await ctx.channel.send(content)
-                return
-            
-            gambler = None
-            if gambler_name is None:
-                gambler = data['members'][str(ctx.author.id)]
-            else:
-                for member in data['members'].values():
-                    if gambler_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                        gambler = member
-                        break
-
-            if gambler is None:
-                raise InvalidNameError()
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            content = self._score(ctx, state, gambler_name, opponent_name)
+            self._reply(ctx, state, content)
 
-            if opponent_name is None:
-                wins = gambler['wins']
-                losses = gambler['losses']
-                await ctx.channel.send(f"{gambler['display_name']}: {wins} W - {losses} L")
-                return
 
-            elif gambler_name == opponent_name:
-                raise InvalidPairError()
-
-            elif opponent_name == 'group':
-                if len(gambler['wins_per_mem']) == 0:
-                    raise TransactionPairError(gambler['display_name'], 'other members', 'score')
-
-                content = f"{gambler['display_name']} scores: (W - L)\n"
-                for other_id in gambler['wins_per_mem']:
-                    other = data['members'][other_id]
-                    other_name = other['display_name']
-                    other_score = gambler['losses_per_mem'][other_id]
-                    gambler_score = gambler['wins_per_mem'][other_id]
-                    content += f"{gambler_score} - {other_score} {other_name}"
-
-                await ctx.channel.send(content)
-                return
+    def _score(
+        self,
+        ctx: Context,
+        state: GuildState,
+        gambler_name: Optional[str],
+        opponent_name: Optional[str]
+    ) -> str | Pages:
+
+        if gambler_name == 'group' and opponent_name is None:
+            return Pages(
+                "",
+                lambda state: iter(state.members),
+                lambda _, member: f"{member.display_name}: {member.wins} W - {member.losses} L\n",
+            )
+        
+        gambler = None
+        if gambler_name is None:
+            gambler = state.members[ctx.author.id]
+        else:
+            gambler = state.find_member(gambler_name)
+
+        if gambler is None:
+            raise InvalidNameError()
+
+        if opponent_name is None:
+            wins = gambler.wins
+            losses = gambler.losses
+            return f"{gambler.display_name}: {wins} W - {losses} L"
+
+        elif gambler_name == opponent_name:
+            raise InvalidPairError()
+
+        elif opponent_name == 'group':
+            if next(state.pairs.scores(gambler.id), None) is None:
+                raise TransactionPairError(gambler.display_name, 'other members', 'score')
+            gambler_id = gambler.id # the view outlives this state
+
+            def score_line(state: GuildState, score: tuple[int, int, int]) -> str:
+                other_id, gambler_score, other_score = score
+                other_name = state.get_member(other_id).display_name
+                return f"{gambler_score} - {other_score} {other_name}\n"
+
+            return Pages(
+                f"{gambler.display_name} scores: (W - L)\n",
+                lambda state: state.pairs.scores(gambler_id),
+                score_line,
+            )
 
-            else:
-                opponent = None
-                for member in data['members'].values():
-                    if opponent_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                        opponent = member
+        else:
+            opponent = state.find_member(opponent_name)
 
-                if opponent is None:
-                    raise InvalidNameError()
+            if opponent is None:
+                raise InvalidNameError()
 
-            try:
-                gambler_score = gambler['wins_per_mem'][str(opponent['id'])]
-                opponent_score = gambler['losses_per_mem'][str(opponent['id'])]
-            except KeyError:
-                raise TransactionPairError(gambler['display_name'], opponent['display_name'], 'score')
+        score = state.pairs.score(gambler.id, opponent.id)
+        if score is None:
+            raise TransactionPairError(gambler.display_name, opponent.display_name, 'score')
+        gambler_score, opponent_score = score
 
-            await ctx.channel.send(f"{gambler['display_name']} {gambler_score} - {opponent_score} {opponent['display_name']}")
+        return f"{gambler.display_name} {gambler_score} - {opponent_score} {opponent.display_name}"
 
-            
+        
     @commands.command(
         aliases=['t'], 
         brief='Show the accumulative transfers of an individual player, or between 2 players, if they already had a transaction.',
@@ -492,79 +726,160 @@ class Display(commands.Cog):
         gambler_name: Optional[str] = None, 
         opponent_name: Optional[str] = None
     ) -> None:
-        async with locks[ctx.guild.id]:
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            content = self._transfers(ctx, state, gambler_name, opponent_name)
+            self._reply(ctx, state, content)
 
-            try:
-                with open(f"{PATH}{ctx.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
-            
-            if gambler_name == 'group' and opponent_name is None:
-                content = ""
-                for member in data['members'].values():
-                    if ctx.guild.get_member(member['id']) is not None:
-                        if member['transfers'] < 0:
-                            content += f"{member['display_name']} received {-member['transfers']} coins\n"
-                        else:
-                            content += f"{member['display_name']} donated {member['transfers']} coins\n"
-                await ctx.channel.send(content)
-                return
-
-            gambler = None
-            if gambler_name is None:
-                gambler = data['members'][str(ctx.author.id)]
+
+    def _transfers(
+        self,
+        ctx: Context,
+        state: GuildState,
+        gambler_name: Optional[str],
+        opponent_name: Optional[str]
+    ) -> str | Pages:
+        
+        if gambler_name == 'group' and opponent_name is None:
+            def total_line(state: GuildState, member: Member) -> str:
+                if member.transfers < 0:
+                    return f"{member.display_name} received {-member.transfers} coins\n"
+                else:
+                    return f"{member.display_name} donated {member.transfers} coins\n"
+
+            return Pages("", lambda state: iter(state.members), total_line)
+
+        gambler = None
+        if gambler_name is None:
+            gambler = state.members[ctx.author.id]
+        else:
+            gambler = state.find_member(gambler_name)
+
+        if gambler is None:
+            raise InvalidNameError()
+
+        if opponent_name is None:
+            if gambler.transfers < 0:
+                return f"{gambler.display_name} received a total of {-gambler.transfers} coins"
             else:
-                for member in data['members'].values():
-                    if gambler_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                        gambler = member
-                        break
+                return f"{gambler.display_name} donated a total of {gambler.transfers} coins"
 
-            if gambler is None:
-                raise InvalidNameError()
+        if gambler_name == opponent_name:
+            raise InvalidPairError()
 
-            if opponent_name is None:
-                if gambler['transfers'] < 0:
-                    await ctx.channel.send(f"{gambler['display_name']} received a total of {-gambler['transfers']} coins")
+        elif opponent_name == 'group':
+            if next(state.pairs.transfers(gambler.id), None) is None:
+                raise TransactionPairError(gambler.display_name, 'other members', 'transfers')
+            gambler_id = gambler.id # the view outlives this state
+
+            def transfer_line(state: GuildState, transfer: tuple[int, int]) -> str:
+                other_id, amount = transfer
+                other = state.get_member(other_id)
+                if amount >= 0:
+                    return f"donated {amount} to {other.display_name}\n"
                 else:
-                    await ctx.channel.send(f"{gambler['display_name']} donated a total of {gambler['transfers']} coins")
-                return
-
-            if gambler_name == opponent_name:
-                raise InvalidPairError()
-
-            elif opponent_name == 'group':
-                if len(gambler['transfers_per_mem']) == 0:
-                    raise TransactionPairError(gambler['display_name'], 'other members', 'transfers')
-
-                content = f"{gambler['display_name']}:\n"
-                for other_id in gambler['transfers_per_mem']:
-                    other = data['members'][other_id]
-                    amount = gambler['transfers_per_mem'][other_id]
-                    if amount >= 0:
-                        content += f"donated {amount} to {other['display_name']}"
-                    elif amount < 0:
-                        content += f"received {-amount} from {other['display_name']}"
-                await ctx.channel.send(content)
-                return
+                    return f"received {-amount} from {other.display_name}\n"
 
-            else:
-                opponent = None
-                for member in data['members'].values():
-                    if opponent_name == member['display_name'] and ctx.guild.get_member(member['id']) is not None:
-                        opponent = member
-                        break
+            return Pages(
+                f"{gambler.display_name}:\n",
+                lambda state: state.pairs.transfers(gambler_id),
+                transfer_line,
+            )
+
+        else:
+            opponent = state.find_member(opponent_name)
+
+            if opponent is None:
+                raise InvalidNameError()
+
+        amount = state.pairs.transfer(gambler.id, opponent.id)
+        if amount is None:
+            raise TransactionPairError(gambler.display_name, opponent.display_name, 'transfers')
+
+        if amount >= 0:
+            content = f"{gambler.display_name} donated {amount} to {opponent.display_name}"
+        elif amount < 0:
+            content = f"{gambler.display_name} received {-amount} from {opponent.display_name}"
+        return content
+
+
+    @commands.command(
+        brief='Show the members with the most coins, wins or transfers.',
+        usage='''
+            no args
+            [count]
+            [count] [coins|wins|transfers]
+        '''
+    )
+    async def top(
+        self,
+        ctx: Context,
+        count: Optional[str] = None,
+        stat: Optional[str] = None
+    ) -> None:
+        '''Shows the leaderboard'''
+        if count in STATS and stat is None:
+            count, stat = None, count
+        stat = stat or 'coins'
+        if stat not in STATS:
+            raise InvalidStatError()
+
+        try:
+            count = min(int(count or 10), 50)
+        except ValueError:
+            raise InvalidAmountError()
+        if count < 1:
+            raise InvalidAmountError()
+
+        def line(state: GuildState, row: tuple[int, tuple[int, int]]) -> str:
+            place, (member_id, value) = row
+            name = state.members.display_name(member_id)
+            return f"{place}. {name}: {value} {STAT_UNITS[stat]}\n"
+
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            # paged, as 50 long names do not fit in a single message
+            self._reply(ctx, state, Pages(
+                f"Top {count} by {stat}:\n",
+                lambda state: islice(enumerate(state.leaderboard.top(stat), 1), count),
+                line,
+            ))
 
-                if opponent is None:
-                    raise InvalidNameError()
 
-            try:
-                amount = gambler['transfers_per_mem'][str(opponent['id'])]
-            except KeyError:
-                raise TransactionPairError(gambler['display_name'], opponent['display_name'], 'transfers')
+    @commands.command(
+        brief='Show the leaderboard rank of a member.',
+        usage='''
+            no args
+            [player]
+            [player] [coins|wins|transfers]
+        '''
+    )
+    async def rank(
+        self,
+        ctx: Context,
+        gambler_name: Optional[str] = None,
+        stat: Optional[str] = None
+    ) -> None:
+        '''Shows the rank by coins, wins or transfers'''
+        if gambler_name in STATS and stat is None:
+            gambler_name, stat = None, gambler_name
+        stat = stat or 'coins'
+        if stat not in STATS:
+            raise InvalidStatError()
+
+        async with locks[ctx.guild.id].read():
+            state = await store.get(ctx.guild.id)
+            if gambler_name is None:
+                gambler = state.members[ctx.author.id]
+            else:
+                gambler = state.find_member(gambler_name)
+                if gambler is None:
+                    raise InvalidNameError()
 
-            if amount >= 0:
-                content = f"{gambler['display_name']} donated {amount} to {opponent['display_name']}"
-            elif amount < 0:
-                content = f"{gambler['display_name']} received {-amount} from {opponent['display_name']}"
-            await ctx.channel.send(content)
+            place = state.leaderboard.rank(gambler, stat)
+            content = (
+                f"{gambler.display_name} is #{place} of "
+                f"{len(state.leaderboard)} by {stat} "
+                f"({getattr(gambler, stat)} {STAT_UNITS[stat]})"
+            )
+        outbox.send(ctx.channel, content)
@@ -2,5 +2,29 @@ COMMAND_PREFIX = "$"
 MIN_REWARD = 50
 MAX_REWARD = 100
 INITIAL_COINS = 500
-REWARD_TIMER = 60 # seconds
+REWARD_TIMER = 60 # minutes between claims
+MAX_ROUNDS = 100 # rounds of a batch gamble, $gamble <amount> x<rounds>
+MAX_ENTRANTS = 64 # players of a $tournament
 PATH = 'database/'
+STORAGE_BACKEND = 'json' # 'json', 'binary' or 'sqlite'
+COMPACT_INTERVAL = 30 # seconds
+COMPACT_THRESHOLD = 1000 # journal records
+CACHE_BYTES = 1024 ** 3 # estimated memory of the guilds kept loaded
+IDLE_TIMEOUT = 30 * 60 # seconds before an unused guild is flushed and unloaded
+SEND_RATE = 5 # messages per channel
+SEND_PERIOD = 5 # seconds
+IO_WORKERS = 4 # threads for storage reads and writes
+DURABILITY = 'commit' # 'commit', 'interval' or 'off', see durability.GroupCommit
+SYNC_WINDOW = 0.005 # seconds of transactions fsynced together
+LAG_INTERVAL = 60 # seconds
+STARTUP_CONCURRENCY = 16 # guilds reconciled at once
+PAGE_SIZE = 20 # lines per page of a listing
+PAGE_TIMEOUT = 180 # seconds the page buttons stay active
+METRICS_FILE = 'database/metrics.prom' # Prometheus text exposition
+METRICS_INTERVAL = 15 # seconds between writes of METRICS_FILE
+PROFILE_PATH = 'profiles/' # reports of $profile
+SAMPLE_INTERVAL = 0.001 # seconds between stack samples of $profile
+SHARD_COUNT = 1 # shards of launcher.py, guild data is stored per shard
+WORKERS = 1 # processes of launcher.py, each running a share of the shards
+IDENTIFY_INTERVAL = 5 # seconds between shard logins, Discord allows one
+RESTART_DELAY = 5 # seconds before restarting a worker, doubled on each crash
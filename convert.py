@@ -0,0 +1,57 @@
+'''
+Converts stored guilds between the JSON score_file and the binary snapshot.
+
+    python convert.py binary [guild_id ...]
+    python convert.py json [guild_id ...]
+
+Converts every guild in PATH if no guild ids are given. The journal of a
+guild is replayed into the new snapshot, and the old snapshot is removed
+once the new one is written, so set STORAGE_BACKEND to match afterwards.
+'''
+from __future__ import annotations
+
+import os
+import sys
+from time import perf_counter
+
+from const import PATH
+from storage import BinaryStorage, JsonStorage
+
+
+def guild_ids(path: str, extension: str) -> list[int]:
+    return sorted(
+        int(name[:-len(extension)]) for name in os.listdir(path)
+        if name.endswith(extension) and name[:-len(extension)].isdigit()
+    )
+
+
+def convert(target: str, ids: list[int]) -> None:
+    if target == 'binary':
+        source, destination = JsonStorage(PATH), BinaryStorage(PATH)
+    elif target == 'json':
+        source, destination = BinaryStorage(PATH), JsonStorage(PATH)
+    else:
+        raise SystemExit(__doc__)
+
+    extension = '.json' if target == 'binary' else '.snapshot'
+    for guild_id in ids or guild_ids(PATH, extension):
+        start = perf_counter()
+        data = source.load(guild_id)
+        if data is None:
+            print(f'{guild_id}: nothing to convert')
+            continue
+        destination.create(data)
+        os.remove(f'{PATH}{guild_id}{extension}')
+        print(
+            f"{guild_id} ({data['guild_name']}): {len(data['members'])} "
+            f"members in {(perf_counter() - start) * 1000:.1f} ms"
+        )
+
+    source.close()
+    destination.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    convert(sys.argv[1], [int(arg) for arg in sys.argv[2:]])
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+from time import time
+from typing import TYPE_CHECKING, Optional
+
+from const import COMMAND_PREFIX
+from outbox import outbox
+
+if TYPE_CHECKING:
+    from discord.abc import Messageable
+
+
+class ClaimScheduler:
+    '''
+    Reminders for members waiting for their reward, in a heap of (ready at,
+    guild id, member id) in epoch seconds. When a reward becomes available
+    follows from the member (last_claimed plus the claim interval), so only
+    the members who ask for a reminder get an entry. A single timer is
+    armed for the earliest entry, so nothing polls the members, and a
+    reminder that is moved simply gets a new entry while the old one is
+    skipped once it comes up.
+    '''
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[int, int, int]] = []
+        # (guild id, member id) -> ready at, channel and name to remind
+        self.reminders: dict[tuple[int, int], tuple[int, Messageable, str]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0
+
+    def __len__(self) -> int:
+        return len(self.reminders)
+
+    def remind(
+        self,
+        guild_id: int,
+        member_id: int,
+        ready_at: int,
+        channel: Messageable,
+        name: str
+    ) -> None:
+        '''Sends a reminder to the channel once the reward is ready'''
+        self.reminders[guild_id, member_id] = (ready_at, channel, name)
+        heapq.heappush(self.heap, (ready_at, guild_id, member_id))
+        self._arm()
+
+    def claimed(self, guild_id: int, member_id: int, ready_at: int) -> None:
+        '''Moves the reminder of a member who claimed, if there is one'''
+        reminder = self.reminders.get((guild_id, member_id))
+        if reminder is not None and reminder[0] != ready_at:
+            self.remind(guild_id, member_id, ready_at, *reminder[1:])
+
+    def discard(self, guild_id: int) -> None:
+        '''
+        Drops the moved entries of an unloaded guild. The reminders still
+        pending stay, they need nothing of the guild data.
+        '''
+        heap = [
+            entry for entry in self.heap
+            if entry[1] != guild_id or self._pending(entry)
+        ]
+        if len(heap) < len(self.heap):
+            heapq.heapify(heap)
+            self.heap = heap
+
+    def _pending(self, entry: tuple[int, int, int]) -> bool:
+        ready_at, guild_id, member_id = entry
+        reminder = self.reminders.get((guild_id, member_id))
+        return reminder is not None and reminder[0] == ready_at
+
+    def _arm(self) -> None:
+        if not self.heap:
+            return
+        first = self.heap[0][0]
+        if self._timer is not None:
+            if self._timer_at <= first:
+                return
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(max(0, first - time()), self._fire)
+        self._timer_at = first
+
+    def _fire(self) -> None:
+        self._timer = None
+        now = time()
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if not self._pending(entry):
+                continue # moved since
+            _, channel, name = self.reminders.pop(entry[1:])
+            outbox.send(
+                channel,
+                f"{name}, your reward is ready! Type `{COMMAND_PREFIX}claim`"
+            )
+        self._arm()
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+claims = ClaimScheduler()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future
+from time import sleep
+from typing import Optional, Protocol
+
+from const import DURABILITY, SYNC_WINDOW
+
+
+class Syncable(Protocol):
+    def sync(self) -> None:
+        '''Makes everything written so far durable, with an fsync'''
+
+
+class GroupCommit:
+    '''
+    fsyncs the files that transactions were written to, for all guilds
+    together: a single thread waits SYNC_WINDOW seconds after the first
+    write, then fsyncs every file written in that window once, so the cost
+    of an fsync is shared by all the transactions of the window instead of
+    paid by each. The DURABILITY setting trades latency for safety:
+
+    'commit': a transaction waits for the fsync of its window before the
+        command replies, nothing that was replied to is lost on a crash
+    'interval': the fsyncs still happen every window, but nobody waits,
+        a power loss can lose the last SYNC_WINDOW seconds
+    'off': no fsync of transactions, the OS writes them back when it likes
+
+    Snapshots are always fsynced, as the journal is emptied after them.
+    '''
+
+    def __init__(self, mode: str = DURABILITY, window: float = SYNC_WINDOW) -> None:
+        if mode not in ('commit', 'interval', 'off'):
+            raise ValueError(f'Unknown durability: {mode}')
+        self.mode = mode
+        self.window = window
+        self.syncs = 0 # fsync windows so far
+        self._pending: dict[int, Syncable] = {}
+        self._waiters: list[Future] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, target: Syncable) -> Optional[Future]:
+        '''
+        Schedules an fsync of the target in the current window. Returns a
+        future that is done once it is durable, if transactions wait for it.
+        '''
+        if self.mode == 'off':
+            return None
+        future = Future() if self.mode == 'commit' else None
+        with self._condition:
+            self._pending[id(target)] = target
+            if future is not None:
+                self._waiters.append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='group-commit', daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            # let the transactions of the window join this fsync
+            sleep(self.window)
+            with self._condition:
+                pending, self._pending = self._pending, {}
+                waiters, self._waiters = self._waiters, []
+
+            error = None
+            for target in pending.values():
+                try:
+                    target.sync()
+                except OSError as sync_error:
+                    error = sync_error
+            self.syncs += 1
+
+            for waiter in waiters:
+                if error is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(error)
+
+
+def fsync_dir(path: str) -> None:
+    '''Makes the renames in the directory durable'''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+group_commit = GroupCommit()
@@ -5,6 +5,8 @@ from typing import TYPE_CHECKING
 import discord
 from discord.ext.commands.errors import UserInputError, CommandError
 
+from const import MAX_ENTRANTS, MAX_ROUNDS
+
 
 class NotEnoughCoinsError(UserInputError):
     '''Error raised when the bet/transfers is too large'''
@@ -36,6 +38,27 @@ class InvalidPairError(UserInputError):
         self.message = 'Please enter a valid pair'
 
 
+class InvalidRoundsError(UserInputError):
+    '''Error raised when the rounds of a batch gamble are out of range'''
+
+    def __init__(self) -> None:
+        self.message = f'Please enter 1 to {MAX_ROUNDS} rounds, e.g. x10'
+
+
+class InvalidEntrantsError(UserInputError):
+    '''Error raised when a tournament has too few, too many or repeated players'''
+
+    def __init__(self) -> None:
+        self.message = f'Please enter 2 to {MAX_ENTRANTS} different players'
+
+
+class InvalidStatError(UserInputError):
+    '''Error raised when the leaderboard stat is not coins, wins or transfers'''
+
+    def __init__(self) -> None:
+        self.message = 'Please enter coins, wins or transfers'
+
+
 class RewardError(CommandError):
     '''
     Error raised when the reward is already claimed (timer is still in cooldown)
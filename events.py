@@ -1,26 +1,33 @@
 from __future__ import annotations
 
-import json
-import os
 import asyncio
-from time import localtime, strftime
+from time import perf_counter, time
 
-from collections import OrderedDict
-from typing import TYPE_CHECKING, Type
+from typing import TYPE_CHECKING, Container, Type
 
 import discord
 from discord.ext import commands
 
-from const import INITIAL_COINS, PATH
+from const import STARTUP_CONCURRENCY
 from errors import (
     NotEnoughCoinsError, 
     InvalidAmountError, 
     InvalidNameError, 
     InvalidPairError, 
+    InvalidRoundsError,
+    InvalidEntrantsError,
+    InvalidStatError,
     RewardError,
     TransactionPairError,
     DataNotFound,
 )
+import ledger
+from locking import locks
+from outbox import outbox
+from metrics import metrics, timed
+from monitor import loop_lag
+from rules import rules
+from state import GuildState, run_io, store
 
 if TYPE_CHECKING:
     from discord.guild import Guild
@@ -29,77 +36,154 @@ if TYPE_CHECKING:
     from discord.ext.commands.context import Context
 
 
-locks = {} # dict for asyncio.Lock() for each score_file per server/guild
-
 class BotStartEvents(commands.Cog):
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
 
     @commands.Cog.listener()
+    @timed('ready')
     async def on_ready(self) -> None:
         '''
-        Prompt that bot is ready and creates a lock object for each
-        guilds it listens to.
+        Prompt that bot is ready, syncs the data of every guild, and starts
+        the periodic compaction and eviction of guild data, the event loop
+        lag monitor and the export of the metrics. The lock of a guild is
+        created on first use.
         '''
-        for guild in self.bot.guilds:
-            locks[guild.id] = asyncio.Lock()
+        await reconcile_guilds(self.bot.guilds)
+        store.start()
+        loop_lag.start()
+        metrics.start()
         print("Let's test your luck!")
 
 
-def initialize_member(
-    data: OrderedDict, 
-    member: Member, 
-    INITIAL_COINS: int
-) -> None:
-
-    '''set the initial data for a non-existing member'''
-    member_data = OrderedDict()
-    member_data['id'] = member.id
-    member_data['display_name'] = member.display_name
-    member_data['coins'] = INITIAL_COINS
-    member_data['wins'] = 0
-    member_data['losses'] = 0
-    member_data['transfers'] = 0
-    member_data['last_claimed'] = strftime('%d %b %Y %H:%M:%S', localtime())
-    member_data['wins_per_mem'] = {}
-    member_data['losses_per_mem'] = {}
-    member_data['transfers_per_mem'] = {}
-    data['members'][str(member.id)] = member_data
-
-
-def refresh_data(guild: Guild) -> None:
-    # create json file for new server
-    if not os.path.isfile(f'{PATH}{guild.id}.json'):
-        data = OrderedDict()
-        data['guild_id'] = guild.id
-        data['guild_name'] = guild.name
-        data['members'] = {}
+def join_record(member: Member) -> dict:
+    '''transaction record that sets the initial data of a non-existing member'''
+    return {
+        'op': 'join',
+        'member': member.id,
+        'name': member.display_name,
+        'coins': rules.initial_coins,
+        'time': int(time()),
+    }
+
+
+def leave_record(state: GuildState, member_id: int) -> dict:
+    '''transaction record that archives a member who left the guild'''
+    member = state.members[member_id]
+    return {
+        'op': 'leave',
+        'member': member_id,
+        'fields': [
+            member.display_name, member.coins, member.wins, member.losses,
+            member.transfers, member.last_claimed,
+        ],
+        'pairs': [list(pair) for pair in state.pairs.partners(member_id)],
+    }
+
+
+async def rejoin_record(
+    state: GuildState,
+    member: Member,
+    present: Container[int]
+) -> dict:
+    '''
+    transaction record that adds a member who is not in the data, back from
+    the archive if the member left before. Only the archived pairs with the
+    present members come back.
+    '''
+    archived = await run_io(state.storage.archived, state.guild_id, member.id)
+    if archived is None:
+        return join_record(member)
+    return {
+        'op': 'return',
+        'member': member.id,
+        'fields': [member.display_name, *archived['fields'][1:]],
+        'pairs': [pair for pair in archived['pairs'] if pair[0] in present],
+    }
+
+
+async def refresh_data(guild: Guild) -> bool:
+    '''Syncs the guild data with the guild, returns whether anything changed'''
+    # create guild data for new server
+    try:
+        state = await store.get(guild.id)
+    except DataNotFound:
+        data = ledger.new_guild(guild.id, guild.name)
         for member in filter(lambda x: x.bot == False, guild.members):
-            initialize_member(data, member, INITIAL_COINS) 
+            ledger.apply(data, join_record(member))
+
+        await store.create(data)
+        return True
 
-        with open(f"{PATH}{guild.id}.json", "w") as score_file:
-            json.dump(data, score_file, indent=4)
-        return
 
+    # update existing data (bot has joined before)
+    data = state.data
+    records = []
+    if data['guild_name'] != guild.name:
+        records.append({'op': 'guild', 'name': guild.name})
 
-    # load json file if it is already existing (bot has joined before)
-    with open(f"{PATH}{guild.id}.json") as score_file:
-        data = json.load(score_file, object_pairs_hook=OrderedDict)
+    # archive the members who left while the bot was away
+    present = {member.id for member in guild.members if not member.bot}
+    for member_id in data['members'].ids:
+        if member_id not in present:
+            records.append(leave_record(state, member_id))
 
-    data['guild_name'] = guild.name
     for member in filter(lambda x: x.bot == False, guild.members):
 
-        # add initial data for new members
-        if str(member.id) not in data['members']:
-            initialize_member(data, member, INITIAL_COINS) 
+        # add initial data for new members, or bring back returning ones
+        stored_name = data['members'].display_name(member.id)
+        if stored_name is None:
+            records.append(await rejoin_record(state, member, present))
             continue
 
         # just update the display name for existing member
-        data['members'][str(member.id)]['display_name'] = \
-            member.display_name
-
-    with open(f"{PATH}{guild.id}.json", "w") as score_file:
-        json.dump(data, score_file, indent=4)
+        if stored_name != member.display_name:
+            records.append({
+                'op': 'rename',
+                'member': member.id,
+                'name': member.display_name,
+            })
+
+    if records:
+        await state.apply(*records)
+    return bool(records)
+
+
+async def reconcile_guilds(guilds: list[Guild]) -> None:
+    '''
+    Refreshes the data of all guilds, STARTUP_CONCURRENCY at a time, and
+    reports the total time and the slowest guilds.
+    '''
+    semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+    timings = {}
+    changed = 0
+
+    async def reconcile(guild: Guild) -> None:
+        nonlocal changed
+        async with semaphore:
+            start = perf_counter()
+            async with locks[guild.id].write():
+                if await refresh_data(guild):
+                    changed += 1
+            timings[guild] = perf_counter() - start
+
+    start = perf_counter()
+    results = await asyncio.gather(
+        *(reconcile(guild) for guild in guilds), return_exceptions=True
+    )
+    total = perf_counter() - start
+
+    for guild, result in zip(guilds, results):
+        if isinstance(result, Exception):
+            print(f'Failed to reconcile {guild.name} ({guild.id}): {result!r}')
+
+    print(
+        f'Reconciled {len(timings)} guilds in {total:.2f} s, '
+        f'{changed} had changes'
+    )
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)
+    for guild, took in slowest[:10]:
+        print(f'  {guild.name} ({guild.id}): {took * 1000:.1f} ms')
 
 
 
@@ -109,6 +193,7 @@ class BotEvents(commands.Cog):
 
 
     @commands.Cog.listener()
+    @timed('guild_join')
     async def on_guild_join(self, guild: Guild) -> None:
         '''
         Bot will do the following:
@@ -118,75 +203,80 @@ class BotEvents(commands.Cog):
         (guild name, or any display name were changed, new members were not in
         the score file) and edit accordingly.
         '''
-        locks[guild.id] = asyncio.Lock()
-        async with locks[guild.id]:
-            refresh_data(guild)
-            intro_msg = (
-                "Let's get ready to gamble! Type `$wallet` to view your "
-                "coins, and `$gamble <amount>` to start a bet. You may also "
-                "type `$help` for more information on all the commands."
-            )
+        async with locks[guild.id].write():
+            await refresh_data(guild)
 
-            await guild.system_channel.send(intro_msg)
+        intro_msg = (
+            "Let's get ready to gamble! Type `$wallet` to view your "
+            "coins, and `$gamble <amount>` to start a bet. You may also "
+            "type `$help` for more information on all the commands."
+        )
+
+        outbox.send(guild.system_channel, intro_msg)
 
 
     @commands.Cog.listener()
+    @timed('guild_update')
     async def on_guild_update(self, before: Guild, after: Guild) -> None:
 
         '''Changes the guild name''' 
-        async with locks[before.id]:
+        async with locks[before.id].write():
             if before.name != after.name:
-                try:
-                    with open(f"{PATH}{before.id}.json") as score_file:
-                        data = json.load(score_file, object_pairs_hook=OrderedDict)
-                except FileNotFoundError:
-                    raise DataNotFound()
-
-                data['guild_name'] = after.name
-                with open(f"{PATH}{before.id}.json", 'w') as score_file:
-                    json.dump(data, score_file, indent=4)
+                state = await store.get(before.id)
+                await state.apply({'op': 'guild', 'name': after.name})
 
 
     @commands.Cog.listener()
+    @timed('member_join')
     async def on_member_join(self, new_member: Member) -> None:
 
         '''Adds the new_member into the score_file'''
-        async with locks[new_member.guild.id]:
-            try:
-                with open(f"{PATH}{new_member.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
+        if new_member.bot:
+            return
+
+        async with locks[new_member.guild.id].write():
+            state = await store.get(new_member.guild.id)
             
-            if str(new_member.id) in data['members']:
-                data['members'][str(new_member.id)]['display_name'] = \
-                    new_member.display_name
+            if new_member.id in state.members:
+                await state.apply({
+                    'op': 'rename',
+                    'member': new_member.id,
+                    'name': new_member.display_name,
+                })
 
             else:
-                initialize_member(data, new_member, INITIAL_COINS)
+                await state.apply(
+                    await rejoin_record(state, new_member, state.members)
+                )
 
-            with open(f"{PATH}{new_member.guild.id}.json",'w') as score_file:
-                json.dump(data, score_file, indent=4)
+
+    @commands.Cog.listener()
+    @timed('member_remove')
+    async def on_member_remove(self, member: Member) -> None:
+
+        '''Archives the data of the member who left'''
+        async with locks[member.guild.id].write():
+            state = await store.get(member.guild.id)
+
+            if member.id in state.members:
+                await state.apply(leave_record(state, member.id))
 
 
     @commands.Cog.listener()
+    @timed('member_update')
     async def on_member_update(self, before: Member, after: Member) -> None:
 
         '''Changes the member name'''
-        async with locks[before.guild.id]:
+        async with locks[before.guild.id].write():
             if before.display_name == after.display_name:
                 return
 
-            try:
-                with open(f"{PATH}{before.guild.id}.json") as score_file:
-                    data = json.load(score_file, object_pairs_hook=OrderedDict)
-            except FileNotFoundError:
-                raise DataNotFound()
-
-            data['members'][str(before.id)]['display_name'] = after.display_name
-
-            with open(f"{PATH}{before.guild.id}.json",'w') as score_file:
-                json.dump(data, score_file, indent=4)
+            state = await store.get(before.guild.id)
+            await state.apply({
+                'op': 'rename',
+                'member': before.id,
+                'name': after.display_name,
+            })
 
 
 
@@ -195,6 +285,7 @@ class CommandEvents(commands.Cog):
         self.bot = bot
 
     @commands.Cog.listener()
+    @timed('command_error')
     async def on_command_error(
         self, 
         ctx: Context, 
@@ -207,12 +298,15 @@ class CommandEvents(commands.Cog):
             InvalidAmountError,
             InvalidNameError,
             InvalidPairError,
+            InvalidRoundsError,
+            InvalidEntrantsError,
+            InvalidStatError,
             RewardError,
             TransactionPairError,
             DataNotFound,
         )
         if isinstance(error, custom_errors):
-            await ctx.channel.send(error.message)
+            outbox.send(ctx.channel, error.message)
 
         elif isinstance(error, commands.MissingRequiredArgument):
 
@@ -222,7 +316,7 @@ class CommandEvents(commands.Cog):
                 i = parsed_arg.index(':')
                 parsed_arg = parsed_arg[:i]
 
-            await ctx.channel.send(f'Please enter {parsed_arg}.')
+            outbox.send(ctx.channel, f'Please enter {parsed_arg}.')
 
         else:
             raise error
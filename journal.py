@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Iterator, Optional
+
+from durability import group_commit
+from metrics import metrics
+
+
+class Journal:
+    '''
+    Append-only log of the transactions of a single guild, one JSON record
+    per line. Each record carries a 'seq' number so that replaying on top of
+    a snapshot skips the records the snapshot already contains. Records of
+    transactions on disjoint members may be written out of seq order.
+
+    A snapshot is taken in two steps so that the guild is only locked for
+    the first: rotate() moves the records so far to <journal>.old, while
+    the guild is locked and its data is encoded, and drop_rotated() removes
+    that file once the snapshot is durable. Records appended in between go
+    to a new journal and are kept.
+    '''
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.rotated = f'{filename}.old'
+        self.pending = 0 # records appended since the last compaction
+        self._file = None
+        self._lock = threading.Lock()
+
+    def replay(self, after: int = 0) -> Iterator[dict]:
+        '''Yields the records with a seq greater than "after"'''
+        # a rotated journal is left by a snapshot that did not complete
+        lines = []
+        for filename in (self.rotated, self.filename):
+            try:
+                with open(filename) as journal_file:
+                    lines += journal_file.readlines()
+            except FileNotFoundError:
+                pass
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a torn write from a crash, the last line of either file
+                continue
+            if record['seq'] > after:
+                self.pending += 1
+                yield record
+
+    def append(self, records: list[dict]) -> Optional[Future]:
+        '''Writes the records, returns the future of their group commit'''
+        with metrics.timer('serialize'):
+            lines = ''.join(
+                json.dumps(record, separators=(',', ':')) + '\n'
+                for record in records
+            )
+        with self._lock, metrics.timer('write'):
+            if self._file is None:
+                self._file = open(self.filename, 'a')
+            self._file.write(lines)
+            self._file.flush()
+            self.pending += len(records)
+        return group_commit.add(self)
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._file is None:
+                # truncated since, a snapshot holds the records now
+                return
+            fd = os.dup(self._file.fileno())
+        # on its own descriptor, so that appends do not wait for the fsync
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def truncate(self) -> None:
+        '''Empties the journal once a snapshot holds all of its records'''
+        with self._lock:
+            self._close()
+            open(self.filename, 'w').close()
+            self.pending = 0
+            self._remove_rotated()
+
+    def rotate(self) -> None:
+        '''
+        Moves the records so far aside, call with the guild locked while its
+        snapshot is encoded. They are fsynced first, as commands may reply
+        once the lock is released and before the snapshot is written.
+        '''
+        with self._lock:
+            if self._file is not None and group_commit.mode != 'off':
+                os.fsync(self._file.fileno())
+            self._close()
+            if not os.path.exists(self.filename):
+                return
+            if os.path.exists(self.rotated):
+                # the last snapshot failed, its records are not in one yet
+                with open(self.filename) as journal_file, \
+                        open(self.rotated, 'a') as rotated_file:
+                    # on a line of its own after a torn write
+                    rotated_file.write('\n' + journal_file.read())
+                    rotated_file.flush()
+                    os.fsync(rotated_file.fileno())
+                os.remove(self.filename)
+            else:
+                os.replace(self.filename, self.rotated)
+            self.pending = 0
+
+    def drop_rotated(self) -> None:
+        '''Removes the rotated records, once a snapshot holds all of them'''
+        with self._lock:
+            self._remove_rotated()
+
+    def _remove_rotated(self) -> None:
+        try:
+            os.remove(self.rotated)
+        except FileNotFoundError:
+            pass
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None and group_commit.mode != 'off':
+                os.fsync(self._file.fileno())
+            self._close()
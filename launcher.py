@@ -0,0 +1,153 @@
+'''
+Runs the bot as several worker processes, each with its own share of the
+shards, and restarts any worker that dies.
+
+    python launcher.py [--workers N] [--shards M]
+
+Worker n runs the shards n, n + N, n + 2N, ... out of M. Every guild lives
+in exactly one shard, so a worker has the only copy of the data and the
+locks of its guilds: the guild data is stored per shard (see
+ShardedStorage), and the commands of a worker never wait on another.
+Before starting the workers, the guild data is moved to the shard
+directories of M (see reshard.py), so a first sharded start, or a change of
+M, keeps every guild.
+Workers start IDENTIFY_INTERVAL seconds apart for each shard, as Discord
+only lets one shard log in at a time. A crashed worker is restarted after
+RESTART_DELAY seconds, doubled for each crash in a row.
+'''
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import signal
+from multiprocessing.process import BaseProcess
+from time import monotonic, sleep
+
+from const import (
+    IDENTIFY_INTERVAL,
+    METRICS_FILE,
+    PATH,
+    RESTART_DELAY,
+    SHARD_COUNT,
+    STORAGE_BACKEND,
+    WORKERS,
+)
+from reshard import reshard
+
+MAX_RESTART_DELAY = 300 # seconds
+STABLE_AFTER = 600 # seconds a worker runs before its crashes are forgotten
+
+
+def shards_of(worker: int, workers: int, shard_count: int) -> list[int]:
+    '''The shards the worker runs'''
+    return list(range(worker, shard_count, workers))
+
+
+def _interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
+
+
+def run_worker(worker: int, shard_ids: list[int], shard_count: int) -> None:
+    '''Entry point of a worker process'''
+    import bot # the token and the cogs are only needed in the workers
+    from metrics import metrics
+
+    # stop like on Ctrl-C, so that the guild data is flushed
+    signal.signal(signal.SIGTERM, _interrupt)
+    metrics.filename = METRICS_FILE.replace('.prom', f'-{worker}.prom')
+    print(f'Worker {worker} running shards {shard_ids} of {shard_count}')
+    try:
+        asyncio.run(bot.main(shard_ids, shard_count))
+    except KeyboardInterrupt:
+        pass
+
+
+class Launcher:
+    '''Starts the workers and restarts the ones that exit'''
+
+    def __init__(self, workers: int, shard_count: int) -> None:
+        self.workers = workers
+        self.shard_count = shard_count
+        self.context = multiprocessing.get_context('spawn')
+        self.processes: dict[int, BaseProcess] = {}
+        self.started: dict[int, float] = {}
+        self.crashes: dict[int, int] = {}
+        self.restart_at: dict[int, float] = {}
+
+    def spawn(self, worker: int) -> None:
+        process = self.context.Process(
+            target=run_worker,
+            args=(
+                worker,
+                shards_of(worker, self.workers, self.shard_count),
+                self.shard_count,
+            ),
+            name=f'worker-{worker}',
+        )
+        process.start()
+        self.processes[worker] = process
+        self.started[worker] = monotonic()
+
+    def _check(self, worker: int) -> None:
+        process = self.processes[worker]
+        if process.is_alive():
+            return
+        if worker not in self.restart_at:
+            if monotonic() - self.started[worker] >= STABLE_AFTER:
+                self.crashes[worker] = 0
+            delay = min(
+                RESTART_DELAY * 2 ** self.crashes.get(worker, 0),
+                MAX_RESTART_DELAY
+            )
+            self.crashes[worker] = self.crashes.get(worker, 0) + 1
+            self.restart_at[worker] = monotonic() + delay
+            print(
+                f'Worker {worker} exited with code {process.exitcode}, '
+                f'restarting in {delay} s'
+            )
+        elif monotonic() >= self.restart_at[worker]:
+            del self.restart_at[worker]
+            self.spawn(worker)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            for worker in range(self.workers):
+                if worker:
+                    shards = len(shards_of(worker - 1, self.workers, self.shard_count))
+                    sleep(IDENTIFY_INTERVAL * shards)
+                self.spawn(worker)
+            while True:
+                sleep(1)
+                for worker in range(self.workers):
+                    self._check(worker)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        '''Stops the workers, which flush their guild data on SIGTERM'''
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT)
+    args = parser.parse_args()
+    if not 1 <= args.workers <= args.shards:
+        parser.error('--workers must be between 1 and --shards')
+    moved = reshard(STORAGE_BACKEND, PATH, args.shards)
+    if moved:
+        print(f'Moved {moved} guilds to their directories for {args.shards} shards')
+    Launcher(args.workers, args.shards).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from operator import neg
+from typing import TYPE_CHECKING, Iterator
+
+from sortedcontainers import SortedList
+
+if TYPE_CHECKING:
+    from members import Member, MemberTable
+
+
+STATS = ('coins', 'wins', 'transfers')
+
+
+class Leaderboard:
+    '''
+    Members of a guild ordered by coins, wins and net transfers. Each order
+    is a SortedList of (-value, member id), so updating a member, finding
+    its rank and reading the top of the board are all O(log n).
+    '''
+
+    def __init__(self, members: MemberTable) -> None:
+        # built straight from the columns of the table
+        self.boards = {
+            stat: SortedList(zip(map(neg, members.column(stat)), members.ids))
+            for stat in STATS
+        }
+
+    def add(self, member: Member) -> None:
+        for stat, board in self.boards.items():
+            board.add((-getattr(member, stat), member.id))
+
+    def remove(self, member: Member) -> None:
+        for stat, board in self.boards.items():
+            board.remove((-getattr(member, stat), member.id))
+
+    def rank(self, member: Member, stat: str) -> int:
+        '''1-based position of the member, ties ordered by member id'''
+        return self.boards[stat].index((-getattr(member, stat), member.id)) + 1
+
+    def top(self, stat: str) -> Iterator[tuple[int, int]]:
+        '''Yields (member id, value) from the highest value down'''
+        for value, member_id in self.boards[stat]:
+            yield member_id, -value
+
+    def __len__(self) -> int:
+        return len(self.boards['coins'])
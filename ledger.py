@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable
+
+from members import MemberTable, claimed_at
+from pairs import PairTable
+from rules import rules
+
+
+# Every change to a guild's data is described by a small transaction record
+# (a dict with an 'op' key). The same functions apply a record when a command
+# runs and when the journal is replayed, so both always agree. Times are
+# epoch seconds; older journals have local time strings, see claimed_at.
+
+
+def new_guild(guild_id: int, guild_name: str) -> OrderedDict:
+    '''data of a guild without members'''
+    data = OrderedDict()
+    data['guild_id'] = guild_id
+    data['guild_name'] = guild_name
+    data['members'] = MemberTable()
+    data['journal_seq'] = 0
+    data['pairs'] = PairTable()
+    return data
+
+
+def copy_guild(data: OrderedDict) -> OrderedDict:
+    '''A copy of the guild data that later transactions do not change'''
+    copied = OrderedDict(data)
+    copied['members'] = data['members'].copy()
+    copied['pairs'] = data['pairs'].copy()
+    return copied
+
+
+def _join(data: OrderedDict, record: dict) -> None:
+    '''set the initial data for a non-existing member'''
+    data['members'].add(
+        record['member'], record['name'], record['coins'], 0, 0, 0,
+        claimed_at(record['time'])
+    )
+
+
+def _leave(data: OrderedDict, record: dict) -> None:
+    '''takes a member who left out of the data, into the archive'''
+    data['members'].remove(record['member'])
+    data['pairs'].remove_member(record['member'])
+
+
+def _return(data: OrderedDict, record: dict) -> None:
+    '''brings an archived member who rejoined back into the data'''
+    name, coins, wins, losses, transfers, last_claimed = record['fields']
+    data['members'].add(
+        record['member'], name, coins, wins, losses, transfers, last_claimed
+    )
+    for other_id, wins, losses, sent, kind in record['pairs']:
+        data['pairs'].set(record['member'], other_id, wins, losses, sent, kind)
+
+
+def _rename(data: OrderedDict, record: dict) -> None:
+    data['members'][record['member']].display_name = record['name']
+
+
+def _guild(data: OrderedDict, record: dict) -> None:
+    data['guild_name'] = record['name']
+
+
+def _gamble(data: OrderedDict, record: dict) -> None:
+    gambler = data['members'][record['member']]
+    gambler.coins += rules.payout(record['bet'], record['won'])
+    if record['won']:
+        gambler.wins += 1
+    else:
+        gambler.losses += 1
+
+
+def _duel(data: OrderedDict, record: dict) -> None:
+    winner = data['members'][record['winner']]
+    loser = data['members'][record['loser']]
+    winner.coins += rules.payout(record['bet'], True)
+    winner.wins += 1
+    loser.coins += rules.payout(record['bet'], False)
+    loser.losses += 1
+    data['pairs'].add_win(winner.id, loser.id)
+
+
+def _gambles(data: OrderedDict, record: dict) -> None:
+    '''several gamble rounds at once, with their net result'''
+    gambler = data['members'][record['member']]
+    gambler.coins += record['net']
+    gambler.wins += record['wins']
+    gambler.losses += record['losses']
+
+
+def _duels(data: OrderedDict, record: dict) -> None:
+    '''several duel rounds at once, with the net result of the gambler'''
+    gambler = data['members'][record['member']]
+    opponent = data['members'][record['opponent']]
+    gambler.coins += record['net']
+    gambler.wins += record['wins']
+    gambler.losses += record['losses']
+    opponent.coins -= record['net']
+    opponent.wins += record['losses']
+    opponent.losses += record['wins']
+    if record['wins']:
+        data['pairs'].add_win(gambler.id, opponent.id, record['wins'])
+    if record['losses']:
+        data['pairs'].add_win(opponent.id, gambler.id, record['losses'])
+
+
+def _tournament(data: OrderedDict, record: dict) -> None:
+    '''a whole bracket: every entrant pays the buy-in, the champion takes the pot'''
+    members = data['members']
+    for member_id in record['entrants']:
+        members[member_id].coins -= record['buy_in']
+    for winner_id, loser_id in record['matches']:
+        members[winner_id].wins += 1
+        members[loser_id].losses += 1
+        data['pairs'].add_win(winner_id, loser_id)
+    champion = members[record['matches'][-1][0]]
+    champion.coins += record['buy_in'] * len(record['entrants'])
+
+
+def _claim(data: OrderedDict, record: dict) -> None:
+    gambler = data['members'][record['member']]
+    gambler.coins += record['reward']
+    gambler.last_claimed = claimed_at(record['time'])
+
+
+def _send(data: OrderedDict, record: dict) -> None:
+    sender = data['members'][record['sender']]
+    receiver = data['members'][record['receiver']]
+    amount = record['amount']
+    sender.coins -= amount
+    sender.transfers += amount
+    receiver.coins += amount
+    receiver.transfers -= amount
+    data['pairs'].add_transfer(sender.id, receiver.id, amount)
+
+
+def _gift(data: OrderedDict, record: dict) -> None:
+    data['members'][record['member']].coins += record['amount']
+
+
+_HANDLERS: dict[str, Callable[[OrderedDict, dict], None]] = {
+    'join': _join,
+    'leave': _leave,
+    'return': _return,
+    'rename': _rename,
+    'guild': _guild,
+    'gamble': _gamble,
+    'duel': _duel,
+    'gambles': _gambles,
+    'duels': _duels,
+    'tournament': _tournament,
+    'claim': _claim,
+    'send': _send,
+    'gift': _gift,
+}
+
+
+def apply(data: OrderedDict, record: dict) -> None:
+    '''Applies a single transaction record to the guild data'''
+    _HANDLERS[record['op']](data, record)
+
+
+def touched(record: dict) -> tuple[int, ...]:
+    '''Returns the ids of the members whose data the record changes'''
+    if record['op'] == 'duel':
+        return (record['winner'], record['loser'])
+    if record['op'] == 'duels':
+        return (record['member'], record['opponent'])
+    if record['op'] == 'tournament':
+        return tuple(record['entrants'])
+    if record['op'] == 'send':
+        return (record['sender'], record['receiver'])
+    if record['op'] == 'guild':
+        return ()
+    return (record['member'],)
+
+
+def touched_pairs(record: dict) -> list[tuple[int, int]]:
+    '''Returns the pairs of members whose pairwise stats the record changes'''
+    if record['op'] == 'tournament':
+        return [tuple(match) for match in record['matches']]
+    if record['op'] == 'return':
+        return [(record['member'], pair[0]) for pair in record['pairs']]
+    member_ids = touched(record)
+    if len(member_ids) == 2:
+        return [member_ids]
+    return []
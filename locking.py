@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator
+
+from metrics import metrics
+
+
+class RWLock:
+    '''
+    asyncio reader/writer lock. Any number of readers may hold it at once,
+    while a writer holds it alone. A waiting writer is served before readers
+    that arrive after it, so a stream of reads cannot starve the writes.
+    '''
+
+    def __init__(self) -> None:
+        self._readers = 0
+        self._writing = False
+        self._waiters: deque[tuple[bool, asyncio.Future]] = deque()
+
+    def _wake(self) -> None:
+        # grant the lock to the waiters at the head of the queue: either a
+        # single writer, or every reader up to the next writer
+        while self._waiters and not self._writing:
+            is_writer, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if is_writer:
+                if self._readers:
+                    return
+                self._writing = True
+            else:
+                self._readers += 1
+            self._waiters.popleft()
+            future.set_result(None)
+            if is_writer:
+                return
+
+    async def _acquire(self, is_writer: bool) -> None:
+        if not self._waiters and not self._writing and \
+                (not is_writer or not self._readers):
+            if is_writer:
+                self._writing = True
+            else:
+                self._readers += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((is_writer, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the lock was granted right as we were cancelled
+                self._release(is_writer)
+            else:
+                # a cancelled writer may have been holding back readers
+                self._wake()
+            raise
+
+    @property
+    def idle(self) -> bool:
+        '''Whether nobody holds or waits for the lock'''
+        return not self._readers and not self._writing and not self.waiting
+
+    @property
+    def waiting(self) -> bool:
+        return any(not future.done() for _, future in self._waiters)
+
+    def _release(self, is_writer: bool) -> None:
+        if is_writer:
+            self._writing = False
+        else:
+            self._readers -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def _hold(self, is_writer: bool) -> AsyncIterator[None]:
+        start = perf_counter()
+        await self._acquire(is_writer)
+        metrics.observe('lock_wait', perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._release(is_writer)
+
+    def read(self):
+        '''Shared hold for commands that only read the guild data'''
+        return self._hold(False)
+
+    def write(self):
+        '''Exclusive hold for commands and events that change the guild data'''
+        return self._hold(True)
+
+
+class GuildLock:
+    '''
+    Locks of a single guild. Commands that change only a few members hold
+    the guild RWLock shared plus an exclusive lock per member involved, so
+    transactions on disjoint members run in parallel. Events that change
+    the whole guild hold the RWLock exclusively.
+    '''
+
+    def __init__(self) -> None:
+        self.rwlock = RWLock()
+        # member id -> [lock, number of commands holding or waiting for it]
+        self._members: dict[int, list] = {}
+
+    @property
+    def idle(self) -> bool:
+        '''Whether no command or event holds or waits for the guild'''
+        return self.rwlock.idle and not self._members
+
+    def read(self):
+        return self.rwlock.read()
+
+    def write(self):
+        return self.rwlock.write()
+
+    def _member_lock(self, member_id: int) -> asyncio.Lock:
+        entry = self._members.get(member_id)
+        if entry is None:
+            entry = self._members[member_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _drop_member_lock(self, member_id: int) -> None:
+        entry = self._members[member_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._members[member_id]
+
+    @asynccontextmanager
+    async def members(self, *member_ids: int) -> AsyncIterator[None]:
+        '''
+        Exclusive hold on the given members. The member locks are always
+        taken in ascending id order, so two transactions over the same pair
+        can never wait on each other in a cycle.
+        '''
+        ordered = sorted(set(member_ids))
+        start = perf_counter()
+        await self.rwlock._acquire(False)
+        acquired = []
+        try:
+            for member_id in ordered:
+                lock = self._member_lock(member_id)
+                try:
+                    await lock.acquire()
+                except BaseException:
+                    self._drop_member_lock(member_id)
+                    raise
+                acquired.append((member_id, lock))
+
+            metrics.observe('lock_wait', perf_counter() - start)
+            yield
+
+        finally:
+            for member_id, lock in reversed(acquired):
+                lock.release()
+                self._drop_member_lock(member_id)
+            self.rwlock._release(False)
+
+
+class GuildLocks(dict):
+    '''
+    GuildLock of each guild by id, created on first use. The lock of a
+    guild that is idle can be dropped (see GuildStore.evict): on the event
+    loop a lock is looked up and acquired without a suspension in between,
+    so nobody can be left holding a dropped lock while a new one is made.
+    '''
+
+    def __missing__(self, guild_id: int) -> GuildLock:
+        lock = self[guild_id] = GuildLock()
+        return lock
+
+    def discard(self, guild_id: int) -> None:
+        '''Drops the lock of the guild if nobody holds or waits for it'''
+        lock = self.get(guild_id)
+        if lock is not None and lock.idle:
+            del self[guild_id]
+
+
+locks = GuildLocks() # GuildLock for each score_file per server/guild
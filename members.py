@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+from array import array
+from operator import attrgetter
+from time import mktime, strptime
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from snapshot import MemberRows
+
+
+# last_claimed used to be stored as local time in this format
+CLAIMED_FORMAT = '%d %b %Y %H:%M:%S'
+
+
+def claimed_at(value: int | str) -> int:
+    '''last_claimed as epoch seconds, also from the old local time strings'''
+    if isinstance(value, str):
+        return int(mktime(strptime(value, CLAIMED_FORMAT)))
+    return value
+
+
+class Member:
+    '''
+    A member of a guild, with the fields of a member in the score_file
+    except for the pairwise stats, which are in the PairTable.
+    '''
+
+    __slots__ = (
+        'id',
+        'display_name',
+        'coins',
+        'wins',
+        'losses',
+        'transfers',
+        'last_claimed',
+    )
+
+    def __init__(
+        self,
+        member_id: int,
+        display_name: str,
+        coins: int,
+        wins: int,
+        losses: int,
+        transfers: int,
+        last_claimed: int
+    ) -> None:
+        self.id = member_id
+        self.display_name = display_name
+        self.coins = coins
+        self.wins = wins
+        self.losses = losses
+        self.transfers = transfers
+        self.last_claimed = last_claimed
+
+    def __repr__(self) -> str:
+        return f'<Member id={self.id} display_name={self.display_name!r}>'
+
+
+def _fields(member: Member) -> tuple[int, str, int, int, int, int, int]:
+    return (
+        member.id, member.display_name, member.coins, member.wins,
+        member.losses, member.transfers, member.last_claimed,
+    )
+
+
+class MemberTable:
+    '''
+    The members of a guild by id, in the order they joined. column() reads
+    a stat of every member into an array, for work that scans the whole
+    guild such as building the leaderboard.
+
+    A table loaded from a binary snapshot keeps the rows of the snapshot in
+    place (base) and only decodes a row into a Member the first time it is
+    used; members that join later are kept as Members right away. Rows of
+    base whose members left the guild are skipped until the next snapshot.
+    '''
+
+    def __init__(self, base: Optional[MemberRows] = None) -> None:
+        self.base = base
+        self.decoded: dict[int, Member] = {} # row of base -> Member
+        self.members: dict[int, Member] = {} # members that are not in base
+        self.removed: set[int] = set() # rows of base of members that left
+
+    def add(
+        self,
+        member_id: int,
+        display_name: str,
+        coins: int,
+        wins: int,
+        losses: int,
+        transfers: int,
+        last_claimed: int
+    ) -> Member:
+        member = Member(
+            member_id, display_name, coins, wins, losses, transfers, last_claimed
+        )
+        self.members[member_id] = member
+        return member
+
+    def remove(self, member_id: int) -> None:
+        if self.members.pop(member_id, None) is not None:
+            return
+        row = self._find(member_id)
+        if row < 0:
+            raise KeyError(member_id)
+        self.removed.add(row)
+        self.decoded.pop(row, None)
+
+    def copy(self) -> MemberTable:
+        '''
+        A copy that does not change with the table, for a snapshot to be
+        encoded while commands go on. base is shared, it is never written.
+        '''
+        table = MemberTable(self.base)
+        table.decoded = {
+            row: Member(*_fields(member)) for row, member in self.decoded.items()
+        }
+        table.members = {
+            member_id: Member(*_fields(member))
+            for member_id, member in self.members.items()
+        }
+        table.removed = set(self.removed)
+        return table
+
+    def _find(self, member_id: int) -> int:
+        '''Row of the member in base, or -1'''
+        if self.base is None:
+            return -1
+        row = self.base.find(member_id)
+        if row in self.removed:
+            return -1
+        return row
+
+    def _rows(self) -> Iterator[int]:
+        '''Rows of base of the members still in the table'''
+        if self.base is None:
+            return iter(())
+        rows = range(self.base.count)
+        if self.removed:
+            return (row for row in rows if row not in self.removed)
+        return iter(rows)
+
+    def _decode(self, row: int) -> Member:
+        member = self.decoded.get(row)
+        if member is None:
+            base = self.base
+            member = self.decoded[row] = Member(
+                base.ids[row],
+                base.display_name(row),
+                base.coins[row],
+                base.wins[row],
+                base.losses[row],
+                base.transfers[row],
+                base.last_claimed[row],
+            )
+        return member
+
+    def get(self, member_id: int) -> Optional[Member]:
+        member = self.members.get(member_id)
+        if member is None:
+            row = self._find(member_id)
+            if row >= 0:
+                return self._decode(row)
+        return member
+
+    def __getitem__(self, member_id: int) -> Member:
+        member = self.get(member_id)
+        if member is None:
+            raise KeyError(member_id)
+        return member
+
+    def __contains__(self, member_id: int) -> bool:
+        if member_id in self.members:
+            return True
+        return self._find(member_id) >= 0
+
+    def __iter__(self) -> Iterator[Member]:
+        for row in self._rows():
+            yield self._decode(row)
+        yield from self.members.values()
+
+    def __len__(self) -> int:
+        count = len(self.members)
+        if self.base is not None:
+            count += self.base.count - len(self.removed)
+        return count
+
+    def display_name(self, member_id: int) -> Optional[str]:
+        '''display_name of a member, without decoding its row'''
+        member = self.members.get(member_id)
+        if member is not None:
+            return member.display_name
+        row = self._find(member_id)
+        if row < 0:
+            return None
+        member = self.decoded.get(row)
+        if member is not None:
+            return member.display_name
+        return self.base.display_name(row)
+
+    def names(self) -> Iterator[tuple[int, str]]:
+        '''Yields (id, display_name) of every member, without decoding rows'''
+        for row in self._rows():
+            member = self.decoded.get(row)
+            if member is not None:
+                yield member.id, member.display_name
+            else:
+                yield self.base.ids[row], self.base.display_name(row)
+        for member in self.members.values():
+            yield member.id, member.display_name
+
+    def rows(self) -> Iterator[tuple[int, str, int, int, int, int, int]]:
+        '''
+        Yields (id, display_name, coins, wins, losses, transfers,
+        last_claimed) of every member, without decoding rows
+        '''
+        base = self.base
+        for row in self._rows():
+            member = self.decoded.get(row)
+            if member is not None:
+                yield _fields(member)
+            else:
+                yield (
+                    base.ids[row], base.display_name(row), base.coins[row],
+                    base.wins[row], base.losses[row], base.transfers[row],
+                    base.last_claimed[row],
+                )
+        for member in self.members.values():
+            yield _fields(member)
+
+    @property
+    def ids(self) -> array:
+        ids = array('q')
+        if self.removed:
+            ids.extend(self.base.ids[row] for row in self._rows())
+        elif self.base is not None:
+            ids.frombytes(self.base.ids.cast('B'))
+        ids.extend(self.members)
+        return ids
+
+    def column(self, stat: str) -> array:
+        '''
+        coins, wins, losses, transfers or last_claimed of every member, in
+        the order of ids
+        '''
+        column = array('q')
+        if self.removed:
+            base_column = getattr(self.base, stat)
+            decoded = self.decoded
+            column.extend(
+                getattr(decoded[row], stat) if row in decoded else base_column[row]
+                for row in self._rows()
+            )
+        elif self.base is not None:
+            # copy the snapshot column, then the rows changed since
+            column.frombytes(memoryview(getattr(self.base, stat)).cast('B'))
+            for row, member in self.decoded.items():
+                column[row] = getattr(member, stat)
+        column.extend(map(attrgetter(stat), self.members.values()))
+        return column
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from const import METRICS_FILE, METRICS_INTERVAL
+from profiling import profiler
+
+if TYPE_CHECKING:
+    from discord.ext.commands.context import Context
+
+
+# upper bounds of the histogram buckets, from 0.1 ms up to about 18 s, each
+# bucket sqrt(2) times as wide as the one before
+BUCKETS = tuple(0.0001 * 2 ** (n / 2) for n in range(36))
+
+# where the time of a command or event goes
+PHASES = (
+    'total', 'lock_wait', 'storage_read', 'serialize', 'write', 'sync', 'send'
+)
+
+# (guild id, command or event) that the current task is working for, it is
+# carried into the io_pool threads by run_io and into the outbox replies
+_scope: ContextVar[tuple[int, str]] = ContextVar(
+    'metrics_scope', default=(0, 'background')
+)
+_started: ContextVar[float] = ContextVar('metrics_started', default=0.0)
+
+
+class Histogram:
+    '''Counts of observed durations per bucket, plus their sum'''
+
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1) # the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, fraction: float) -> float:
+        '''Upper bound of the bucket that holds the quantile'''
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    '''
+    Histograms of the time spent in each phase, per guild and per command or
+    event. Recording is a dict lookup and a bisect, cheap enough to leave on.
+    Besides, there are plain counters and gauges, such as the hits and
+    evictions of the guild cache. All of them are written every
+    METRICS_INTERVAL seconds to METRICS_FILE in the Prometheus text format,
+    to be scraped locally.
+
+    The io_pool threads record too, so the histograms and counters change
+    under a lock, and are copied under it before they are read.
+    '''
+
+    def __init__(
+        self,
+        filename: str = METRICS_FILE,
+        interval: float = METRICS_INTERVAL
+    ) -> None:
+        self.filename = filename
+        self.interval = interval
+        # (phase, guild id, command) -> Histogram
+        self.histograms: dict[tuple[str, int, str], Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(
+        self,
+        phase: str,
+        seconds: float,
+        scope: Optional[tuple[int, str]] = None
+    ) -> None:
+        '''Records a duration under the given or the current scope'''
+        guild_id, command = scope or _scope.get()
+        key = (phase, guild_id, command)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, perf_counter() - start)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        '''Adds to a counter, exported as gamble_<name>_total'''
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value: float) -> None:
+        '''Sets a gauge, exported as gamble_<name>'''
+        with self._lock:
+            self.gauges[name] = value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def _copy(self) -> tuple[list, list, list]:
+        with self._lock:
+            return (
+                list(self.histograms.items()),
+                list(self.counters.items()),
+                list(self.gauges.items()),
+            )
+
+    def summary(self, guild_id: int, command: Optional[str] = None) -> str:
+        '''Count, average, p50 and p99 of each phase of each command of a guild'''
+        by_command: dict[str, list[tuple[str, Histogram]]] = {}
+        histograms, _, _ = self._copy()
+        for (phase, key_guild, key_command), histogram in histograms:
+            if key_guild == guild_id and command in (None, key_command):
+                by_command.setdefault(key_command, []).append((phase, histogram))
+
+        lines = []
+        for name in sorted(by_command):
+            lines.append(f'**{name}**')
+            phases = sorted(by_command[name], key=lambda item: PHASES.index(item[0]))
+            for phase, histogram in phases:
+                lines.append(
+                    f'  {phase}: {histogram.count} calls, '
+                    f'avg {histogram.total / histogram.count * 1000:.2f} ms, '
+                    f'p50 {histogram.quantile(0.5) * 1000:.2f} ms, '
+                    f'p99 {histogram.quantile(0.99) * 1000:.2f} ms'
+                )
+        return '\n'.join(lines)
+
+    def exposition(self) -> str:
+        '''The histograms in the Prometheus text format'''
+        lines = [
+            '# HELP gamble_phase_seconds Time spent per phase of the commands and events',
+            '# TYPE gamble_phase_seconds histogram',
+        ]
+        histograms, counters, gauges = self._copy()
+        for (phase, guild_id, command), histogram in sorted(histograms):
+            labels = f'phase="{phase}",guild="{guild_id}",command="{command}"'
+            seen = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                seen += count
+                lines.append(
+                    f'gamble_phase_seconds_bucket{{{labels},le="{bound:g}"}} {seen}'
+                )
+            lines.append(
+                f'gamble_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}'
+            )
+            lines.append(f'gamble_phase_seconds_sum{{{labels}}} {histogram.total}')
+            lines.append(f'gamble_phase_seconds_count{{{labels}}} {histogram.count}')
+        for name, value in sorted(counters):
+            lines.append(f'# TYPE gamble_{name}_total counter')
+            lines.append(f'gamble_{name}_total {value}')
+        for name, value in sorted(gauges):
+            lines.append(f'# TYPE gamble_{name} gauge')
+            lines.append(f'gamble_{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, text: str) -> None:
+        # written aside and renamed, a scrape never sees a partial file
+        with open(self.filename + '.tmp', 'w') as metrics_file:
+            metrics_file.write(text)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.write, self.exposition())
+            except OSError as error:
+                print(f'Failed to write {self.filename}: {error}')
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+metrics = Metrics()
+
+
+def current_scope() -> tuple[int, str]:
+    return _scope.get()
+
+
+@contextmanager
+def scope(guild_id: int, name: str) -> Iterator[None]:
+    '''Attributes the time recorded inside to the guild and command or event'''
+    token = _scope.set((guild_id, name))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+async def before_command(ctx: Context) -> None:
+    '''Bot before_invoke hook, starts the scope of the command'''
+    guild_id = ctx.guild.id if ctx.guild else 0
+    _scope.set((guild_id, ctx.command.qualified_name))
+    _started.set(perf_counter())
+    profiler.enter(guild_id)
+
+
+async def after_command(ctx: Context) -> None:
+    '''Bot after_invoke hook, records the total time of the command'''
+    metrics.observe('total', perf_counter() - _started.get())
+    profiler.exit(_scope.get()[0])
+
+
+def _guild_id(event_args: tuple) -> int:
+    # events get a guild, or a member or context that belongs to one
+    for arg in event_args:
+        guild = getattr(arg, 'guild', arg)
+        if hasattr(guild, 'system_channel'):
+            return guild.id
+    return 0
+
+
+def timed(name: str) -> Callable:
+    '''Decorates an event listener to record its total time under the scope'''
+
+    def decorator(listener: Callable) -> Callable:
+        @functools.wraps(listener)
+        async def wrapper(cog, *args):
+            with scope(_guild_id(args), name):
+                start = perf_counter()
+                try:
+                    return await listener(cog, *args)
+                finally:
+                    metrics.observe('total', perf_counter() - start)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+from time import perf_counter
+from typing import Optional
+
+from const import LAG_INTERVAL
+
+
+class LoopLagMonitor:
+    '''
+    Measures how late the event loop wakes up a short periodic sleep, which
+    is how long something blocked the loop, and reports the longest stall
+    of every LAG_INTERVAL seconds.
+    '''
+
+    def __init__(
+        self,
+        interval: float = LAG_INTERVAL,
+        tick: float = 0.1
+    ) -> None:
+        self.interval = interval
+        self.tick = tick
+        self.longest = 0.0 # longest stall in the current interval
+        self.last_report = 0.0 # longest stall in the previous interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        elapsed = 0.0
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(self.tick)
+            took = perf_counter() - start
+            self.longest = max(self.longest, took - self.tick)
+            elapsed += took
+            if elapsed >= self.interval:
+                self.report()
+                elapsed = 0.0
+
+    def report(self) -> None:
+        print(f'Longest event loop stall: {self.longest * 1000:.1f} ms')
+        self.last_report = self.longest
+        self.longest = 0.0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
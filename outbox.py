@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, Optional
+
+from const import SEND_RATE, SEND_PERIOD
+from metrics import current_scope, metrics
+
+if TYPE_CHECKING:
+    from discord.abc import Messageable
+    from discord.ui import View
+
+
+MAX_MESSAGE_LENGTH = 2000 # Discord limit per message
+
+Reply = tuple[str, Optional['View'], tuple[int, str]]
+
+
+class Outbox:
+    '''
+    Queue of the bot replies, sent in the background so that commands never
+    wait on Discord while holding a lock. Replies are sent in order per
+    channel, replies that pile up while a channel is busy are joined into
+    one message, and each channel sends at most SEND_RATE messages per
+    SEND_PERIOD seconds.
+    '''
+
+    def __init__(self, rate: int = SEND_RATE, period: float = SEND_PERIOD) -> None:
+        self.rate = rate
+        self.period = period
+        # queued (content, view, metrics scope of the sender) per channel id
+        self._pending: dict[int, deque[Reply]] = {}
+        self._sent: dict[int, deque[float]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+
+    def send(
+        self,
+        channel: Messageable,
+        content: str,
+        view: Optional[View] = None
+    ) -> None:
+        '''Queues a reply to the channel and returns right away'''
+        self._pending.setdefault(channel.id, deque()).append(
+            (content, view, current_scope())
+        )
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(
+                self._deliver(channel)
+            )
+
+    def _next_message(self, pending: deque[Reply]) -> Reply:
+        # join as many queued replies as fit in a single message, replies
+        # with a view (e.g. page buttons) are always sent on their own; the
+        # message is timed under the scope of its first reply
+        content, view, scope = pending.popleft()
+        if view is not None:
+            return content, view, scope
+        while pending and pending[0][1] is None and \
+                len(content) + 1 + len(pending[0][0]) <= MAX_MESSAGE_LENGTH:
+            content += '\n' + pending.popleft()[0]
+        return content, None, scope
+
+    async def _wait_turn(self, channel_id: int) -> None:
+        sent = self._sent.setdefault(channel_id, deque(maxlen=self.rate))
+        if len(sent) == self.rate:
+            delay = sent[0] + self.period - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sent.append(monotonic())
+
+    async def _deliver(self, channel: Messageable) -> None:
+        pending = self._pending[channel.id]
+        try:
+            while pending:
+                await self._wait_turn(channel.id)
+                content, view, scope = self._next_message(pending)
+                start = perf_counter()
+                try:
+                    if view is None:
+                        await channel.send(content)
+                    else:
+                        await channel.send(content, view=view)
+                    metrics.observe('send', perf_counter() - start, scope)
+                except Exception as error:
+                    print(f'Failed to send to channel {channel.id}: {error}')
+        finally:
+            del self._workers[channel.id]
+            if not pending:
+                del self._pending[channel.id]
+
+    async def drain(self) -> None:
+        '''Waits until every queued reply is sent'''
+        while self._workers:
+            await asyncio.gather(*self._workers.values())
+
+
+outbox = Outbox()
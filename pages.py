@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+import discord
+
+from const import PAGE_SIZE, PAGE_TIMEOUT
+from locking import locks
+from outbox import outbox
+from state import store
+
+if TYPE_CHECKING:
+    from discord.abc import Messageable
+    from state import GuildState
+
+
+class Pages:
+    '''
+    A listing split into pages of PAGE_SIZE lines. rows(state) returns a
+    fresh generator over the resident guild data, and only the rows of the
+    page being viewed are turned into lines by line(state, row).
+    '''
+
+    def __init__(
+        self,
+        title: str,
+        rows: Callable[[GuildState], Iterator[Any]],
+        line: Callable[[GuildState, Any], str],
+        page_size: int = PAGE_SIZE
+    ) -> None:
+        self.title = title
+        self.rows = rows
+        self.line = line
+        self.page_size = page_size
+
+    def render(self, state: GuildState, page: int) -> tuple[str, bool]:
+        '''Returns the content of the page and whether a next page exists'''
+        start = page * self.page_size
+        # read one row past the page to know if there is a next one
+        chunk = list(islice(self.rows(state), start, start + self.page_size + 1))
+        has_next = len(chunk) > self.page_size
+
+        body = ''.join(self.line(state, row) for row in chunk[:self.page_size])
+        if not body:
+            body = 'Nothing to show\n'
+        if page > 0 or has_next:
+            body += f'Page {page + 1}'
+        return self.title + body, has_next
+
+
+class PageView(discord.ui.View):
+    '''
+    Previous and Next buttons that re-render a Pages on every click. Only
+    the guild id is kept, the guild may be unloaded and loaded again while
+    the buttons are shown.
+    '''
+
+    def __init__(
+        self,
+        pages: Pages,
+        guild_id: int,
+        timeout: float = PAGE_TIMEOUT
+    ) -> None:
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.guild_id = guild_id
+        self.page = 0
+        self.previous.disabled = True
+
+    async def show(self, interaction: discord.Interaction) -> None:
+        async with locks[self.guild_id].read():
+            state = await store.get(self.guild_id)
+            content, has_next = self.pages.render(state, self.page)
+        self.previous.disabled = self.page == 0
+        self.next.disabled = not has_next
+        await interaction.response.edit_message(content=content, view=self)
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous(
+        self,
+        interaction: discord.Interaction,
+        button: discord.ui.Button
+    ) -> None:
+        self.page = max(self.page - 1, 0)
+        await self.show(interaction)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next(
+        self,
+        interaction: discord.Interaction,
+        button: discord.ui.Button
+    ) -> None:
+        self.page += 1
+        await self.show(interaction)
+
+
+def send_pages(channel: Messageable, pages: Pages, state: GuildState) -> None:
+    '''
+    Queues the first page of the listing, with page buttons if it does not
+    fit in one page. Call with the guild lock held for reading.
+    '''
+    content, has_next = pages.render(state, 0)
+    if has_next:
+        outbox.send(channel, content, view=PageView(pages, state.guild_id))
+    else:
+        outbox.send(channel, content)
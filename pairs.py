@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left, insort
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from snapshot import PairRows
+
+
+SCORE = 1 # the pair has dueled
+TRANSFER = 2 # the pair has sent coins to each other
+
+_ROW = (1 << 32) - 1 # row bits of an adjacency entry
+
+
+def _thaw(typecode: str, column: array | memoryview) -> array:
+    '''Returns the column as an array that can grow'''
+    if isinstance(column, array):
+        return column
+    thawed = array(typecode)
+    thawed.frombytes(column.cast('B'))
+    return thawed
+
+
+def _copy(typecode: str, column: array | memoryview) -> array:
+    if isinstance(column, array):
+        return column[:]
+    return _thaw(typecode, column)
+
+
+class PairTable:
+    '''
+    Head-to-head scores and net transfers of the pairs of members of a guild
+    that have dueled or sent coins to each other. Members that have a pair
+    get a dense index, and each pair is a single row of array columns shared
+    by both members: the dense indexes of the first and second member, the
+    duels each of them won, the net coins first sent to second, and which of
+    SCORE and TRANSFER the pair has.
+
+    Every member has a sorted adjacency array of (partner << 32 | row), so a
+    pair is found with a bisect and the pairs of a member are read off one
+    array, without any per-pair Python objects.
+
+    The pairs of a member who leaves the guild are archived (see archive),
+    their rows stay behind with no kind and no adjacency entries until the
+    next snapshot leaves them out.
+
+    A table loaded from a binary snapshot uses the snapshot in place (base):
+    the dense index of a member is its row in the snapshot, and the columns
+    and adjacency arrays are views of the snapshot, which are copied into
+    arrays only once they need to grow.
+    '''
+
+    def __init__(self, base: Optional[PairRows] = None) -> None:
+        self.base = base
+        self.index: dict[int, int] = {} # member id -> dense index, if not in base
+        self.adjacency: dict[int, array] = {} # dense index -> adjacency, if not in base
+
+        if base is None:
+            self.ids = array('q') # dense index -> member id
+            self.first = array('i')
+            self.second = array('i')
+            self.first_wins = array('q')
+            self.second_wins = array('q')
+            self.sent = array('q')
+            self.kind = array('B')
+        else:
+            self.ids = base.members.ids
+            self.first = base.first
+            self.second = base.second
+            self.first_wins = base.first_wins
+            self.second_wins = base.second_wins
+            self.sent = base.sent
+            self.kind = base.kind
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def copy(self) -> PairTable:
+        '''
+        A copy that does not change with the table, for a snapshot to be
+        encoded while commands go on. The columns may be views of base that
+        are written in place, so they are copied; the adjacency of base is
+        only ever replaced, and is shared.
+        '''
+        table = PairTable.__new__(PairTable)
+        table.base = self.base
+        table.index = dict(self.index)
+        table.adjacency = {
+            i: adjacency[:] for i, adjacency in self.adjacency.items()
+        }
+        table.ids = _copy('q', self.ids)
+        table.first = _copy('i', self.first)
+        table.second = _copy('i', self.second)
+        table.first_wins = _copy('q', self.first_wins)
+        table.second_wins = _copy('q', self.second_wins)
+        table.sent = _copy('q', self.sent)
+        table.kind = _copy('B', self.kind)
+        return table
+
+    def _index_of(self, member_id: int) -> Optional[int]:
+        i = self.index.get(member_id)
+        if i is None and self.base is not None:
+            row = self.base.members.find(member_id)
+            if row >= 0:
+                return row
+        return i
+
+    def _member(self, member_id: int) -> int:
+        i = self._index_of(member_id)
+        if i is None:
+            self.ids = _thaw('q', self.ids)
+            i = self.index[member_id] = len(self.ids)
+            self.ids.append(member_id)
+            self.adjacency[i] = array('q')
+        return i
+
+    def _adjacent(self, i: int) -> array | memoryview:
+        adjacency = self.adjacency.get(i)
+        if adjacency is None:
+            # members of the snapshot that have no new pairs
+            offsets = self.base.offsets
+            return self.base.adjacency[offsets[i]:offsets[i + 1]]
+        return adjacency
+
+    def _grow(self, i: int, j: int, row: int) -> None:
+        self.first = _thaw('i', self.first)
+        self.second = _thaw('i', self.second)
+        self.first_wins = _thaw('q', self.first_wins)
+        self.second_wins = _thaw('q', self.second_wins)
+        self.sent = _thaw('q', self.sent)
+        self.kind = _thaw('B', self.kind)
+        for member, partner in ((i, j), (j, i)):
+            if member not in self.adjacency:
+                self.adjacency[member] = _thaw('q', self._adjacent(member))
+            insort(self.adjacency[member], partner << 32 | row)
+
+    def _find(self, i: int, j: int) -> int:
+        adjacency = self._adjacent(i)
+        pos = bisect_left(adjacency, j << 32)
+        if pos < len(adjacency) and adjacency[pos] >> 32 == j:
+            return adjacency[pos] & _ROW
+        return -1
+
+    def _row(self, member_id: int, other_id: int) -> tuple[int, bool]:
+        '''Row of the pair, added if new, and whether member is its first'''
+        i = self._member(member_id)
+        j = self._member(other_id)
+        row = self._find(i, j)
+        if row < 0:
+            row = len(self.kind)
+            self._grow(i, j, row)
+            self.first.append(min(i, j))
+            self.second.append(max(i, j))
+            self.first_wins.append(0)
+            self.second_wins.append(0)
+            self.sent.append(0)
+            self.kind.append(0)
+        return row, i < j
+
+    def _lookup(self, member_id: int, other_id: int) -> tuple[int, bool]:
+        i = self._index_of(member_id)
+        j = self._index_of(other_id)
+        if i is None or j is None:
+            return -1, False
+        return self._find(i, j), i < j
+
+    def _view(self, row: int, is_first: bool) -> tuple[int, int, int, int]:
+        # (wins, losses, sent, kind) from the point of view of one member
+        if is_first:
+            return (self.first_wins[row], self.second_wins[row],
+                    self.sent[row], self.kind[row])
+        return (self.second_wins[row], self.first_wins[row],
+                -self.sent[row], self.kind[row])
+
+    def add_win(self, winner_id: int, loser_id: int, count: int = 1) -> None:
+        row, is_first = self._row(winner_id, loser_id)
+        if is_first:
+            self.first_wins[row] += count
+        else:
+            self.second_wins[row] += count
+        self.kind[row] |= SCORE
+
+    def add_transfer(self, sender_id: int, receiver_id: int, amount: int) -> None:
+        row, is_first = self._row(sender_id, receiver_id)
+        self.sent[row] += amount if is_first else -amount
+        self.kind[row] |= TRANSFER
+
+    def get(
+        self,
+        member_id: int,
+        other_id: int
+    ) -> Optional[tuple[int, int, int, int]]:
+        '''(wins, losses, sent, kind) of the member against the other'''
+        row, is_first = self._lookup(member_id, other_id)
+        if row < 0:
+            return None
+        return self._view(row, is_first)
+
+    def set(
+        self,
+        member_id: int,
+        other_id: int,
+        wins: int,
+        losses: int,
+        sent: int,
+        kind: int
+    ) -> None:
+        '''Overwrites a pair, from the point of view of the member'''
+        row, is_first = self._row(member_id, other_id)
+        if not is_first:
+            wins, losses, sent = losses, wins, -sent
+        self.first_wins[row] = wins
+        self.second_wins[row] = losses
+        self.sent[row] = sent
+        self.kind[row] = kind
+
+    def score(self, member_id: int, other_id: int) -> Optional[tuple[int, int]]:
+        '''(wins, losses) of the member against the other, if they dueled'''
+        pair = self.get(member_id, other_id)
+        if pair is None or not pair[3] & SCORE:
+            return None
+        return pair[0], pair[1]
+
+    def transfer(self, member_id: int, other_id: int) -> Optional[int]:
+        '''Net coins the member sent to the other, if they ever sent any'''
+        pair = self.get(member_id, other_id)
+        if pair is None or not pair[3] & TRANSFER:
+            return None
+        return pair[2]
+
+    def partners(self, member_id: int) -> Iterator[tuple[int, int, int, int, int]]:
+        '''Yields (other id, wins, losses, sent, kind) for each pair of the member'''
+        i = self._index_of(member_id)
+        if i is None:
+            return
+        for entry in self._adjacent(i):
+            j = entry >> 32
+            yield (self.ids[j], *self._view(entry & _ROW, i < j))
+
+    def scores(self, member_id: int) -> Iterator[tuple[int, int, int]]:
+        '''Yields (other id, wins, losses) for everyone the member dueled'''
+        for other_id, wins, losses, _, kind in self.partners(member_id):
+            if kind & SCORE:
+                yield other_id, wins, losses
+
+    def transfers(self, member_id: int) -> Iterator[tuple[int, int]]:
+        '''Yields (other id, net coins sent) for everyone the member sent to'''
+        for other_id, _, _, sent, kind in self.partners(member_id):
+            if kind & TRANSFER:
+                yield other_id, sent
+
+    def remove_member(self, member_id: int) -> None:
+        '''Drops every pair of the member'''
+        i = self._index_of(member_id)
+        if i is None:
+            return
+        for entry in self._adjacent(i):
+            j, row = entry >> 32, entry & _ROW
+            self.kind[row] = 0
+            if j not in self.adjacency:
+                self.adjacency[j] = _thaw('q', self._adjacent(j))
+            partner = self.adjacency[j]
+            del partner[bisect_left(partner, i << 32 | row)]
+        self.adjacency[i] = array('q')
+
+    def rows(self) -> Iterator[tuple[int, int, int, int, int, int]]:
+        '''Yields every pair as (first id, second id, wins, losses, sent, kind)'''
+        for row in range(len(self.kind)):
+            if not self.kind[row]:
+                continue # the pair of a member who left
+            yield (self.ids[self.first[row]], self.ids[self.second[row]],
+                   *self._view(row, True))
+
+    def load_per_mem(
+        self,
+        member_id: int,
+        wins_per_mem: dict[str, int],
+        losses_per_mem: dict[str, int],
+        transfers_per_mem: dict[str, int]
+    ) -> None:
+        '''Adds the pairs of a member from its score_file dicts'''
+        for other in wins_per_mem.keys() | losses_per_mem.keys() \
+                | transfers_per_mem.keys():
+            kind = 0
+            if other in wins_per_mem or other in losses_per_mem:
+                kind |= SCORE
+            if other in transfers_per_mem:
+                kind |= TRANSFER
+            # each pair is in the dicts of both members, with the same values
+            self.set(
+                member_id,
+                int(other),
+                wins_per_mem.get(other, 0),
+                losses_per_mem.get(other, 0),
+                transfers_per_mem.get(other, 0),
+                kind
+            )
+
+    def per_mem(self, member_id: int) -> tuple[dict, dict, dict]:
+        '''The wins_per_mem, losses_per_mem and transfers_per_mem of a member'''
+        wins_per_mem = {}
+        losses_per_mem = {}
+        transfers_per_mem = {}
+        for other_id, wins, losses, sent, kind in self.partners(member_id):
+            if wins:
+                wins_per_mem[str(other_id)] = wins
+            if losses:
+                losses_per_mem[str(other_id)] = losses
+            if kind & TRANSFER:
+                transfers_per_mem[str(other_id)] = sent
+        return wins_per_mem, losses_per_mem, transfers_per_mem
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from time import sleep, strftime
+from typing import Callable, Optional
+
+from const import PROFILE_PATH, SAMPLE_INTERVAL
+
+
+MODES = ('cprofile', 'sample')
+MAX_DEPTH = 64 # frames of a collapsed stack
+
+
+def _label(filename: str, line: int, function: str) -> str:
+    return f'{function} ({os.path.basename(filename)}:{line})'
+
+
+class _Sampler(threading.Thread):
+    '''
+    Samples the stack of the event loop thread every SAMPLE_INTERVAL seconds
+    while a profiled command is running, and counts the collapsed stacks.
+    '''
+
+    def __init__(self, loop_thread: int, profiling: Callable[[], bool]) -> None:
+        super().__init__(name='sampler', daemon=True)
+        self.loop_thread = loop_thread
+        self.profiling = profiling
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            sleep(SAMPLE_INTERVAL)
+            if not self.profiling():
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append(_label(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class Session:
+    '''
+    Profiles the commands of one guild, for the next "count" commands or
+    for "seconds" seconds. The profiler runs whenever a command of the guild
+    is running; as commands of other guilds run in between on the same event
+    loop, their frames can show up too while a profiled command awaits.
+    '''
+
+    def __init__(
+        self,
+        guild_id: int,
+        mode: str,
+        count: Optional[int],
+        seconds: Optional[float],
+        done: Callable[[str, str], None]
+    ) -> None:
+        self.guild_id = guild_id
+        self.mode = mode
+        self.remaining = count
+        self.done = done
+        self.running: set[asyncio.Task] = set()
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+        self.sampler = None
+        if mode == 'sample':
+            self.sampler = _Sampler(threading.get_ident(), lambda: bool(self.running))
+            self.sampler.start()
+        self.timer = None
+        if seconds is not None:
+            self.timer = asyncio.get_running_loop().call_later(seconds, profiler.stop)
+
+    def enter(self, task: asyncio.Task) -> None:
+        if not self.running and self.profile is not None:
+            self.profile.enable()
+        self.running.add(task)
+
+    def exit(self, task: asyncio.Task) -> bool:
+        '''Returns whether the session is over'''
+        if task not in self.running:
+            return False
+        self.running.discard(task)
+        if not self.running and self.profile is not None:
+            self.profile.disable()
+        if self.remaining is not None:
+            self.remaining -= 1
+            return self.remaining <= 0
+        return False
+
+    def close(self) -> None:
+        '''Stops profiling, on the event loop thread which cProfile is bound to'''
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.profile is not None and self.running:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stopped.set()
+        self.running.clear()
+
+    def finish(self) -> tuple[str, str]:
+        '''Writes the sorted report and the collapsed stacks, returns their files'''
+        if self.profile is not None:
+            report, stacks = _cprofile_report(self.profile)
+        else:
+            self.sampler.join()
+            report, stacks = _sample_report(self.sampler.stacks)
+
+        os.makedirs(PROFILE_PATH, exist_ok=True)
+        name = f'{PROFILE_PATH}{self.guild_id}-{strftime("%Y%m%d-%H%M%S")}'
+        with open(f'{name}.txt', 'w') as report_file:
+            report_file.write(report)
+        with open(f'{name}.folded', 'w') as stacks_file:
+            stacks_file.write(stacks)
+        return f'{name}.txt', f'{name}.folded'
+
+
+def _cprofile_report(profile: cProfile.Profile) -> tuple[str, str]:
+    report = io.StringIO()
+    stats = pstats.Stats(profile, stream=report)
+    stats.sort_stats('cumulative').print_stats(100)
+
+    # cProfile only knows callers, so the stacks are rebuilt from the call
+    # graph by splitting the time of each function over the calls it made
+    callees: dict[tuple, list[tuple[tuple, float]]] = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, cumulative))
+
+    stacks: Counter[str] = Counter()
+
+    def expand(function: tuple, stack: list[str], share: float) -> None:
+        _, _, own, cumulative, _ = stats.stats[function]
+        stack = stack + [_label(*function)]
+        if cumulative > 0:
+            stacks[';'.join(stack)] += share * own / cumulative
+        if len(stack) >= MAX_DEPTH:
+            return
+        for callee, time in callees.get(function, ()):
+            # skip recursion, it would repeat the same time
+            if cumulative > 0 and _label(*callee) not in stack:
+                expand(callee, stack, share * time / cumulative)
+
+    for function, (_, _, _, cumulative, callers) in stats.stats.items():
+        if not callers:
+            expand(function, [], cumulative)
+
+    # collapsed stack values are integers, here in microseconds
+    lines = (
+        f'{stack} {round(seconds * 1e6)}\n'
+        for stack, seconds in stacks.items() if round(seconds * 1e6) > 0
+    )
+    return report.getvalue(), ''.join(lines)
+
+
+def _sample_report(samples: Counter[str]) -> tuple[str, str]:
+    own: Counter[str] = Counter()
+    total: Counter[str] = Counter()
+    for stack, count in samples.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+
+    sample_count = sum(samples.values())
+    lines = [
+        f'{sample_count} samples, every {SAMPLE_INTERVAL * 1000:g} ms\n\n',
+        f'{"own":>8} {"total":>8}  function\n',
+    ]
+    for frame, count in own.most_common():
+        lines.append(f'{count:8} {total[frame]:8}  {frame}\n')
+    stacks = ''.join(f'{stack} {count}\n' for stack, count in samples.items())
+    return ''.join(lines), stacks
+
+
+class Profiler:
+    '''Runs at most one profiling Session at a time'''
+
+    def __init__(self) -> None:
+        self.session: Optional[Session] = None
+
+    def start(
+        self,
+        guild_id: int,
+        mode: str,
+        done: Callable[[str, str], None],
+        count: Optional[int] = None,
+        seconds: Optional[float] = None
+    ) -> None:
+        '''done gets the files of the report and of the collapsed stacks'''
+        self.session = Session(guild_id, mode, count, seconds, done)
+
+    def enter(self, guild_id: int) -> None:
+        '''Called as a command of the guild starts'''
+        session = self.session
+        if session is not None and session.guild_id == guild_id:
+            session.enter(asyncio.current_task())
+
+    def exit(self, guild_id: int) -> None:
+        '''Called as a command of the guild ends'''
+        session = self.session
+        if session is not None and session.guild_id == guild_id:
+            if session.exit(asyncio.current_task()):
+                self.stop()
+
+    def stop(self) -> None:
+        session = self.session
+        if session is None:
+            return
+        self.session = None
+        session.close()
+
+        async def finish() -> None:
+            loop = asyncio.get_running_loop()
+            try:
+                files = await loop.run_in_executor(None, session.finish)
+            except OSError as error:
+                print(f'Failed to write the profile: {error}')
+                return
+            session.done(*files)
+
+        asyncio.create_task(finish())
+
+
+profiler = Profiler()
@@ -0,0 +1,95 @@
+'''
+Moves the stored guilds to their shard directories for a shard count, on
+the first sharded start or after SHARD_COUNT changed.
+
+    python reshard.py <shard_count>
+
+Guilds are looked for in PATH and in every PATH/shard<id>/ directory, and
+each one goes to PATH/shard<n>/ with n its shard (see storage.shard_of), or
+back to PATH itself for a single shard. launcher.py runs this before it
+starts the workers; stop the bot before running it by hand.
+'''
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+
+from const import PATH, STORAGE_BACKEND
+from durability import fsync_dir
+from storage import (
+    SQLITE_FILE,
+    SqliteStorage,
+    guild_path,
+    stored_guilds,
+)
+
+EXTENSIONS = ('json', 'snapshot', 'journal', 'journal.old', 'archive')
+# members in the order they joined, the other tables have no order
+TABLES = {
+    'guilds': '',
+    'members': ' ORDER BY rowid',
+    'pairs': '',
+    'archived_members': '',
+    'archived_pairs': '',
+}
+
+
+def move_files(guild_id: int, source: str, target: str) -> None:
+    for extension in EXTENSIONS:
+        filename = f'{guild_id}.{extension}'
+        if not os.path.exists(f'{source}{filename}'):
+            continue
+        if os.path.exists(f'{target}{filename}'):
+            raise RuntimeError(f'{filename} is in both {source} and {target}')
+        os.replace(f'{source}{filename}', f'{target}{filename}')
+    fsync_dir(target)
+    fsync_dir(source)
+
+
+def move_rows(guild_id: int, source: str, target: str) -> None:
+    # opening them creates the tables, and migrates an old source database
+    for path in (source, target):
+        SqliteStorage(f'{path}{SQLITE_FILE}').close()
+
+    db = sqlite3.connect(f'{target}{SQLITE_FILE}')
+    try:
+        db.execute('ATTACH DATABASE ? AS source', (f'{source}{SQLITE_FILE}',))
+        # copied before deleted: after a crash, running again finishes it
+        with db:
+            for table, order in TABLES.items():
+                db.execute(
+                    f'INSERT OR REPLACE INTO main.{table} '
+                    f'SELECT * FROM source.{table} WHERE guild_id = ?{order}',
+                    (guild_id,)
+                )
+                db.execute(
+                    f'DELETE FROM source.{table} WHERE guild_id = ?',
+                    (guild_id,)
+                )
+    finally:
+        db.close()
+
+
+def reshard(backend: str, path: str, shard_count: int) -> int:
+    '''Moves every guild under path to its directory, returns how many moved'''
+    moved = 0
+    for guild_id, source in stored_guilds(backend, path):
+        target = guild_path(path, guild_id, shard_count)
+        if source == target:
+            continue
+        os.makedirs(target, exist_ok=True)
+        if backend == 'sqlite':
+            move_rows(guild_id, source, target)
+        else:
+            move_files(guild_id, source, target)
+        moved += 1
+    return moved
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or not sys.argv[1].isdigit() or int(sys.argv[1]) < 1:
+        raise SystemExit(__doc__)
+    shard_count = int(sys.argv[1])
+    moved = reshard(STORAGE_BACKEND, PATH, shard_count)
+    print(f'Moved {moved} guilds to their directories for {shard_count} shards')
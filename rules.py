@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from typing import TypeVar
+
+from const import INITIAL_COINS, MIN_REWARD, MAX_REWARD, REWARD_TIMER
+
+
+# a Python number for the cogs, or a NumPy array for the simulator
+N = TypeVar('N')
+
+
+class Rules:
+    '''
+    The rules of the economy: how gamble, yolo, claim and send move coins.
+    The cogs and the simulator (simulate.py) both go through these methods,
+    so the two cannot drift apart. Every method is elementwise and works on
+    Python numbers as well as on NumPy arrays, and randomness comes in as
+    draws so that each side can use its own generator.
+    '''
+
+    def __init__(
+        self,
+        initial_coins: int = INITIAL_COINS,
+        min_reward: int = MIN_REWARD,
+        max_reward: int = MAX_REWARD,
+        reward_timer: int = REWARD_TIMER,
+        win_chance: float = 0.5
+    ) -> None:
+        self.initial_coins = initial_coins
+        self.min_reward = min_reward
+        self.max_reward = max_reward
+        self.reward_timer = reward_timer
+        self.win_chance = win_chance
+
+    @property
+    def reward_choices(self) -> int:
+        '''Number of possible claim rewards, draws are in range(reward_choices)'''
+        return self.max_reward - self.min_reward + 1
+
+    @property
+    def claim_interval(self) -> int:
+        '''Seconds between two claims'''
+        return self.reward_timer * 60
+
+    def won(self, draw: N) -> N:
+        '''Whether a gamble or duel is won, for a uniform draw in [0, 1)'''
+        return draw < self.win_chance
+
+    def valid_bet(self, bet: N, coins: N) -> N:
+        '''Whether a player with the coins can bet, or take a duel of, bet'''
+        return (bet > 0) & (bet <= coins)
+
+    def payout(self, bet: N, won: N) -> N:
+        '''Change of the coins of the gambler for a bet that was won or lost'''
+        return bet * (2 * won - 1)
+
+    def reward(self, draw: N) -> N:
+        '''Claim reward for a draw in range(reward_choices)'''
+        return self.min_reward + draw
+
+    def can_claim(self, elapsed: N) -> N:
+        '''Whether a claim is due, elapsed seconds after the last one'''
+        return elapsed >= self.claim_interval
+
+    def minutes_left(self, elapsed: N) -> N:
+        '''Minutes until the next claim, elapsed seconds after the last one'''
+        return self.reward_timer - elapsed // 60
+
+    def valid_send(self, amount: N, coins: N) -> N:
+        '''Whether a player with the coins can send the amount'''
+        return (amount >= 1) & (amount <= coins)
+
+
+rules = Rules()
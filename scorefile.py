@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+from members import Member, MemberTable, claimed_at
+from pairs import PairTable
+
+
+# The score_file layout (database/sample_json_file.txt) keeps each member as
+# a dict, with its pairwise stats in wins_per_mem, losses_per_mem and
+# transfers_per_mem dicts. In memory the members are Member records in a
+# MemberTable under data['members'], and the pairwise stats are in a
+# PairTable under data['pairs']; these functions convert between the two.
+# last_claimed is in epoch seconds, older files have local time strings.
+
+
+def decode(raw: OrderedDict) -> OrderedDict:
+    '''Turns a loaded score_file into guild data, in place'''
+    members = MemberTable()
+    pairs = PairTable()
+    for member in raw['members'].values():
+        members.add(
+            member['id'],
+            member['display_name'],
+            member['coins'],
+            member['wins'],
+            member['losses'],
+            member['transfers'],
+            claimed_at(member['last_claimed']),
+        )
+        pairs.load_per_mem(
+            member['id'],
+            member.get('wins_per_mem', {}),
+            member.get('losses_per_mem', {}),
+            member.get('transfers_per_mem', {}),
+        )
+    raw['members'] = members
+    raw['pairs'] = pairs
+    return raw
+
+
+def _encode_member(member: Member, pairs: PairTable) -> OrderedDict:
+    '''Returns a member in the score_file layout'''
+    wins, losses, transfers = pairs.per_mem(member.id)
+    member_data = OrderedDict()
+    member_data['id'] = member.id
+    member_data['display_name'] = member.display_name
+    member_data['coins'] = member.coins
+    member_data['wins'] = member.wins
+    member_data['losses'] = member.losses
+    member_data['transfers'] = member.transfers
+    member_data['last_claimed'] = member.last_claimed
+    member_data['wins_per_mem'] = wins
+    member_data['losses_per_mem'] = losses
+    member_data['transfers_per_mem'] = transfers
+    return member_data
+
+
+def encode(data: OrderedDict) -> OrderedDict:
+    '''Returns the guild data in the score_file layout, ready to be dumped'''
+    raw = OrderedDict()
+    for key, value in data.items():
+        if key != 'pairs':
+            raw[key] = value
+
+    raw['members'] = {
+        str(member.id): _encode_member(member, data['pairs'])
+        for member in data['members']
+    }
+    return raw
@@ -0,0 +1,193 @@
+'''
+Monte Carlo simulation of the economy of a guild, to tune the rewards.
+
+    python simulate.py [--players N] [--days D] [--guilds G] [--seed S]
+                       [--initial-coins C] [--min-reward R] [--max-reward R]
+                       [--reward-timer M]
+
+Each round is ROUND_MINUTES of guild time, in which every player is active
+with ACTIVE_CHANCE and then does one of the commands in ACTIONS. Gambles,
+duels, claims and sends are settled with the same Rules as the cogs, over
+all players at once. Reports, once per simulated day, the coin supply and
+its growth, the Gini coefficient of the coins, and the share of bankrupt
+players (no coins left), averaged over the guilds.
+'''
+from __future__ import annotations
+
+import argparse
+from time import perf_counter
+
+import numpy as np # pip install numpy
+
+from rules import Rules
+
+ROUND_MINUTES = 10
+ACTIVE_CHANCE = 0.3 # of a player doing something in a round
+
+# share of each command among the active players
+ACTIONS = {'gamble': 0.45, 'yolo': 0.05, 'duel': 0.15, 'claim': 0.25, 'send': 0.1}
+BET_SHARE = 0.2 # mean share of their coins players bet or send
+
+
+class Economy:
+    '''Coins and last claim times of the players of many guilds, as arrays'''
+
+    def __init__(
+        self,
+        rules: Rules,
+        guilds: int,
+        players: int,
+        rng: np.random.Generator
+    ) -> None:
+        self.rules = rules
+        self.rng = rng
+        self.coins = np.full((guilds, players), rules.initial_coins, dtype=np.int64)
+        # everyone joined at 0 and can claim an interval later
+        self.last_claimed = np.zeros((guilds, players), dtype=np.int64)
+        self.now = 0 # seconds
+
+    def _amounts(self, coins: np.ndarray) -> np.ndarray:
+        # bets and transfers are a random share of the coins, at least 1
+        share = self.rng.exponential(BET_SHARE, coins.shape).clip(0, 1)
+        return np.maximum(1, (coins * share).astype(np.int64))
+
+    def _gamble(self, players: np.ndarray, yolo: bool) -> None:
+        coins = self.coins.flat[players]
+        bets = coins if yolo else self._amounts(coins)
+        valid = self.rules.valid_bet(bets, coins)
+        won = self.rules.won(self.rng.random(players.size))
+        self.coins.flat[players] = coins + np.where(
+            valid, self.rules.payout(bets, won), 0
+        )
+
+    def _duel(self, players: np.ndarray, guild_of: np.ndarray) -> None:
+        # duelists of a guild are paired up at random; both must afford the bet
+        order = np.lexsort((self.rng.random(players.size), guild_of))
+        players, guild_of = players[order], guild_of[order]
+        # pairs start at even places within the segment of each guild, so an
+        # odd guild leaves one duelist out without shifting the next guild
+        place = np.arange(players.size) - np.searchsorted(guild_of, guild_of)
+        first = np.flatnonzero(place % 2 == 0)
+        first = first[first + 1 < players.size]
+        first = first[guild_of[first] == guild_of[first + 1]]
+        gamblers = players[first]
+        opponents = players[first + 1]
+
+        coins = self.coins.flat[gamblers]
+        opponent_coins = self.coins.flat[opponents]
+        bets = self._amounts(coins)
+        valid = self.rules.valid_bet(bets, coins) \
+            & self.rules.valid_bet(bets, opponent_coins)
+        won = self.rules.won(self.rng.random(gamblers.size))
+        change = np.where(valid, self.rules.payout(bets, won), 0)
+        self.coins.flat[gamblers] = coins + change
+        self.coins.flat[opponents] = opponent_coins - change
+
+    def _claim(self, players: np.ndarray) -> None:
+        elapsed = self.now - self.last_claimed.flat[players]
+        due = players[self.rules.can_claim(elapsed)]
+        draws = self.rng.integers(self.rules.reward_choices, size=due.size)
+        self.coins.flat[due] += self.rules.reward(draws)
+        self.last_claimed.flat[due] = self.now
+
+    def _send(self, players: np.ndarray, guild_of: np.ndarray) -> None:
+        guilds, size = self.coins.shape
+        receivers = guild_of * size + self.rng.integers(size, size=players.size)
+        keep = receivers != players
+        players, receivers = players[keep], receivers[keep]
+
+        coins = self.coins.flat[players]
+        amounts = self._amounts(coins)
+        amounts = np.where(self.rules.valid_send(amounts, coins), amounts, 0)
+        self.coins.flat[players] = coins - amounts
+        # a player may receive from several senders in a round
+        np.add.at(self.coins.reshape(-1), receivers, amounts)
+
+    def round(self) -> None:
+        '''Every active player does one command'''
+        self.now += ROUND_MINUTES * 60
+        guilds, size = self.coins.shape
+        active = np.flatnonzero(self.rng.random(guilds * size) < ACTIVE_CHANCE)
+        actions = self.rng.choice(
+            len(ACTIONS), size=active.size, p=list(ACTIONS.values())
+        )
+        for action, name in enumerate(ACTIONS):
+            players = active[actions == action]
+            if name == 'gamble':
+                self._gamble(players, yolo=False)
+            elif name == 'yolo':
+                self._gamble(players, yolo=True)
+            elif name == 'duel':
+                self._duel(players, players // size)
+            elif name == 'claim':
+                self._claim(players)
+            else:
+                self._send(players, players // size)
+
+
+def gini(coins: np.ndarray) -> np.ndarray:
+    '''Gini coefficient of each row'''
+    ordered = np.sort(coins, axis=1).astype(np.float64)
+    size = ordered.shape[1]
+    ranks = np.arange(1, size + 1)
+    totals = ordered.sum(axis=1)
+    return (2 * (ordered * ranks).sum(axis=1) / (size * totals)) - (size + 1) / size
+
+
+def simulate(rules: Rules, guilds: int, players: int, days: int, seed: int) -> None:
+    economy = Economy(rules, guilds, players, np.random.default_rng(seed))
+    rounds_per_day = 24 * 60 // ROUND_MINUTES
+    supply = economy.coins.sum(axis=1).mean()
+    print(
+        f'{guilds} guilds of {players} players, {rules.initial_coins} initial '
+        f'coins, rewards {rules.min_reward}-{rules.max_reward} every '
+        f'{rules.reward_timer} min'
+    )
+    print(f'{"day":>5} {"supply":>14} {"growth":>8} {"gini":>6} {"bankrupt":>9}')
+
+    start = perf_counter()
+    for day in range(1, days + 1):
+        for _ in range(rounds_per_day):
+            economy.round()
+        coins = economy.coins
+        previous, supply = supply, coins.sum(axis=1).mean()
+        print(
+            f'{day:5} {supply:14.0f} {(supply / previous - 1) * 100:7.2f}% '
+            f'{gini(coins).mean():6.3f} {(coins <= 0).mean() * 100:8.2f}%'
+        )
+    took = perf_counter() - start
+
+    player_rounds = guilds * players * rounds_per_day * days
+    print(
+        f'{player_rounds} player-rounds in {took:.2f} s, '
+        f'{player_rounds / took / 1e6:.1f} M/s'
+    )
+
+
+def main() -> None:
+    defaults = Rules()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--initial-coins', type=int, default=defaults.initial_coins)
+    parser.add_argument('--min-reward', type=int, default=defaults.min_reward)
+    parser.add_argument('--max-reward', type=int, default=defaults.max_reward)
+    parser.add_argument(
+        '--reward-timer', type=int, default=defaults.reward_timer,
+        help='minutes between claims'
+    )
+    args = parser.parse_args()
+
+    rules = Rules(
+        initial_coins=args.initial_coins,
+        min_reward=args.min_reward,
+        max_reward=args.max_reward,
+        reward_timer=args.reward_timer,
+    )
+    simulate(rules, args.guilds, args.players, args.days, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import BinaryIO, Iterable, Optional
+
+from members import MemberTable, claimed_at
+from pairs import PairTable
+
+
+# Binary snapshot of a guild, the <guild_id>.snapshot alternative to the
+# <guild_id>.json score_file. It is loaded with mmap and used in place: the
+# members and pairs are read straight from the file, and a member row is
+# only decoded once it is used. Numbers are in the native byte order, and
+# every section starts at a multiple of 8 bytes.
+#
+#   header      magic, byte order mark, version, guild id, journal seq,
+#               member count n, pair count m, guild name length
+#   guild name  utf-8
+#   members     ids, coins, wins, losses, transfers: int64[n]
+#               ids in ascending order: int64[n], and their rows: int64[n]
+#               display names: int64[n + 1] offsets, utf-8
+#               last claimed, epoch seconds: int64[n]
+#   pairs       first and second member row: int32[m]
+#               first wins, second wins, net sent by first: int64[m]
+#               kind: uint8[m]
+#               adjacency: int64[n + 1] offsets, int64[2m] entries of
+#               (partner row << 32 | pair), in ascending order per member
+#
+# Version 1 kept last claimed as local time strings, int64[n + 1] offsets and
+# utf-8; they are converted when loaded and written as version 2.
+
+MAGIC = b'GAMBLE\x00\x00'
+BYTE_ORDER_MARK = 0x01020304
+VERSION = 2
+HEADER = struct.Struct('=8sIIqqqqq')
+
+
+class MemberRows:
+    '''The member section of a loaded snapshot'''
+
+    def __init__(self, reader: _Reader, count: int, version: int) -> None:
+        self.count = count
+        self.ids = reader.take('q', count)
+        self.coins = reader.take('q', count)
+        self.wins = reader.take('q', count)
+        self.losses = reader.take('q', count)
+        self.transfers = reader.take('q', count)
+        self.sorted_ids = reader.take('q', count)
+        self.sorted_rows = reader.take('q', count)
+        self.name_offsets = reader.take('q', count + 1)
+        self.names = reader.take('B', self.name_offsets[count])
+        if version == 1:
+            offsets = reader.take('q', count + 1)
+            claimed = reader.take('B', offsets[count])
+            self.last_claimed = array('q', (
+                claimed_at(str(claimed[offsets[row]:offsets[row + 1]], 'utf-8'))
+                for row in range(count)
+            ))
+        else:
+            self.last_claimed = reader.take('q', count)
+
+    def find(self, member_id: int) -> int:
+        '''Row of the member, or -1'''
+        pos = bisect_left(self.sorted_ids, member_id)
+        if pos < self.count and self.sorted_ids[pos] == member_id:
+            return self.sorted_rows[pos]
+        return -1
+
+    def display_name(self, row: int) -> str:
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return str(self.names[start:end], 'utf-8')
+
+
+class PairRows:
+    '''The pair section of a loaded snapshot'''
+
+    def __init__(self, reader: _Reader, members: MemberRows, count: int) -> None:
+        self.members = members
+        self.first = reader.take('i', count)
+        self.second = reader.take('i', count)
+        self.first_wins = reader.take('q', count)
+        self.second_wins = reader.take('q', count)
+        self.sent = reader.take('q', count)
+        self.kind = reader.take('B', count)
+        self.offsets = reader.take('q', members.count + 1)
+        self.adjacency = reader.take('q', 2 * count)
+
+
+class _Reader:
+    def __init__(self, view: memoryview, pos: int) -> None:
+        self.view = view
+        self.pos = pos
+
+    def take(self, fmt: str, count: int) -> memoryview:
+        size = count * struct.calcsize(fmt)
+        section = self.view[self.pos:self.pos + size].cast(fmt)
+        self.pos += _padded(size)
+        return section
+
+
+def _padded(size: int) -> int:
+    return -(-size // 8) * 8
+
+
+def load(filename: str) -> Optional[OrderedDict]:
+    '''Maps the snapshot and returns the guild data, or None if there is none'''
+    try:
+        snapshot_file = open(filename, 'rb')
+    except FileNotFoundError:
+        return None
+    with snapshot_file:
+        # a private mapping, changes to the columns never reach the file
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    view = memoryview(mapped)
+    magic, mark, version, guild_id, journal_seq, member_count, pair_count, \
+        name_length = HEADER.unpack_from(view)
+    if magic != MAGIC or mark != BYTE_ORDER_MARK or version not in (1, VERSION):
+        raise ValueError(f'{filename} is not a snapshot of a known version')
+
+    reader = _Reader(view, HEADER.size)
+    guild_name = str(reader.take('B', name_length), 'utf-8')
+    members = MemberRows(reader, member_count, version)
+    pairs = PairRows(reader, members, pair_count)
+
+    data = OrderedDict()
+    data['guild_id'] = guild_id
+    data['guild_name'] = guild_name
+    data['members'] = MemberTable(members)
+    data['journal_seq'] = journal_seq
+    data['pairs'] = PairTable(pairs)
+    return data
+
+
+def _strings(values: Iterable[str]) -> tuple[array, bytes]:
+    offsets = array('q', [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _write(snapshot_file: BinaryIO, section: bytes | array) -> None:
+    section = bytes(section)
+    snapshot_file.write(section)
+    snapshot_file.write(bytes(_padded(len(section)) - len(section)))
+
+
+def dump(data: OrderedDict, snapshot_file: BinaryIO) -> None:
+    '''Writes the guild data as a snapshot'''
+    rows = list(data['members'].rows())
+    ids = array('q', [row[0] for row in rows])
+    row_of = {member_id: row for row, member_id in enumerate(ids)}
+    sorted_rows = array('q', sorted(range(len(ids)), key=ids.__getitem__))
+    sorted_ids = array('q', [ids[row] for row in sorted_rows])
+    name_offsets, names = _strings(row[1] for row in rows)
+    last_claimed = array('q', [row[6] for row in rows])
+
+    first = array('i')
+    second = array('i')
+    first_wins = array('q')
+    second_wins = array('q')
+    sent = array('q')
+    kind = array('B')
+    adjacency: list[list[int]] = [[] for _ in rows]
+    for first_id, second_id, wins, losses, pair_sent, pair_kind \
+            in data['pairs'].rows():
+        i, j = row_of[first_id], row_of[second_id]
+        if i > j:
+            i, j, wins, losses, pair_sent = j, i, losses, wins, -pair_sent
+        pair = len(kind)
+        first.append(i)
+        second.append(j)
+        first_wins.append(wins)
+        second_wins.append(losses)
+        sent.append(pair_sent)
+        kind.append(pair_kind)
+        adjacency[i].append(j << 32 | pair)
+        adjacency[j].append(i << 32 | pair)
+
+    offsets = array('q', [0])
+    entries = array('q')
+    for member_adjacency in adjacency:
+        entries.extend(sorted(member_adjacency))
+        offsets.append(len(entries))
+
+    guild_name = data['guild_name'].encode('utf-8')
+    _write(snapshot_file, HEADER.pack(
+        MAGIC, BYTE_ORDER_MARK, VERSION, data['guild_id'],
+        data.get('journal_seq', 0), len(rows), len(kind), len(guild_name)
+    ))
+    _write(snapshot_file, guild_name)
+    _write(snapshot_file, ids)
+    for field in (2, 3, 4, 5):
+        _write(snapshot_file, array('q', [row[field] for row in rows]))
+    for section in (
+        sorted_ids, sorted_rows, name_offsets, names, last_claimed,
+        first, second, first_wins, second_wins, sent, kind, offsets, entries,
+    ):
+        _write(snapshot_file, section)
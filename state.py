@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Iterable, Optional
+
+import ledger
+from cooldowns import claims
+from const import (
+    PATH,
+    STORAGE_BACKEND,
+    COMPACT_INTERVAL,
+    COMPACT_THRESHOLD,
+    CACHE_BYTES,
+    IDLE_TIMEOUT,
+    IO_WORKERS,
+)
+from errors import DataNotFound
+from leaderboard import Leaderboard
+from locking import locks
+from members import Member, MemberTable
+from metrics import metrics, scope
+from pairs import PairTable
+from rules import rules
+from storage import Storage, open_storage
+
+
+# file reads, writes and (de)serialization never run on the event loop
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+
+
+async def run_io(func: Callable, *args) -> Any:
+    '''Runs a blocking storage call in the io_pool and waits for it'''
+    # in the context of the caller, so the call is timed under its scope
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        io_pool, context.run, func, *args
+    )
+
+
+# estimated memory of a loaded guild, measured with tracemalloc
+MEMBER_BYTES = 300
+LEADERBOARD_BYTES = 250 # per member, once the leaderboard is built
+PAIR_BYTES = 100
+
+# records that add, remove or rename members in the names index
+NAME_OPS = ('join', 'leave', 'return', 'rename')
+
+
+class GuildState:
+    '''
+    Resident data of a single guild, see scorefile for its layout. All changes
+    go through apply() so that each one is persisted by the storage. Only
+    the members who are in the guild are resident: members who leave are
+    archived (see archive), so every member of the data is an active one.
+    '''
+
+    def __init__(self, data: OrderedDict, storage: Storage) -> None:
+        self.data = data
+        self.storage = storage
+        self.dirty = False
+        self.last_used = monotonic()
+        # called when the estimated memory changes, see GuildStore.measure
+        self.on_resize: Optional[Callable[[GuildState], None]] = None
+        self.compacting = asyncio.Lock() # one snapshot of the guild at a time
+        data.setdefault('journal_seq', 0)
+
+        # the indexes are built on first use, which keeps loading cheap
+        self._names: Optional[dict[str, list[int]]] = None
+        self._leaderboard: Optional[Leaderboard] = None
+
+    @property
+    def guild_id(self) -> int:
+        return self.data['guild_id']
+
+    @property
+    def nbytes(self) -> int:
+        '''Estimated memory of the data and of the indexes built so far'''
+        per_member = MEMBER_BYTES
+        if self._leaderboard is not None:
+            per_member += LEADERBOARD_BYTES
+        return len(self.members) * per_member + len(self.pairs) * PAIR_BYTES
+
+    @property
+    def seq(self) -> int:
+        '''seq number of the last persisted transaction'''
+        return self.data['journal_seq']
+
+    @property
+    def members(self) -> MemberTable:
+        return self.data['members']
+
+    @property
+    def pairs(self) -> PairTable:
+        return self.data['pairs']
+
+    @property
+    def names(self) -> dict[str, list[int]]:
+        '''
+        display_name -> ids of the members with that name, in ascending
+        order so that duplicate names always resolve the same way
+        '''
+        if self._names is None:
+            names = {}
+            for member_id, name in self.members.names():
+                insort(names.setdefault(name, []), member_id)
+            self._names = names
+        return self._names
+
+    @property
+    def leaderboard(self) -> Leaderboard:
+        if self._leaderboard is None:
+            self._leaderboard = Leaderboard(self.members)
+            self._resized()
+        return self._leaderboard
+
+    def _resized(self) -> None:
+        if self.on_resize is not None:
+            self.on_resize(self)
+
+    def get_member(self, member_id: int) -> Optional[Member]:
+        return self.data['members'].get(member_id)
+
+    def _index(self, member: Member) -> None:
+        insort(self.names.setdefault(member.display_name, []), member.id)
+
+    def _unindex(self, member: Member) -> None:
+        ids = self.names[member.display_name]
+        del ids[bisect_left(ids, member.id)]
+        if not ids:
+            del self.names[member.display_name]
+
+    def find_member(
+        self,
+        name: str,
+        exclude: Optional[Member] = None
+    ) -> Optional[Member]:
+        '''
+        Returns the member with the display name. If several members share
+        the name, the one with the lowest id wins.
+        '''
+        for member_id in self.names.get(name, ()):
+            if exclude is None or member_id != exclude.id:
+                return self.data['members'][member_id]
+        return None
+
+    def present(self, *members: Member) -> bool:
+        '''
+        Whether the members are still in the guild. Commands resolve their
+        members before locking them, and one may leave in between: check
+        again once the locks are held.
+        '''
+        return all(self.get_member(member.id) is member for member in members)
+
+    def find_members(self, names: Iterable[str]) -> list[Member]:
+        '''Returns all members with any of the names'''
+        found = []
+        for name in dict.fromkeys(names):
+            for member_id in self.names.get(name, ()):
+                found.append(self.data['members'][member_id])
+        return found
+
+    async def apply(self, *records: dict) -> Optional[Future]:
+        '''
+        Applies transaction records in order and persists them. Raises
+        KeyError, before changing anything, for a record of a member who is
+        not in the guild; the records before it are still persisted.
+
+        Returns the group commit of the records, for commands to wait on
+        with durable() once their locks are released and before replying.
+        Events do not wait, what they record is synced from the guild again
+        by the next refresh.
+        '''
+        applied = 0
+        synced = None
+        try:
+            for record in records:
+                self._apply(record)
+                applied += 1
+        finally:
+            if applied:
+                synced = await self._persist(records[:applied])
+        return synced
+
+    def _apply(self, record: dict) -> None:
+        member_ids = ledger.touched(record)
+        if record['op'] not in ('join', 'return'):
+            for member_id in member_ids:
+                if member_id not in self.members:
+                    raise KeyError(member_id)
+
+        # take the members out of the built indexes while they change
+        leaderboard = self._leaderboard
+        names = self._names if record['op'] in NAME_OPS else None
+        for member_id in member_ids:
+            member = self.get_member(member_id)
+            if member is not None:
+                if leaderboard is not None:
+                    leaderboard.remove(member)
+                if names is not None:
+                    self._unindex(member)
+
+        ledger.apply(self.data, record)
+        if record['op'] == 'claim':
+            member = self.get_member(record['member'])
+            claims.claimed(
+                self.guild_id,
+                member.id,
+                member.last_claimed + rules.claim_interval
+            )
+
+        for member_id in member_ids:
+            member = self.get_member(member_id)
+            if member is None:
+                continue # left the guild
+            if leaderboard is not None:
+                leaderboard.add(member)
+            if names is not None:
+                self._index(member)
+
+        self.data['journal_seq'] += 1
+        record['seq'] = self.data['journal_seq']
+
+    async def _persist(self, records: tuple[dict, ...]) -> Optional[Future]:
+        self.dirty = True
+        self._resized() # members and pairs may have been added
+        return await run_io(self.storage.append, self.data, list(records))
+
+
+async def durable(synced: Optional[Future]) -> None:
+    '''
+    Waits for the group commit returned by GuildState.apply, so that a
+    reply is only sent for a durable transaction (see durability). Call it
+    with the member locks released: the next transaction of the members
+    does not have to wait for the fsync of this one.
+    '''
+    if synced is not None:
+        with metrics.timer('sync'):
+            await asyncio.wrap_future(synced)
+
+
+class GuildStore:
+    '''
+    Keeps the data of the guilds in use in memory. Each transaction is
+    persisted on its own through the storage, and the store takes a full
+    snapshot every COMPACT_INTERVAL seconds, once a guild has
+    COMPACT_THRESHOLD transactions since its last snapshot, and on shutdown.
+    All storage work runs in the io_pool threads; snapshots hold the guild
+    lock exclusively so that the data does not change while it is being
+    serialized.
+
+    Loaded guilds are kept in least recently used order. Their memory is
+    estimated from their size (see GuildState.nbytes), measured again after
+    every transaction and once the leaderboard is built. Once the total is
+    over CACHE_BYTES, the least recently used ones are
+    flushed and unloaded, as are the guilds unused for IDLE_TIMEOUT seconds,
+    along with their locks. A guild is only unloaded while no command or
+    event holds or waits for its lock: commands look up the guild and take
+    its lock without a suspension in between, so none can be left with the
+    unloaded state. Hits, misses and evictions are counted in the metrics.
+    '''
+
+    def __init__(
+        self,
+        storage: Storage,
+        budget: int = CACHE_BYTES,
+        idle_timeout: float = IDLE_TIMEOUT
+    ) -> None:
+        self.storage = storage
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        # least recently used first
+        self.guilds: OrderedDict[int, GuildState] = OrderedDict()
+        self.nbytes = 0 # estimated memory of the loaded guilds
+        self._sizes: dict[int, int] = {} # guild id -> its part of nbytes
+        self._loading: dict[int, asyncio.Future] = {}
+        self._compactor: Optional[asyncio.Task] = None
+        self._shrinking: Optional[asyncio.Task] = None
+
+    async def get(self, guild_id: int) -> GuildState:
+        '''Returns the resident guild, loading it on first use'''
+        state = self.guilds.get(guild_id)
+        if state is not None:
+            self.guilds.move_to_end(guild_id)
+            state.last_used = monotonic()
+            metrics.count('cache_hits')
+            return state
+        metrics.count('cache_misses')
+
+        # concurrent commands on a guild that is not loaded yet share one load
+        loading = self._loading.get(guild_id)
+        if loading is None:
+            loading = asyncio.ensure_future(run_io(self.storage.load, guild_id))
+            self._loading[guild_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(guild_id))
+        data = await asyncio.shield(loading)
+
+        if data is None:
+            raise DataNotFound()
+
+        state = self.guilds.get(guild_id)
+        if state is None:
+            state = GuildState(data, self.storage)
+            state.dirty = self.storage.pending(guild_id) > 0
+            self._add(state)
+        return state
+
+    async def create(self, data: OrderedDict) -> GuildState:
+        '''Adds a new guild, which is stored right away'''
+        state = GuildState(data, self.storage)
+        await run_io(self.storage.create, data)
+        self._add(state)
+        return state
+
+    def _add(self, state: GuildState) -> None:
+        self.guilds[state.guild_id] = state
+        state.on_resize = self.measure
+        self.measure(state)
+
+    def measure(self, state: GuildState) -> None:
+        '''
+        Updates the estimated memory of a loaded guild, and starts unloading
+        the least recently used guilds if the total is over the budget
+        '''
+        if self.guilds.get(state.guild_id) is not state:
+            return # unloaded
+        self._resize(state.guild_id, state.nbytes)
+        if self.nbytes > self.budget and \
+                (self._shrinking is None or self._shrinking.done()):
+            self._shrinking = asyncio.create_task(self._shrink())
+
+    def _resize(self, guild_id: int, size: int) -> None:
+        self.nbytes += size - self._sizes.get(guild_id, 0)
+        if size:
+            self._sizes[guild_id] = size
+        else:
+            self._sizes.pop(guild_id, None)
+        metrics.gauge('cache_bytes', self.nbytes)
+        metrics.gauge('cache_guilds', len(self.guilds))
+
+    async def evict(self, guild_id: int) -> bool:
+        '''
+        Flushes the guild and unloads it, unless a command or event holds
+        or waits for it. Returns whether it was unloaded.
+        '''
+        state = self.guilds.get(guild_id)
+        lock = locks.get(guild_id)
+        if state is None or (lock is not None and not lock.idle):
+            return False
+        if state.dirty:
+            await self.compact(state)
+
+        # commands may have come in during the snapshot, and no suspension
+        # is allowed between this check and the unloading
+        lock = locks.get(guild_id)
+        if self.guilds.get(guild_id) is not state or state.dirty or \
+                (lock is not None and not lock.idle):
+            return False
+        del self.guilds[guild_id]
+        self._resize(guild_id, 0)
+        self.storage.release(guild_id)
+        locks.discard(guild_id)
+        claims.discard(guild_id)
+        metrics.count('cache_evictions')
+        return True
+
+    async def _shrink(self) -> None:
+        '''Unloads the least recently used guilds until the rest fit the budget'''
+        for guild_id in list(self.guilds):
+            if self.nbytes <= self.budget:
+                break
+            await self.evict(guild_id)
+
+    async def evict_idle(self) -> None:
+        '''Unloads the guilds unused for idle_timeout seconds'''
+        now = monotonic()
+        for guild_id, state in list(self.guilds.items()):
+            if now - state.last_used < self.idle_timeout:
+                break # the rest were used later
+            await self.evict(guild_id)
+
+    async def compact(self, state: GuildState) -> None:
+        '''
+        Takes a full snapshot of the guild. The guild is only locked while
+        its data is copied, commands go on while the copy is encoded and
+        written out.
+        '''
+        with scope(state.guild_id, 'compact'):
+            async with state.compacting:
+                async with locks[state.guild_id].write():
+                    copied = await run_io(self.storage.snapshot, state.data)
+                    state.dirty = False
+                try:
+                    await run_io(
+                        self.storage.store_snapshot, state.guild_id, copied
+                    )
+                except BaseException:
+                    state.dirty = True # the journal still has the records
+                    raise
+
+    async def flush(self) -> None:
+        '''Compacts all guilds with transactions since their last snapshot'''
+        for state in list(self.guilds.values()):
+            if state.dirty:
+                await self.compact(state)
+
+    async def compact_oversized(self) -> None:
+        for state in list(self.guilds.values()):
+            if self.storage.pending(state.guild_id) >= COMPACT_THRESHOLD:
+                await self.compact(state)
+
+    async def _compact_loop(self, interval: float) -> None:
+        elapsed = 0.0
+        tick = min(interval, 1.0)
+        while True:
+            await asyncio.sleep(tick)
+            elapsed += tick
+            if elapsed >= interval:
+                await self.flush()
+                await self.evict_idle()
+                elapsed = 0.0
+            else:
+                await self.compact_oversized()
+
+    def start(self, interval: float = COMPACT_INTERVAL) -> None:
+        '''Starts the periodic compaction and eviction, if not yet running'''
+        if self._compactor is None or self._compactor.done():
+            self._compactor = asyncio.create_task(self._compact_loop(interval))
+
+    async def close(self) -> None:
+        '''Stops the periodic compaction and snapshots every changed guild'''
+        if self._compactor is not None:
+            self._compactor.cancel()
+            self._compactor = None
+        await self.flush()
+        await run_io(self.storage.close)
+
+
+store = GuildStore(open_storage(STORAGE_BACKEND, PATH))
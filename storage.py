@@ -0,0 +1,648 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Optional
+
+import ledger
+import scorefile
+import snapshot
+from archive import Archive, archived_member, pair_key
+from durability import fsync_dir, group_commit
+from journal import Journal
+from metrics import metrics
+from members import claimed_at
+
+if TYPE_CHECKING:
+    from members import Member
+
+
+class Storage(ABC):
+    '''
+    Persistent storage of guild data. The GuildStore keeps the data in
+    memory (see scorefile) and goes through a Storage to load a
+    guild, persist each applied transaction, and take full snapshots.
+    Storage methods are blocking and are called from the io_pool threads.
+
+    A snapshot is taken in two steps: snapshot() copies the data while the
+    guild is locked, and store_snapshot() encodes and writes out the copy
+    once the lock is released, keeping the transactions persisted in
+    between.
+    '''
+
+    @abstractmethod
+    def load(self, guild_id: int) -> Optional[OrderedDict]:
+        '''Returns the latest data of the guild, or None if there is none'''
+
+    @abstractmethod
+    def create(self, data: OrderedDict) -> None:
+        '''Stores the data of a new guild'''
+
+    @abstractmethod
+    def append(self, data: OrderedDict, records: list[dict]) -> Optional[Future]:
+        '''
+        Persists transaction records that were just applied to data. Returns
+        the future of their group commit, if the caller should wait for it.
+        '''
+
+    def snapshot(self, data: OrderedDict) -> Optional[OrderedDict]:
+        '''Copies the guild data for a snapshot, call with the guild locked'''
+        return None
+
+    def store_snapshot(self, guild_id: int, copied: Optional[OrderedDict]) -> None:
+        '''Stores the copied data as a full snapshot, without the guild lock'''
+
+    def compact(self, data: OrderedDict) -> None:
+        '''Stores a full snapshot of the guild'''
+        self.store_snapshot(data['guild_id'], self.snapshot(data))
+
+    @abstractmethod
+    def archived(self, guild_id: int, member_id: int) -> Optional[dict]:
+        '''
+        The archive of a member who left the guild (see archive), or None
+        if the member never left
+        '''
+
+    def pending(self, guild_id: int) -> int:
+        '''Number of transactions persisted since the last snapshot'''
+        return 0
+
+    def release(self, guild_id: int) -> None:
+        '''Drops what is kept open for a guild that was unloaded and flushed'''
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    '''
+    The <guild_id>.json score_file as snapshot, plus an append-only
+    <guild_id>.journal of the transactions made since that snapshot.
+    Snapshots are written aside, fsynced and renamed over the old one, so a
+    crash leaves either snapshot whole; journal writes are group committed.
+    Members who left are in a <guild_id>.archive log.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.journals: dict[int, Journal] = {}
+        self.archives: dict[int, Archive] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, guild_id: int) -> str:
+        return f'{self.path}{guild_id}.json'
+
+    def _read_snapshot(self, guild_id: int) -> Optional[OrderedDict]:
+        try:
+            with open(self._file(guild_id)) as score_file:
+                data = json.load(score_file, object_pairs_hook=OrderedDict)
+        except FileNotFoundError:
+            return None
+        return scorefile.decode(data)
+
+    def _encode(self, data: OrderedDict) -> bytes:
+        return json.dumps(scorefile.encode(data), indent=4).encode()
+
+    def _journal(self, guild_id: int) -> Journal:
+        with self._lock:
+            journal = self.journals.get(guild_id)
+            if journal is None:
+                journal = Journal(f'{self.path}{guild_id}.journal')
+                self.journals[guild_id] = journal
+            return journal
+
+    def _archive(self, guild_id: int) -> Archive:
+        with self._lock:
+            archive = self.archives.get(guild_id)
+            if archive is None:
+                archive = Archive(f'{self.path}{guild_id}.archive')
+                self.archives[guild_id] = archive
+            return archive
+
+    def load(self, guild_id: int) -> Optional[OrderedDict]:
+        with metrics.timer('storage_read'):
+            return self._load(guild_id)
+
+    def _load(self, guild_id: int) -> Optional[OrderedDict]:
+        data = self._read_snapshot(guild_id)
+        if data is None:
+            return None
+
+        seq = data.get('journal_seq', 0)
+        for record in self._journal(guild_id).replay(after=seq):
+            ledger.apply(data, record)
+            seq = max(seq, record['seq'])
+        data['journal_seq'] = seq
+        return data
+
+    def create(self, data: OrderedDict) -> None:
+        self._journal(data['guild_id']).truncate()
+        self.compact(data)
+
+    def append(self, data: OrderedDict, records: list[dict]) -> Optional[Future]:
+        # archived before the journal has the leave, so a member is never lost
+        archived = [
+            record for record in records if record['op'] in ('leave', 'return')
+        ]
+        if archived:
+            self._archive(data['guild_id']).append(archived)
+        return self._journal(data['guild_id']).append(records)
+
+    def snapshot(self, data: OrderedDict) -> OrderedDict:
+        # the records so far are all in the copy, later ones stay journaled
+        self._journal(data['guild_id']).rotate()
+        return ledger.copy_guild(data)
+
+    def store_snapshot(self, guild_id: int, copied: OrderedDict) -> None:
+        with metrics.timer('serialize'):
+            encoded = self._encode(copied)
+        filename = self._file(guild_id)
+        with metrics.timer('write'), open(f'{filename}.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(encoded)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(f'{filename}.tmp', filename)
+        # the rename must be durable before the rotated journal is removed
+        fsync_dir(self.path)
+        self._journal(guild_id).drop_rotated()
+
+    def archived(self, guild_id: int, member_id: int) -> Optional[dict]:
+        with metrics.timer('storage_read'):
+            return self._archive(guild_id).find(member_id)
+
+    def release(self, guild_id: int) -> None:
+        # flushed, so the journal is empty and closed already
+        with self._lock:
+            journal = self.journals.pop(guild_id, None)
+            self.archives.pop(guild_id, None)
+        if journal is not None:
+            journal.close()
+
+    def pending(self, guild_id: int) -> int:
+        return self._journal(guild_id).pending
+
+    def close(self) -> None:
+        for journal in self.journals.values():
+            journal.close()
+
+
+class BinaryStorage(JsonStorage):
+    '''
+    Same as JsonStorage, with a binary <guild_id>.snapshot (see snapshot) in
+    place of the score_file. Loading maps the snapshot instead of parsing it.
+    '''
+
+    def _file(self, guild_id: int) -> str:
+        return f'{self.path}{guild_id}.snapshot'
+
+    def _read_snapshot(self, guild_id: int) -> Optional[OrderedDict]:
+        return snapshot.load(self._file(guild_id))
+
+    def _encode(self, data: OrderedDict) -> bytes:
+        buffer = io.BytesIO()
+        snapshot.dump(data, buffer)
+        return buffer.getvalue()
+
+
+class SqliteStorage(Storage):
+    '''
+    A single SQLite database with members and pairs as indexed tables, with
+    one row per pair of members as in the PairTable. Each transaction only
+    rewrites the rows of the members (and the pair) it involves. Members who
+    left, and their pairs, are moved to the archived_ tables. As every
+    transaction is already in the tables, snapshots have nothing to do.
+    '''
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS guilds (
+            guild_id INTEGER PRIMARY KEY,
+            guild_name TEXT NOT NULL,
+            journal_seq INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            guild_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            display_name TEXT NOT NULL,
+            coins INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            transfers INTEGER NOT NULL,
+            last_claimed INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, member_id)
+        );
+        CREATE INDEX IF NOT EXISTS members_name
+            ON members (guild_id, display_name);
+        CREATE TABLE IF NOT EXISTS pairs (
+            guild_id INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            second_id INTEGER NOT NULL,
+            first_wins INTEGER NOT NULL,
+            second_wins INTEGER NOT NULL,
+            sent INTEGER NOT NULL,
+            kind INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, first_id, second_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS archived_members (
+            guild_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            display_name TEXT NOT NULL,
+            coins INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            transfers INTEGER NOT NULL,
+            last_claimed INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, member_id)
+        );
+        CREATE TABLE IF NOT EXISTS archived_pairs (
+            guild_id INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            second_id INTEGER NOT NULL,
+            first_wins INTEGER NOT NULL,
+            second_wins INTEGER NOT NULL,
+            sent INTEGER NOT NULL,
+            kind INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, first_id, second_id)
+        ) WITHOUT ROWID;
+    '''
+
+    # older databases kept every pair twice, once per member, in a scores
+    # and a transfers table
+    MIGRATE = '''
+        INSERT OR REPLACE INTO pairs
+        SELECT guild_id, member_id, other_id,
+            SUM(wins), SUM(losses), SUM(sent), SUM(kind)
+        FROM (
+            SELECT guild_id, member_id, other_id, IFNULL(wins, 0) AS wins,
+                IFNULL(losses, 0) AS losses, 0 AS sent, 1 AS kind
+            FROM scores WHERE member_id < other_id
+            UNION ALL
+            SELECT guild_id, member_id, other_id, 0, 0, amount, 2
+            FROM transfers WHERE member_id < other_id
+        )
+        GROUP BY guild_id, member_id, other_id;
+        DROP TABLE scores;
+        DROP TABLE transfers;
+    '''
+
+    def __init__(self, filename: str) -> None:
+        # the connection is shared by the io_pool threads, one at a time
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        tables = {
+            name for name, in self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        if 'scores' in tables:
+            self.db.executescript(f'BEGIN; {self.MIGRATE} COMMIT;')
+        columns = {
+            name: column_type for _, name, column_type, *_ in self.db.execute(
+                'PRAGMA table_info(members)'
+            )
+        }
+        if columns['last_claimed'] == 'TEXT':
+            self._migrate_claimed()
+
+    def _migrate_claimed(self) -> None:
+        # last_claimed used to be a local time string in a TEXT column, and
+        # SQLite cannot change the type of a column in place
+        rows = self.db.execute('SELECT * FROM members ORDER BY rowid').fetchall()
+        self.db.execute('BEGIN')
+        self.db.execute('ALTER TABLE members RENAME TO members_text')
+        self.db.execute('DROP INDEX members_name')
+        for statement in self.SCHEMA.split(';'):
+            self.db.execute(statement)
+        self.db.executemany(
+            'INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(*row[:7], claimed_at(row[7])) for row in rows]
+        )
+        self.db.execute('DROP TABLE members_text')
+        self.db.commit()
+
+    def load(self, guild_id: int) -> Optional[OrderedDict]:
+        with self._lock, metrics.timer('storage_read'):
+            return self._load(guild_id)
+
+    def _load(self, guild_id: int) -> Optional[OrderedDict]:
+        row = self.db.execute(
+            'SELECT guild_name, journal_seq FROM guilds WHERE guild_id = ?',
+            (guild_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        data = ledger.new_guild(guild_id, row[0])
+        data['journal_seq'] = row[1]
+
+        members = self.db.execute(
+            'SELECT member_id, display_name, coins, wins, losses, transfers, '
+            'last_claimed FROM members WHERE guild_id = ? ORDER BY rowid',
+            (guild_id,)
+        )
+        for member in members:
+            data['members'].add(*member)
+
+        pairs = self.db.execute(
+            'SELECT first_id, second_id, first_wins, second_wins, sent, kind '
+            'FROM pairs WHERE guild_id = ?',
+            (guild_id,)
+        )
+        for pair in pairs:
+            data['pairs'].set(*pair)
+
+        return data
+
+    def _write_guild(self, data: OrderedDict) -> None:
+        self.db.execute(
+            'INSERT INTO guilds (guild_id, guild_name, journal_seq) '
+            'VALUES (?, ?, ?) ON CONFLICT (guild_id) DO UPDATE SET '
+            'guild_name = excluded.guild_name, '
+            'journal_seq = excluded.journal_seq',
+            (data['guild_id'], data['guild_name'], data.get('journal_seq', 0))
+        )
+
+    def _write_member(self, guild_id: int, member: Member) -> None:
+        self.db.execute(
+            'INSERT INTO members (guild_id, member_id, display_name, coins, '
+            'wins, losses, transfers, last_claimed) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (guild_id, member_id) DO UPDATE SET '
+            'display_name = excluded.display_name, coins = excluded.coins, '
+            'wins = excluded.wins, losses = excluded.losses, '
+            'transfers = excluded.transfers, '
+            'last_claimed = excluded.last_claimed',
+            (
+                guild_id, member.id, member.display_name, member.coins,
+                member.wins, member.losses, member.transfers,
+                member.last_claimed,
+            )
+        )
+
+    def _write_pair(self, guild_id: int, pair: tuple[int, ...]) -> None:
+        # each pair is stored once, with the lower member id first
+        first, second, wins, losses, sent, kind = pair
+        if first > second:
+            first, second, wins, losses, sent = second, first, losses, wins, -sent
+        self.db.execute(
+            'INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (guild_id, first, second, wins, losses, sent, kind)
+        )
+
+    def create(self, data: OrderedDict) -> None:
+        with self._lock, metrics.timer('write'), self.db:
+            for table in ('guilds', 'members', 'pairs'):
+                self.db.execute(
+                    f'DELETE FROM {table} WHERE guild_id = ?',
+                    (data['guild_id'],)
+                )
+            self._write_guild(data)
+            for member in data['members']:
+                self._write_member(data['guild_id'], member)
+            for pair in data['pairs'].rows():
+                self._write_pair(data['guild_id'], pair)
+
+    def append(self, data: OrderedDict, records: list[dict]) -> Optional[Future]:
+        guild_id = data['guild_id']
+        member_ids = set()
+        pairs = set()
+        for record in records:
+            member_ids.update(ledger.touched(record))
+            pairs.update(ledger.touched_pairs(record))
+
+        with self._lock, metrics.timer('write'), self.db:
+            self._write_guild(data)
+            for record in records:
+                if record['op'] in ('leave', 'return'):
+                    self._write_archive(guild_id, record)
+            for member_id in member_ids:
+                member = data['members'].get(member_id)
+                if member is not None: # else archived
+                    self._write_member(guild_id, member)
+            for first, second in pairs:
+                pair = data['pairs'].get(first, second)
+                if pair is not None:
+                    self._write_pair(guild_id, (first, second, *pair))
+        return group_commit.add(self)
+
+    def sync(self) -> None:
+        # with synchronous=NORMAL a commit only reaches the WAL file, which
+        # SQLite fsyncs at checkpoints; this makes the commits durable sooner
+        try:
+            fd = os.open(f'{self.filename}-wal', os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_archive(self, guild_id: int, record: dict) -> None:
+        member_id = record['member']
+        keys = []
+        for pair in record['pairs']:
+            (first, second), values = pair_key(member_id, pair)
+            keys.append((guild_id, first, second))
+            if record['op'] == 'leave':
+                self.db.execute(
+                    'INSERT OR REPLACE INTO archived_pairs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (guild_id, first, second, *values)
+                )
+        if record['op'] == 'leave':
+            self.db.execute(
+                'INSERT OR REPLACE INTO archived_members VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (guild_id, member_id, *record['fields'])
+            )
+            self.db.execute(
+                'DELETE FROM members WHERE guild_id = ? AND member_id = ?',
+                (guild_id, member_id)
+            )
+            self.db.executemany(
+                'DELETE FROM pairs WHERE guild_id = ? AND first_id = ? AND second_id = ?',
+                keys
+            )
+        else:
+            self.db.execute(
+                'DELETE FROM archived_members WHERE guild_id = ? AND member_id = ?',
+                (guild_id, member_id)
+            )
+            self.db.executemany(
+                'DELETE FROM archived_pairs '
+                'WHERE guild_id = ? AND first_id = ? AND second_id = ?',
+                keys
+            )
+
+    def archived(self, guild_id: int, member_id: int) -> Optional[dict]:
+        with self._lock, metrics.timer('storage_read'):
+            row = self.db.execute(
+                'SELECT display_name, coins, wins, losses, transfers, last_claimed '
+                'FROM archived_members WHERE guild_id = ? AND member_id = ?',
+                (guild_id, member_id)
+            ).fetchone()
+            if row is None:
+                return None
+            pairs = {
+                (first, second): list(values)
+                for first, second, *values in self.db.execute(
+                    'SELECT first_id, second_id, first_wins, second_wins, sent, kind '
+                    'FROM archived_pairs '
+                    'WHERE guild_id = ? AND (first_id = ? OR second_id = ?)',
+                    (guild_id, member_id, member_id)
+                )
+            }
+        return archived_member(member_id, list(row), pairs)
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.close()
+
+
+SHARD_DIR = re.compile(r'shard\d+') # PATH/shard<id>/
+GUILD_FILE = re.compile(r'(\d+)\.(json|snapshot|journal|journal\.old|archive)')
+SQLITE_FILE = 'gamble.sqlite3'
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    '''The shard Discord delivers the events of the guild to'''
+    return (guild_id >> 22) % shard_count
+
+
+def guild_path(path: str, guild_id: int, shard_count: int) -> str:
+    '''Directory of the guild data for the shard count, PATH when unsharded'''
+    if shard_count == 1:
+        return path
+    return f'{path}shard{shard_of(guild_id, shard_count)}/'
+
+
+def stored_guilds(backend: str, path: str) -> list[tuple[int, str]]:
+    '''
+    (guild id, directory) of every guild stored under path, whether in
+    path itself or in any shard directory, whatever the shard count
+    '''
+    if not os.path.isdir(path):
+        return []
+    directories = [path] + [
+        f'{path}{name}/' for name in sorted(os.listdir(path))
+        if SHARD_DIR.fullmatch(name) and os.path.isdir(f'{path}{name}')
+    ]
+    found = []
+    for directory in directories:
+        if backend == 'sqlite':
+            if not os.path.exists(f'{directory}{SQLITE_FILE}'):
+                continue
+            db = sqlite3.connect(f'{directory}{SQLITE_FILE}')
+            try:
+                rows = db.execute('SELECT guild_id FROM guilds').fetchall()
+            except sqlite3.OperationalError:
+                rows = [] # an empty database
+            finally:
+                db.close()
+            found += [(guild_id, directory) for guild_id, in rows]
+        else:
+            ids = set()
+            for name in os.listdir(directory):
+                match = GUILD_FILE.fullmatch(name)
+                if match:
+                    ids.add(int(match[1]))
+            found += [(guild_id, directory) for guild_id in sorted(ids)]
+    return found
+
+
+class ShardedStorage(Storage):
+    '''
+    The storage of the guilds of some shards, for a worker process of
+    launcher.py: every shard has a storage of its own under PATH/shard<id>/,
+    so workers that own disjoint shards never share a file or a database,
+    and a shard keeps its data when it moves to another worker. A guild
+    always maps to the same shard for a given SHARD_COUNT. Guilds stored
+    elsewhere, unsharded in PATH or for another count, would look missing
+    and be created anew, so the storage refuses to open until reshard.py
+    has moved them (launcher.py runs it before starting the workers).
+    '''
+
+    def __init__(
+        self,
+        backend: str,
+        path: str,
+        shard_ids: list[int],
+        shard_count: int
+    ) -> None:
+        misplaced = [
+            guild_id for guild_id, directory in stored_guilds(backend, path)
+            if directory != guild_path(path, guild_id, shard_count)
+        ]
+        if misplaced:
+            raise RuntimeError(
+                f'{len(misplaced)} guilds in {path} are not in their shard '
+                f'directory for {shard_count} shards, run '
+                f'python reshard.py {shard_count} first'
+            )
+
+        self.shard_count = shard_count
+        self.shards: dict[int, Storage] = {}
+        for shard_id in shard_ids:
+            shard_path = f'{path}shard{shard_id}/'
+            os.makedirs(shard_path, exist_ok=True)
+            self.shards[shard_id] = open_storage(backend, shard_path)
+
+    def _storage(self, guild_id: int) -> Storage:
+        return self.shards[shard_of(guild_id, self.shard_count)]
+
+    def load(self, guild_id: int) -> Optional[OrderedDict]:
+        return self._storage(guild_id).load(guild_id)
+
+    def create(self, data: OrderedDict) -> None:
+        self._storage(data['guild_id']).create(data)
+
+    def append(self, data: OrderedDict, records: list[dict]) -> Optional[Future]:
+        return self._storage(data['guild_id']).append(data, records)
+
+    def snapshot(self, data: OrderedDict) -> Optional[OrderedDict]:
+        return self._storage(data['guild_id']).snapshot(data)
+
+    def store_snapshot(self, guild_id: int, copied: Optional[OrderedDict]) -> None:
+        self._storage(guild_id).store_snapshot(guild_id, copied)
+
+    def archived(self, guild_id: int, member_id: int) -> Optional[dict]:
+        return self._storage(guild_id).archived(guild_id, member_id)
+
+    def release(self, guild_id: int) -> None:
+        self._storage(guild_id).release(guild_id)
+
+    def pending(self, guild_id: int) -> int:
+        return self._storage(guild_id).pending(guild_id)
+
+    def close(self) -> None:
+        for storage in self.shards.values():
+            storage.close()
+
+
+def open_storage(
+    backend: str,
+    path: str,
+    shard_ids: Optional[list[int]] = None,
+    shard_count: int = 1
+) -> Storage:
+    '''
+    Returns the Storage for the STORAGE_BACKEND setting, partitioned by
+    shard when only some of the shard_count shards are given
+    '''
+    if shard_ids is not None and shard_count > 1:
+        return ShardedStorage(backend, path, shard_ids, shard_count)
+    if backend == 'json':
+        return JsonStorage(path)
+    if backend == 'binary':
+        return BinaryStorage(path)
+    if backend == 'sqlite':
+        return SqliteStorage(f'{path}{SQLITE_FILE}')
+    raise ValueError(f'Unknown storage backend: {backend}')